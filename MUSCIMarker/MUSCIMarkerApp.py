@@ -206,7 +206,11 @@ import copy
 import logging
 import os
 import pprint
+import threading
 import time
+import traceback
+import uuid
+import zlib
 
 import pickle
 import datetime
@@ -233,6 +237,9 @@ from MUSCIMarker.rendering import CropObjectRenderer
 from MUSCIMarker.utils import FileNameLoader, ImageToModelScaler, ConfirmationDialog, keypress_to_dispatch_key, \
     MessageDialog, OnBindFileSaver, compute_connected_components, filename2docname
 from MUSCIMarker.annotator_model import CropObjectAnnotatorModel
+from MUSCIMarker.edit_journal import EditJournal
+from MUSCIMarker.muscimarker_io import load_cropobject_list_binary, binary_sidecar_filename, \
+    unpack_cropobject_mask
 import MUSCIMarker.toolkit
 import MUSCIMarker.tracker as tr
 
@@ -523,6 +530,22 @@ class MUSCIMarkerApp(App):
     ##########################################################################
     # App build & config methods
 
+    def __init__(self, **kwargs):
+        super(MUSCIMarkerApp, self).__init__(**kwargs)
+
+        # Crash recovery state. These are plain attributes, not Kivy
+        # properties: the checkpoint thread sets _checkpoint_failed,
+        # and property events must only be dispatched in the main thread.
+        #  - The edits since the last checkpoint of the app state
+        self._edit_journal = None
+        #  - The loaded files at the time of the last checkpoint
+        self._checkpoint_filenames = None
+        #  - The image is saved next to the checkpoint, only when it changes.
+        self._checkpoint_image_revision = -1
+        self._checkpoint_image_filename = None
+        self._checkpoint_thread = None
+        self._checkpoint_failed = False
+
     def build(self):
 
         self.init_tracking()
@@ -595,8 +618,10 @@ class MUSCIMarkerApp(App):
         self.cropobject_list_saver.last_output_path = saver_output_path
         self.cropobject_list_saver.bind(filename=lambda *args, **kwargs: self.annot_model.export_cropobjects(
             self.cropobject_list_saver.filename,
+            background=True,
             docname=filename2docname(self.cropobject_list_saver.filename),
             dataset_name=self.cropobject_current_dataset_namespace))
+        self.annot_model.bind(on_export_failed=self._on_export_failed)
 
         logging.info('Build: started loading grammar from config')
         _grammar_abspath = os.path.abspath(conf.get('default_input_files',
@@ -627,11 +652,19 @@ class MUSCIMarkerApp(App):
         logging.info('App: main area children: {0}'.format(main_area.children))
 
         # Attempt recovery
+        is_recovered = False
         attempt_recovery = conf.get('recovery', 'attempt_recovery_on_build')
         if attempt_recovery is True:
             logging.info('App.build: Requested an attempt to recover last application'
                          ' state at build time.')
-            self.do_recovery()
+            is_recovered = self.do_recovery()
+
+        # From now on, edits go into the journal on top of a fresh checkpoint
+        # (a journal left over from before the recovery must not be
+        # appended to). A successful recovery has just written one.
+        if not is_recovered:
+            self._save_app_state(checkpoint=True)
+        self.annot_model.journal = self._get_edit_journal()
 
         recovery_dump_freq = int(conf.get('recovery', 'recovery_dump_frequency_seconds'))
         if (recovery_dump_freq is not None) and (recovery_dump_freq != 0):
@@ -697,6 +730,7 @@ class MUSCIMarkerApp(App):
                 'attempt_recovery_on_build': True,
                 'attempt_recovery_dump_on_exit': True,
                 'recovery_dump_frequency_seconds': 5,
+                'recovery_checkpoint_every_n_edits': 1000,
             })
         config.setdefaults('toolkit',
             {
@@ -713,12 +747,23 @@ class MUSCIMarkerApp(App):
                                      'sharp,flat,natural,stem,beam,duration-dot,' + \
                                      'thin_barline,g-clef,f-clef,c-clef',
                 'detection_use_current_class': True,
+                'memmap_cc_labels': True,
+                # If set, the connected component labels of the image are
+                # kept in a memory-mapped file in the tmp dir. The label
+                # image is as large as the page, so this is the default.
             })
         config.setdefaults('tracking',
             {
                 'tracking_root_dir': self._get_default_tracking_root_dir(),
             })
         config.setdefaults('interface', {'center_on_resize': False})
+        config.setdefaults('io',
+            {
+                'binary_sidecar': False,
+                # If set, CropObjectLists are also cached in a binary file
+                # next to the XML file, which is much faster to reload.
+                # Off by default: it writes next to the user's data.
+            })
         config.setdefaults('automation',
             {
                 'sparse_cropobject_threshold': 0.1,
@@ -792,6 +837,10 @@ class MUSCIMarkerApp(App):
     # Functions for recovering work from crashes, inadvertent shutdowns, etc.
     # Don't call these directly!
 
+    # The recovery file is a checkpoint of the app state. The edits made
+    # since then are kept in an EditJournal next to it, so that a new
+    # checkpoint only needs to be written once in a while.
+
     # TODO: refactor recovery as a separate class.
     def _get_recovery_path(self):
         conf = self.config
@@ -800,6 +849,31 @@ class MUSCIMarkerApp(App):
         recovery_path = os.path.join(recovery_dir, recovery_fname)
         return recovery_path
 
+    def _get_edit_journal(self):
+        recovery_path = self._get_recovery_path()
+        if (self._edit_journal is None) \
+                or (self._edit_journal.checkpoint_path != recovery_path):
+            if self._edit_journal is not None:
+                self._edit_journal.close()
+            self._edit_journal = EditJournal(recovery_path)
+        return self._edit_journal
+
+    def _get_checkpoint_filenames(self):
+        return (self.image_loader.filename,
+                self.mlclass_list_loader.filename,
+                self.cropobject_list_loader.filename)
+
+    def _needs_checkpoint(self):
+        journal = self._get_edit_journal()
+        if self._checkpoint_failed:
+            return True
+        if self._checkpoint_filenames != self._get_checkpoint_filenames():
+            # Loading files is not journaled.
+            return True
+        checkpoint_every = int(self.config.get('recovery',
+                                               'recovery_checkpoint_every_n_edits'))
+        return journal.n_records >= checkpoint_every
+
     def _get_app_state(self):
         self.annot_model.ensure_consistent()
         state = {
@@ -817,11 +891,16 @@ class MUSCIMarkerApp(App):
             # The cropobjects member of annot_model is a kivy Property,
             # so it fails on pickle -- we must get the data itself
             # by different means.
-            'cropobjects': list(self.annot_model.cropobjects.values()),
+            # The checkpoint is written in the background, so it needs
+            # a copy that further edits will not change.
+            # The masks are packed into bits, to keep the checkpoint small.
+            'cropobjects': self.annot_model._snapshot_cropobjects(pack_masks=True),
             # We also want to save the state of the image, as it may have been
             # manually binarized and we do not want to lose that work.
-            'image_state': self.annot_model.image.tostring(),
+            # It is saved into a separate file (see _save_app_state()).
+            'image_state_filename': None,
             'image_shape': self.annot_model.image.shape,
+            'image_dtype': self.annot_model.image.dtype.str,
         }
         return state
 
@@ -834,12 +913,13 @@ class MUSCIMarkerApp(App):
         reverting, it will kill the application, though, because that means
         it was in an inconsistent state before recovery even started."""
         logging.info('App._build_from_state: starting')
-        cropobjects = state['cropobjects']
+        # Checkpoints from older versions do not have packed masks,
+        # unpacking leaves them as they are.
+        cropobjects = [unpack_cropobject_mask(c) for c in state['cropobjects']]
         logging.info('Cropobjects {0}'.format(cropobjects))
         mlclass_list_filename = state['mlclass_list_filename']
         image_filename = state['image_filename']
         cropobject_list_filename = state['cropobject_list_filename']
-        image_state_string = state['image_state']
 
         fail = False
         if not os.path.isfile(mlclass_list_filename):
@@ -929,10 +1009,9 @@ class MUSCIMarkerApp(App):
 
         # Finally, load the saved state of the image.
         try:
-            image_state = numpy.fromstring(image_state_string, dtype='uint8')
-            image_shape = state['image_shape']
-            image_data = numpy.reshape(image_state, image_shape)
-            self.update_image(image_data)
+            image_data = self._load_image_state(state)
+            # The components are precomputed once the journal is replayed.
+            self.update_image(image_data, precompute=False)
         except:
             logging.warn('App._build_from_app_state: Loading image state'
                          ' failed, falling back on image file.')
@@ -941,47 +1020,142 @@ class MUSCIMarkerApp(App):
 
         logging.info('App._build_from_state: Finished successfully.')
 
-    def _save_app_state(self):
-        recovery_path = self._get_recovery_path()
-        logging.debug('App.recover: Saving recovery file {0}'.format(recovery_path))
+    def _save_app_state(self, checkpoint=False, background=False):
+        """Makes sure the current state can be recovered. The edits are
+        already in the journal, so the full state is only written (as
+        a new checkpoint) if ``checkpoint`` is set, if the loaded files
+        changed, or if the journal has grown too long.
+
+        :param background: If set, the checkpoint is written in a separate
+            thread from a snapshot of the state, so that the editor does not
+            wait for it. If the previous background checkpoint is still
+            being written, nothing is done.
+        """
+        if not (checkpoint or self._needs_checkpoint()):
+            return
+        if background and self._is_checkpoint_running():
+            logging.debug('App.save_app_state: Previous checkpoint still running.')
+            return
+        self.wait_for_checkpoint()
 
+        journal = self._get_edit_journal()
+        logging.debug('App.save_app_state: Saving recovery file {0}'
+                      ''.format(journal.checkpoint_path))
         state = self._get_app_state()
 
-        # Cautious behavior: let's try not to destroy the previous
-        # backup until we are sure the backup has been made correctly.
-        rec_temp_name = recovery_path + '.temp'
-        logging.debug('App.save_app_state: Saving to recovery file {0}'
-                      ''.format(recovery_path))
+        # The image is large: only write it when it changed since
+        # the last checkpoint. Each version goes into a new file, so that
+        # the last checkpoint's image stays there until the new checkpoint
+        # has been written.
+        image = None
+        image_revision = self.annot_model.image_revision
+        if self._checkpoint_failed \
+                or (image_revision != self._checkpoint_image_revision) \
+                or (self._checkpoint_image_filename is None):
+            image = self.annot_model.image
+            self._checkpoint_image_filename = '{0}.image.{1}'.format(
+                os.path.basename(journal.checkpoint_path), str(uuid.uuid4())[:8])
+            self._checkpoint_image_revision = image_revision
+        state['image_state_filename'] = self._checkpoint_image_filename
+
+        first_segment = journal.start_checkpoint()
+        self._checkpoint_filenames = self._get_checkpoint_filenames()
+        self._checkpoint_failed = False
+
+        args = (journal, state, first_segment, image)
+        if not background:
+            self._write_checkpoint(*args)
+            return
+        self._checkpoint_thread = threading.Thread(target=self._write_checkpoint,
+                                                   args=args)
+        self._checkpoint_thread.start()
+
+    def _write_checkpoint(self, journal, state, first_segment, image):
+        """Writes the image state (if given) and the checkpoint. Does not
+        touch the App or the model, so that it can run in the background."""
+        recovery_dir = os.path.dirname(journal.checkpoint_path)
+        image_path = os.path.join(recovery_dir, state['image_state_filename'])
         try:
-            with open(rec_temp_name, 'wb') as hdl:
-                pickle.dump(state, hdl, protocol=pickle.HIGHEST_PROTOCOL)
+            if image is not None:
+                with open(image_path, 'wb') as hdl:
+                    hdl.write(zlib.compress(image.tobytes()))
+            journal.write_checkpoint(state, first_segment)
         except:
             logging.warn('App.save_app_state: Saving to recovery file failed.')
-            if os.path.isfile(rec_temp_name):
-                os.remove(rec_temp_name)
+            self._checkpoint_failed = True
             return
 
-        if os.path.isfile(recovery_path):
-            os.remove(recovery_path)
-        os.rename(rec_temp_name, recovery_path)
+        # Images of older checkpoints are not needed anymore.
+        image_prefix = os.path.basename(journal.checkpoint_path) + '.image.'
+        for fname in os.listdir(recovery_dir):
+            if fname.startswith(image_prefix) and (fname != state['image_state_filename']):
+                os.remove(os.path.join(recovery_dir, fname))
+
+    def _is_checkpoint_running(self):
+        return (self._checkpoint_thread is not None) \
+               and self._checkpoint_thread.is_alive()
+
+    def wait_for_checkpoint(self):
+        """Blocks until the running background checkpoint (if any) is done."""
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+
+    def _load_image_state(self, state):
+        image_shape = state['image_shape']
+        if 'image_state' in state:
+            # Recovery files from older versions have the whole image inside.
+            image_state = numpy.fromstring(state['image_state'], dtype='uint8')
+            return numpy.reshape(image_state, image_shape)
+
+        image_path = os.path.join(os.path.dirname(self._get_recovery_path()),
+                                  state['image_state_filename'])
+        with open(image_path, 'rb') as hdl:
+            image_state = numpy.frombuffer(zlib.decompress(hdl.read()),
+                                           dtype=state['image_dtype'])
+        return numpy.reshape(image_state, image_shape).copy()
 
     def _recover(self):
-        recovery_path = self._get_recovery_path()
-        logging.info('App.recover: Loading recovery file {0}'.format(recovery_path))
-        if not os.path.exists(recovery_path):
+        """Rebuilds the state from the last checkpoint and the journal,
+        and writes it as a new checkpoint. Returns True if that happened,
+        False if there was nothing to recover from."""
+        journal = self._get_edit_journal()
+        logging.info('App.recover: Loading recovery file {0}'
+                     ''.format(journal.checkpoint_path))
+        if not os.path.exists(journal.checkpoint_path):
             logging.warn('App.recover: Recovery file {0} not found! '
-                         'No recovery will be performed.'.format(recovery_path))
-            return
+                         'No recovery will be performed.'.format(journal.checkpoint_path))
+            return False
 
         try:
-            with open(recovery_path, 'rb') as hdl:
-                state = pickle.load(hdl)
+            state, records = journal.load()
         except pickle.PickleError:
             logging.warn('App.recover: Recovery failed! Resuming without recovery.')
-            return
+            return False
 
         logging.info('App.recover: loaded state, rebuilding from state.')
-        self._build_from_app_state(state=state)
+        # Neither rebuilding nor replaying should be journaled again.
+        self.annot_model.journal = None
+        try:
+            self._build_from_app_state(state=state)
+
+            logging.info('App.recover: replaying {0} edits from the journal.'
+                         ''.format(len(records)))
+            try:
+                n_skipped = self.annot_model.replay_journal(records)
+                if n_skipped > 0:
+                    logging.warn('App.recover: {0} edits from the journal could'
+                                 ' not be replayed.'.format(n_skipped))
+            except Exception as e:
+                logging.warn('App.recover: Replaying the journal failed, resuming'
+                             ' from the edits replayed so far: {0}\n{1}'
+                             ''.format(e, traceback.format_exc()))
+            self.update_image_texture_from_model()
+        finally:
+            self.annot_model.journal = journal
+
+        self._save_app_state(checkpoint=True)
+        return True
 
     # These functions are the public interface to the recovery manager.
     def do_save_app_state(self):
@@ -993,8 +1167,11 @@ class MUSCIMarkerApp(App):
     def do_recovery(self):
         """Use this method to invoke recovery.
         So far, it is trivial, but there may be some more complex
-        logic & validation here later on."""
-        self._recover()
+        logic & validation here later on.
+
+        :returns: True if the state has been recovered.
+        """
+        return self._recover()
 
     @tr.Tracker(track_names=[],
                 tracker_name='commands')
@@ -1006,7 +1183,7 @@ class MUSCIMarkerApp(App):
 
     def do_save_app_state_clock_event(self, *args):
         logging.info('App: making scheduled recovery dump.')
-        self.do_save_app_state()
+        self._save_app_state(background=True)
         logging.debug('App: scheduled recovery dump done.')
 
     ##########################################################################
@@ -1153,12 +1330,20 @@ class MUSCIMarkerApp(App):
 
 
         try:
-            cropobject_list = parse_cropobject_list(pos,
-                                                    #with_refs=True,
-                                                    #tolerate_ref_absence=True,
-                                                    #fill_mlclass_names=True,
-                                                    #mlclass_dict=self.annot_model.mlclasses
-                                                    )
+            if self.config.getboolean('io', 'binary_sidecar'):
+                # Falls back on (and refreshes from) the XML file
+                # if the binary sidecar is missing or out of date.
+                cropobject_list = load_cropobject_list_binary(binary_sidecar_filename(pos),
+                                                              source_filename=pos,
+                                                              cropobject_class=CropObject,
+                                                              fallback_parser=parse_cropobject_list)
+            else:
+                cropobject_list = parse_cropobject_list(pos,
+                                                        #with_refs=True,
+                                                        #tolerate_ref_absence=True,
+                                                        #fill_mlclass_names=True,
+                                                        #mlclass_dict=self.annot_model.mlclasses
+                                                        )
 
             # # Handling MLClassList and Image conflicts. Currently just warns.
             # if mfile is not None:
@@ -1264,6 +1449,11 @@ class MUSCIMarkerApp(App):
                                                      image_processor.stretch_intensity))
         self.annot_model._image_processor = image_processor
 
+        if self.config.getboolean('toolkit', 'memmap_cc_labels'):
+            self.annot_model.cc_labels_dir = self.tmp_dir
+        else:
+            self.annot_model.cc_labels_dir = None
+
         self.annot_model.load_image(img,
                                     do_preprocessing=True,
                                     update_temp=True)
@@ -1314,9 +1504,19 @@ class MUSCIMarkerApp(App):
     def update_image(self, image,
                      # allow_size_change_without_cropobjects=False,
                      do_preprocessing=False,
-                     update_temp=False):
+                     update_temp=False,
+                     changed_region=None,
+                     precompute=True):
         """Nondestructively swaps out underlying image in the model and displays
-        it."""
+        it.
+
+        :param changed_region: The ``(top, left, bottom, right)`` bounding box
+            of the pixels that differ from the current image, if known.
+            Only this region is then recorded in the edit journal, and
+            the connected components are only updated around it.
+
+        :param precompute: Passed on to the model's ``load_image()``.
+        """
         if image.shape != self.annot_model.image.shape:
             #if allow_size_change_without_cropobjects and (len(self.annot_model.cropobjects) == 0):
             #    pass
@@ -1327,7 +1527,10 @@ class MUSCIMarkerApp(App):
 
         self.annot_model.load_image(image,
                                     do_preprocessing=do_preprocessing,
-                                    update_temp=update_temp)
+                                    update_temp=update_temp,
+                                    changed_region=changed_region,
+                                    precompute=precompute)
+        self.annot_model.journal_image_edit(changed_region)
         # This function is used to update the image on the fly, so the preprocessing
         # applied when the image is first imported does not have to be done.
 
@@ -1499,6 +1702,13 @@ class MUSCIMarkerApp(App):
         self.do_center_current_image()
         Window.unbind(on_draw=self._do_center_current_image_and_unenforce)
 
+    def _on_export_failed(self, instance, output, error):
+        dialog = MessageDialog(title='Export failed',
+                               text='Could not save the annotation to {0}:\n{1}\n\n'
+                                    'The previously saved file has not been changed.'
+                                    ''.format(output, error))
+        dialog.open()
+
     ##########################################################################
     # Basic image manipulation
     def rotate_image(self, clockwise=False):
@@ -1512,6 +1722,7 @@ class MUSCIMarkerApp(App):
         self.annot_model.load_image(new_image,
                                     do_preprocessing=False,
                                     update_temp=True)
+        self.annot_model.journal_image_edit()
         editor_container = self._get_editor_scatter_container_widget()
         # self.update_image(new_image,
         #                   # allow_size_change_without_cropobjects=True,
@@ -2048,7 +2259,13 @@ class MUSCIMarkerApp(App):
         attempt_recovery_dump = self.config.get('recovery',
                                                 'attempt_recovery_dump_on_exit')
         if attempt_recovery_dump:
-            self.do_save_app_state()
+            self._save_app_state(checkpoint=True)
+
+        # Do not cut off an export that is still being written.
+        try:
+            self.annot_model.wait_for_export()
+        except Exception as e:
+            logging.error('App.exit(): Export failed: {0}'.format(e))
 
         # Stop tracking
         handler = self.get_tracking_handler()
@@ -2163,17 +2380,19 @@ class MUSCIMarkerApp(App):
         self.currently_selected_mlclass_name = MEASURE_SEPARATOR_CLSNAME
 
 
-        for c in list(self.annot_model.cropobjects.values()):
-            if (c.clsname in BARLINE_CLASSES) and (len(c.inlinks) == 0):
-                # Add a measure separator from this one:
-                #  - create the new CropObject
-                #  - add the link from the measure_separator
-                # Basically, it's like passing shift+M on the barline
-                # with the measure_separator as current class.
-                c_view = c_l_view.get_cropobject_view(c.objid)
-                c_view.ensure_selected()
-                c_l_view.handle_dispatch_key('109+shift')
-                c_view.ensure_deselected()
+        # The views are only redrawn once all the separators are added.
+        with self.annot_model.batch():
+            for c in list(self.annot_model.cropobjects.values()):
+                if (c.clsname in BARLINE_CLASSES) and (len(c.inlinks) == 0):
+                    # Add a measure separator from this one:
+                    #  - create the new CropObject
+                    #  - add the link from the measure_separator
+                    # Basically, it's like passing shift+M on the barline
+                    # with the measure_separator as current class.
+                    c_view = c_l_view.get_cropobject_view(c.objid)
+                    c_view.ensure_selected()
+                    c_l_view.handle_dispatch_key('109+shift')
+                    c_view.ensure_deselected()
 
         # Restoring prev selection state and clsname
         self.currently_selected_mlclass_name = _prev_clsname
@@ -2279,17 +2498,19 @@ class MUSCIMarkerApp(App):
             cropobjects = list(self.annot_model.cropobjects.values())
 
         _objids_duplicate = set()
-        sorted_cropobjects = sorted(cropobjects, key=lambda c: c.bounding_box)
-        current_cropobject = sorted_cropobjects[0]
-        for other_cropobject in sorted_cropobjects[1:]:
-            if other_cropobject.bounding_box == current_cropobject.bounding_box:
-                if (current_cropobject.objid not in other_cropobject.inlinks) \
-                    and (current_cropobject.objid not in other_cropobject.outlinks):
-                    _objids_duplicate.add(current_cropobject.objid)
-                    _objids_duplicate.add(other_cropobject.objid)
-            else:
-                # Move along the list
-                current_cropobject = other_cropobject
+        _objids = set([c.objid for c in cropobjects])
+        for c in cropobjects:
+            # Only the CropObjects that overlap can have the same bounding box.
+            for objid in self.annot_model.find_objids_in_bbox(*c.bounding_box):
+                if (objid == c.objid) or (objid not in _objids):
+                    continue
+                other_cropobject = self.annot_model.cropobjects[objid]
+                if other_cropobject.bounding_box != c.bounding_box:
+                    continue
+                if (c.objid not in other_cropobject.inlinks) \
+                        and (c.objid not in other_cropobject.outlinks):
+                    _objids_duplicate.add(c.objid)
+                    _objids_duplicate.add(objid)
 
         c_l_view.unselect_all()
         c_l_view.ensure_selected_objids(_objids_duplicate)
@@ -20,8 +20,11 @@ import time
 import itertools
 import numpy
 
+from muscima.cropobject import CropObject
 from muscima.io import parse_cropobject_list
 
+from MUSCIMarker.parse_cache import cropobject_list_parser, CACHE_DIR_HELP
+
 __version__ = "0.0.1"
 __author__ = "Jan Hajic jr."
 
@@ -251,6 +254,9 @@ def build_argument_parser():
                         help='If set, will not require aligned objects\' clsnames'
                              ' to match before computing pixel-wise overlap'
                              ' metrics.')
+    parser.add_argument('--no_cache', '--no-cache', action='store_true',
+                        help='Always parse the input files, do not use'
+                             ' the parsed CropObjectList cache. ' + CACHE_DIR_HELP)
 
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Turn on INFO messages.')
@@ -274,8 +280,11 @@ def main(args):
     # Rule: if two objects don't share a pixel, they cannot be considered related.
     # Object classes do not factor into this so far.
 
-    truth = parse_cropobject_list(args.true)
-    prediction = parse_cropobject_list(args.prediction)
+    parse = cropobject_list_parser(use_cache=not args.no_cache,
+                                   parser=parse_cropobject_list,
+                                   cropobject_class=CropObject)
+    truth = parse(args.true)
+    prediction = parse(args.prediction)
 
     _parse_time = time.clock()
     logging.info('Parsing {0} true and {1} prediction cropobjects took {2:.2f} s'
@@ -27,10 +27,13 @@ import logging
 import pprint
 import time
 
+import numpy
 import operator
 
-from muscima.io import parse_cropobject_list, export_cropobject_graph
-from muscima.cropobject import merge_cropobject_lists
+from MUSCIMarker.cropobject_store import CropObjectStore
+from MUSCIMarker.muscimarker_io import export_cropobject_graph, merge_cropobject_lists, \
+    iter_cropobject_lists_parallel
+from MUSCIMarker.parse_cache import cropobject_list_parser, CACHE_DIR_HELP
 
 __version__ = "0.0.1"
 __author__ = "Jan Hajic jr."
@@ -42,23 +45,31 @@ def compute_cropobject_stats(cropobjects, edges=None):
     # Count cropobjects
     stats['n_cropobjects'] = len(cropobjects)
 
+    # The statistics do not need the masks.
+    store = CropObjectStore(cropobjects, compute_mask_areas=False)
+
     # Count cropobjects by class
     n_cropobjects_by_class = collections.defaultdict(int)
-    for c in cropobjects:
-        n_cropobjects_by_class[c.clsname] += 1
+    n_cropobjects_by_class.update(store.count_by_clsname())
     stats['n_cropobjects_by_class'] = n_cropobjects_by_class
     stats['n_cropobjects_distinct'] = len(n_cropobjects_by_class)
 
     if edges is not None:
-        # Count relationships
-        _cropobjects_dict = {c.objid: c for c in cropobjects}
+        # Count relationships: each (from class, to class) pair
+        # gets one number, and these are counted all at once.
         stats['n_relationships'] = len(edges)
+        n_classes = len(store.clsnames)
         n_relationships_by_class = collections.defaultdict(int)
-        for e in edges:
-            fr, to = e
-            c_fr = _cropobjects_dict[fr].clsname
-            c_to = _cropobjects_dict[to].clsname
-            n_relationships_by_class[(c_fr, c_to)] += 1
+        if len(edges) > 0:
+            fr_rows = store.rows([fr for fr, _ in edges])
+            to_rows = store.rows([to for _, to in edges])
+            pairs = store.clsname_ids[fr_rows].astype('int64') * n_classes \
+                    + store.clsname_ids[to_rows]
+            pair_counts = numpy.bincount(pairs)
+            for pair in numpy.flatnonzero(pair_counts):
+                c_fr = store.clsnames[pair // n_classes]
+                c_to = store.clsnames[pair % n_classes]
+                n_relationships_by_class[(c_fr, c_to)] = int(pair_counts[pair])
         stats['n_relationships_by_class'] = n_relationships_by_class
         stats['n_relationships_distinct'] = len(n_relationships_by_class)
 
@@ -109,6 +120,11 @@ def build_argument_parser():
     parser.add_argument('-e', '--emit', action='store', default='print',
                         choices=['print', 'latex', 'json'],
                         help='How should the analysis results be presented?')
+    parser.add_argument('--no_cache', '--no-cache', action='store_true',
+                        help='Always parse the input files, do not use'
+                             ' the parsed CropObjectList cache. ' + CACHE_DIR_HELP)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Parse the input files in this many processes.')
 
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Turn on INFO messages.')
@@ -120,19 +136,25 @@ def build_argument_parser():
 
 def main(args):
     logging.info('Starting main...')
-    _start_time = time.clock()
+    _start_time = time.time()
 
     # Parse individual CropObject lists.
+    # The statistics do not need masks, so they are never decoded.
+    parse_cropobject_list = cropobject_list_parser(use_cache=not args.no_cache,
+                                                   lazy_masks=True)
     cropobject_lists = []
     _n_parsed_cropobjects = 0
-    for i, f in enumerate(args.input):
-        cs = parse_cropobject_list(f)
+    for i, cs in enumerate(iter_cropobject_lists_parallel(args.input,
+                                                          workers=args.jobs,
+                                                          parser=parse_cropobject_list)):
         cropobject_lists.append(cs)
 
         # Logging progress
         _n_parsed_cropobjects += len(cs)
         if i % 10 == 0 and i > 0:
-            _time_parsing = time.clock() - _start_time
+            # Wall-clock time: with --jobs, the parsing does not happen
+            # in this process.
+            _time_parsing = time.time() - _start_time
             _cropobjects_per_second = old_div(_n_parsed_cropobjects, _time_parsing)
             logging.info('Parsed {0} cropobjects in {1:.2f} s ({2:.2f} objs/s)'
                          ''.format(_n_parsed_cropobjects,
@@ -140,12 +162,13 @@ def main(args):
 
     # Merge the CropObject lists into one.
     # This is done so that the resulting object graph can be manipulated
-    # at once, without objid clashes.
-    cropobjects = merge_cropobject_lists(*cropobject_lists)
+    # at once, without objid clashes. The merged list is only read,
+    # so it shares the masks with the parsed lists instead of copying them.
+    cropobjects = merge_cropobject_lists(*cropobject_lists, copy=False)
 
     edges = export_cropobject_graph(cropobjects)
 
-    _parse_end_time = time.clock()
+    _parse_end_time = time.time()
     logging.info('Parsing took {0:.2f} s'.format(_parse_end_time - _start_time))
 
     ##########################################################################
@@ -163,7 +186,7 @@ def main(args):
     #  - json
     #  - latex table
 
-    _end_time = time.clock()
+    _end_time = time.time()
     logging.info('analyze_annotations.py done in {0:.3f} s'
                  ''.format(_end_time - _start_time))
 
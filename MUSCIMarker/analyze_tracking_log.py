@@ -38,7 +38,9 @@ import time
 import matplotlib.pyplot as plt
 import operator
 
-from muscima.io import parse_cropobject_list
+from MUSCIMarker.muscimarker_io import parse_cropobject_list, iter_cropobject_list, \
+    iter_cropobject_lists_parallel
+from MUSCIMarker.parse_cache import cropobject_list_parser, CACHE_DIR_HELP
 
 __version__ = "0.0.1"
 __author__ = "Jan Hajic jr."
@@ -207,11 +209,24 @@ def annotations_from_package(package):
 
 
 def count_cropobjects(annot_file):
-    return len(parse_cropobject_list(annot_file))
+    return sum([1 for _ in iter_cropobject_list(annot_file, lazy_masks=True)])
 
 
-def count_cropobjects_and_relationships(annot_file):
-    cropobjects = parse_cropobject_list(annot_file)
+def count_cropobjects_and_relationships(annot_file, parser=None):
+    """Counts the CropObjects and relationships in the given file.
+
+    :param parser: Function that parses the file into a list of CropObjects
+        (e.g. from ``parse_cache.cropobject_list_parser()``). If not given,
+        the file is parsed directly.
+    """
+    if parser is None:
+        cropobjects = parse_cropobject_list(annot_file, lazy_masks=True)
+    else:
+        cropobjects = parser(annot_file)
+    return count_parsed_cropobjects_and_relationships(cropobjects)
+
+
+def count_parsed_cropobjects_and_relationships(cropobjects):
     n_inlinks = 0
     for c in cropobjects:
         if c.inlinks is not None:
@@ -325,6 +340,12 @@ def build_argument_parser():
                              ' and compute object/rel counts and efficiency statistics.')
     parser.add_argument('--no_training', action='store_true',
                         help='If given, will ignore packages with "training" in their name.')
+    parser.add_argument('--no_cache', '--no-cache', action='store_true',
+                        help='When counting annotations, always parse the files,'
+                             ' do not use the parsed CropObjectList cache. ' + CACHE_DIR_HELP)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='When counting annotations, parse the files'
+                             ' of each package in this many processes.')
 
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Turn on INFO messages.')
@@ -434,14 +455,19 @@ def main(args):
         if args.packages is None:
             raise ValueError('Cannot count annotations if no packages are given!')
 
+        parser = cropobject_list_parser(use_cache=not args.no_cache,
+                                        lazy_masks=True)
         n_cropobjects = 0
         n_relationships = 0
         for package in args.packages:
             annot_files = annotations_from_package(package)
             n_c_package = 0
             n_r_package = 0
-            for f in annot_files:
-                n_c, n_r = count_cropobjects_and_relationships(f)
+            parsed_annot_files = iter_cropobject_lists_parallel(annot_files,
+                                                                workers=args.jobs,
+                                                                parser=parser)
+            for cropobjects in parsed_annot_files:
+                n_c, n_r = count_parsed_cropobjects_and_relationships(cropobjects)
                 n_cropobjects += n_c
                 n_relationships += n_r
                 n_c_package += n_c
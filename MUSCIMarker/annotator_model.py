@@ -3,10 +3,13 @@ from __future__ import print_function, unicode_literals
 
 from builtins import str
 import codecs
+import contextlib
+import copy
 import itertools
 import logging
 import os
 import pickle
+import threading
 import traceback
 import uuid
 
@@ -16,7 +19,9 @@ import numpy
 from scipy.misc import imsave
 
 from kivy.app import App
-from kivy.properties import ObjectProperty, DictProperty, NumericProperty, ListProperty, StringProperty
+from kivy.clock import Clock
+from kivy.properties import ObjectProperty, DictProperty, NumericProperty, ListProperty, StringProperty, \
+    BooleanProperty
 from kivy.uix.widget import Widget
 
 from muscima.io import export_cropobject_list
@@ -25,12 +30,16 @@ from muscima.inference import PitchInferenceEngine, OnsetsInferenceEngine, MIDIB
 from muscima.inference_engine_constants import InferenceEngineConstants as _CONST
 from muscima.graph import \
     find_beams_incoherent_with_stems, \
-    find_misdirected_ledger_line_edges, \
-    find_related_staffs
+    find_misdirected_ledger_line_edges
+from MUSCIMarker.cropobject_store import CropObjectStore
+from MUSCIMarker.graph_snapshot import GraphSnapshot
+from MUSCIMarker.muscimarker_io import write_cropobject_list, \
+    pack_cropobject_mask, unpack_cropobject_mask
+from MUSCIMarker.spatial_index import SpatialIndex
 from MUSCIMarker.object_detection import ObjectDetectionHandler
 from MUSCIMarker.syntax.dependency_parsers import SimpleDeterministicDependencyParser, PairwiseClassificationParser, \
     PairwiseClfFeatureExtractor
-from MUSCIMarker.utils import compute_connected_components
+from MUSCIMarker.utils import compute_connected_components, update_connected_components
 from MUSCIMarker.tracker import Tracker
 
 from MUSCIMarker.image_processing import ImageProcessing
@@ -73,6 +82,22 @@ class ObjectGraph(Widget):
     '''Automatically computed dict of all CropObjects that the given
     CropObject is attached to. Internal.'''
 
+    _outlinks_by_label = DictProperty()
+    '''The same as ``_outlinks``, but partitioned by edge label:
+    ``_outlinks_by_label[label][objid]`` is the set of CropObjects
+    to which the given CropObject has an edge with that label.
+    Keeps label-filtered queries from scanning all the neighbors.
+    Internal.'''
+
+    _inlinks_by_label = DictProperty()
+    '''The same as ``_inlinks``, partitioned by edge label. Internal.'''
+
+    revision = NumericProperty(0)
+    '''Incremented on every change of the vertices or edges.'''
+
+    _snapshot = ObjectProperty(None, allownone=True)
+    '''The cached GraphSnapshot, valid while its revision matches.'''
+
     # def __init__(self, model, **kwargs):
     #     super(ObjectGraph, self).__init__(**kwargs)
     #     # self.cropobject_model = model
@@ -83,6 +108,7 @@ class ObjectGraph(Widget):
 
     def add_vertex(self, v):
         self.vertices[v] = True
+        self.revision += 1
 
     def remove_vertex(self, v):
         if v in self.vertices:
@@ -112,8 +138,11 @@ class ObjectGraph(Widget):
             raise ValueError('Invalid attachment {0}: member {1} not in cropobjects.'
                              ''.format(edge, a2))
 
+        if edge in self.edges:
+            self._remove_from_label_index(a1, a2, self.edges[edge])
         self.edges[edge] = label
-        self.add_to_edges_index(a1, a2)
+        self.add_to_edges_index(a1, a2, label=label)
+        self.revision += 1
 
     def ensure_add_edges(self, edges, label='Attachment'):
         logging.info('Graph: ensuring edges {0}'.format(edges))
@@ -136,12 +165,17 @@ class ObjectGraph(Widget):
             if a2 not in self.vertices:
                 raise ValueError('Invalid attachment {0}: member {1} not in cropobjects.'
                                  ''.format((a1, a2), a2))
-            self.add_to_edges_index(a1, a2)
+            if (a1, a2) in self.edges:
+                self._remove_from_label_index(a1, a2, self.edges[a1, a2])
+            self.add_to_edges_index(a1, a2, label=label)
 
         edge_dict = {e: label for e in edges}
         self.edges.update(edge_dict)
+        self.revision += 1
+
+    def add_to_edges_index(self, a1, a2, label='Attachment'):
+        self._add_to_label_index(a1, a2, label)
 
-    def add_to_edges_index(self, a1, a2):
         if a1 not in self._outlinks:
             self._outlinks[a1] = set()
         if a2 not in self._inlinks:
@@ -158,6 +192,25 @@ class ObjectGraph(Widget):
             logging.warn('Trying to re-add inlink from {0} to {1}'
                          ''.format(a1, a2))
 
+    def _add_to_label_index(self, a1, a2, label):
+        if label not in self._outlinks_by_label:
+            self._outlinks_by_label[label] = dict()
+            self._inlinks_by_label[label] = dict()
+        outlinks = self._outlinks_by_label[label]
+        inlinks = self._inlinks_by_label[label]
+        if a1 not in outlinks:
+            outlinks[a1] = set()
+        if a2 not in inlinks:
+            inlinks[a2] = set()
+        outlinks[a1].add(a2)
+        inlinks[a2].add(a1)
+
+    def _remove_from_label_index(self, a1, a2, label):
+        if label not in self._outlinks_by_label:
+            return
+        self._outlinks_by_label[label].get(a1, set()).discard(a2)
+        self._inlinks_by_label[label].get(a2, set()).discard(a1)
+
     def compute_edges_index(self, attachments):
         '''Adds to the attachment indexes all the given
         attachments ``(a1, a2)``.'''
@@ -190,7 +243,10 @@ class ObjectGraph(Widget):
                          ''.format(a1, a2))
         else:
             self._outlinks[a1].remove(a2)
+
+        self._remove_from_label_index(a1, a2, self.edges[a1, a2])
         del self.edges[a1, a2]
+        self.revision += 1
 
     def remove_obj_from_graph(self, objid):
         """Clears out the given CropObject from the attachments
@@ -202,6 +258,7 @@ class ObjectGraph(Widget):
         """
         self.remove_obj_edges(objid)
         del self.vertices[objid]
+        self.revision += 1
 
     def remove_obj_edges(self, objid):
         """Clears all edges in which the object participates."""
@@ -216,6 +273,7 @@ class ObjectGraph(Widget):
                 del self.edges[objid, a]
 
         self._remove_obj_from_edges_index(objid)
+        self.revision += 1
 
     def _remove_obj_from_edges_index(self, objid):
         """Remove all of this node's inlinks and outlinks,
@@ -238,6 +296,11 @@ class ObjectGraph(Widget):
                     self._inlinks[o].remove(objid)
             self._outlinks[objid] = set()
 
+        for label, outlinks in self._outlinks_by_label.items():
+            inlinks = self._inlinks_by_label[label]
+            for o in outlinks.pop(objid, set()):
+                inlinks[o].discard(objid)
+
     def _clear_obj_inlinks(self, objid):
         """Remove the node's inlinks, and remove it from the outlinks
         of the nodes from which it has inlinks"""
@@ -248,6 +311,11 @@ class ObjectGraph(Widget):
                     self._outlinks[i].remove(objid)
             self._inlinks[objid] = set()
 
+        for label, inlinks in self._inlinks_by_label.items():
+            outlinks = self._outlinks_by_label[label]
+            for i in inlinks.pop(objid, set()):
+                outlinks[i].discard(objid)
+
     def clear(self):
         self.vertices = []
         self.clear_edges()
@@ -256,6 +324,19 @@ class ObjectGraph(Widget):
         self.edges = {}
         self._inlinks = dict()
         self._outlinks = dict()
+        self._inlinks_by_label = dict()
+        self._outlinks_by_label = dict()
+        self.revision += 1
+
+    def snapshot(self):
+        """Returns a read-only GraphSnapshot of the graph, for running
+        many queries (neighborhoods, descendants, connected groups...)
+        at once. The snapshot is cached and only rebuilt after the graph
+        changes, so do not modify it."""
+        if (self._snapshot is None) or (self._snapshot.revision != self.revision):
+            self._snapshot = GraphSnapshot(self.vertices, self.edges,
+                                           revision=self.revision)
+        return self._snapshot
 
     def get_neighborhood(self, objid, inclusive=True):
         """Returns a list of ``objid``s of the undirected neighbors
@@ -283,18 +364,12 @@ class ObjectGraph(Widget):
         :returns: List of ``objid``s of inlinks with given label.
             Empty list if no such inlinks exist in graph.
         """
-        if objid not in self._inlinks:
-            return []
-
         if label is None:
-            return list(self._inlinks[objid])
+            return list(self._inlinks.get(objid, []))
 
-        output = []
-        for i in list(self._inlinks[objid]):
-            if self.edges[(i, objid)] == label:
-                output.append(i)
-
-        return output
+        if label not in self._inlinks_by_label:
+            return []
+        return list(self._inlinks_by_label[label].get(objid, []))
 
     def outlinks_of(self, objid, label=None):
         """Returns the outlinks for the given objid such that the
@@ -305,23 +380,152 @@ class ObjectGraph(Widget):
         :returns: List of ``objid``s of outlinks with given label.
             Empty list if no such inlinks exist in graph.
         """
-        if objid not in self._outlinks:
-            return []
-
         if label is None:
-            return list(self._outlinks[objid])
+            return list(self._outlinks.get(objid, []))
 
-        output = []
-        for o in list(self._outlinks[objid]):
-            if self.edges[(objid, o)] == label:
-                output.append(o)
+        if label not in self._outlinks_by_label:
+            return []
+        return list(self._outlinks_by_label[label].get(objid, []))
 
-        return output
+    def edges_with_label(self, label):
+        """Returns a list of all the ``(from, to)`` edges
+        with the given label."""
+        if label not in self._outlinks_by_label:
+            return []
+        return [(a1, a2) for a1, outlinks in self._outlinks_by_label[label].items()
+                for a2 in outlinks]
 
 
 ##############################################################################
 
 
+def _suspend_property_observers(dispatcher, name):
+    """Unbinds everything that observes the given Kivy property
+    and returns the observers, so that they can be re-bound with
+    ``_resume_property_observers()``."""
+    observers = dispatcher.get_property_observers(name, args=True)
+    for callback, largs, kwargs, is_ref, uid in observers:
+        if uid:
+            dispatcher.unbind_uid(name, uid)
+        else:
+            dispatcher.unbind(**{name: callback() if is_ref else callback})
+    return observers
+
+
+def _resume_property_observers(dispatcher, name, observers):
+    for callback, largs, kwargs, is_ref, uid in observers:
+        if is_ref:
+            callback = callback()
+            if callback is None:
+                # The observer died in the meantime.
+                continue
+        if uid:
+            dispatcher.fbind(name, callback, *largs, **kwargs)
+        else:
+            dispatcher.bind(**{name: callback})
+
+
+def _remove_cc_labels_file(path):
+    if (path is None) or (not os.path.isfile(path)):
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        # E.g. on Windows, while the file is still mapped.
+        logging.warn('AnnotModel: Could not remove connected component'
+                     ' labels file {0}'.format(path))
+
+
+class _BackgroundComputation(object):
+    """Runs ``fn(*args)`` in a worker thread and keeps the result,
+    like a minimal ``concurrent.futures.Future``.
+
+    The worker only touches this object, never the caller's state, so
+    cancelling is just a matter of marking the computation as cancelled
+    and dropping it: a result that is still being computed is thrown away
+    when the worker finishes.
+
+    :param discard: Called with the result of a cancelled computation
+        once it is available, e.g. to remove the files it created.
+    """
+    def __init__(self, fn, args=(), discard=None):
+        self._fn = fn
+        self._args = args
+        self._discard = discard
+        self._result = None
+        self._error = None
+        self._cancelled = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run)
+        # A cancelled computation must not keep the application from exiting.
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        result, error = None, None
+        try:
+            if not self._cancelled:
+                result = self._fn(*self._args)
+        except Exception as e:
+            error = e
+            logging.warn('Background computation failed: {0}\n{1}'
+                         ''.format(e, traceback.format_exc()))
+        # Do not hold on to the arguments (e.g. a full-page image).
+        self._args = None
+        with self._lock:
+            self._result, self._error = result, error
+            self._done.set()
+            cancelled = self._cancelled
+        if cancelled:
+            self._discard_result()
+
+    def _discard_result(self):
+        result, self._result = self._result, None
+        if (result is not None) and (self._discard is not None):
+            self._discard(result)
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self, wait=False):
+        """Marks the computation as cancelled.
+
+        :param wait: If set, blocks until the worker has finished, so that
+            the result has been discarded when this method returns.
+        """
+        with self._lock:
+            was_cancelled = self._cancelled
+            self._cancelled = True
+            done = self._done.is_set()
+        if done and not was_cancelled:
+            self._discard_result()
+        if wait:
+            self._thread.join()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def result(self, timeout=None):
+        """Waits for the computation to finish and returns its result.
+
+        :raises RuntimeError: If the computation has been cancelled,
+            or did not finish within ``timeout`` seconds.
+
+        :raises Exception: Whatever the computation raised.
+        """
+        if self._cancelled:
+            raise RuntimeError('Background computation was cancelled.')
+        if not self._done.wait(timeout):
+            raise RuntimeError('Background computation did not finish'
+                               ' within {0} s.'.format(timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
 class CropObjectAnnotatorModel(Widget):
     """This model describes the conceptual interface of the annotation
     app: there is an annotator performing some actions, and this model
@@ -337,15 +541,46 @@ class CropObjectAnnotatorModel(Widget):
     The object graph is synced to the CropObject dict in the Model
     on export.
 
+    Many changes at once should be made inside ``with model.batch():``,
+    so that the views are updated only once, at the end. The model then
+    fires ``on_cropobjects_changed`` with the objids of all CropObjects
+    that were added, removed, or had their relationships changed.
+
     """
+    __events__ = ('on_cropobjects_changed', 'on_export_failed')
+
     image = ObjectProperty()
+    image_revision = NumericProperty(0)
+    '''Incremented whenever a new image is loaded. The image array should
+    only be replaced through ``load_image()``, never edited in place.'''
 
     # Connected component precomputing
-    _cc = NumericProperty(-1)
+    _max_label = NumericProperty(-1)
     _labels = ObjectProperty(None, allownone=True)
     _bboxes = ObjectProperty(None, allownone=True)
+    precompute_cc = BooleanProperty(True)
+    '''If set, the connected components of every newly loaded image
+    are computed right away in a background thread, so that the first
+    tool that needs them does not have to wait as long.'''
+    cc_labels_dir = StringProperty(None, allownone=True)
+    '''If set, the label image of the connected components is kept
+    in a memory-mapped file in this directory instead of in memory.'''
+    _cc_labels_path = StringProperty(None, allownone=True)
+    # The background computation of the connected components, and the
+    # bounding box of the image changes made since it started.
+    _cc_future = ObjectProperty(None, allownone=True)
+    _cc_future_region = ObjectProperty(None, allownone=True)
+    _cc_future_labels_path = StringProperty(None, allownone=True)
 
     cropobjects = DictProperty()
+    # Numpy columns of the CropObjects' bounding boxes, classes and mask
+    # areas, kept in sync with cropobjects, for fast bulk queries.
+    cropobject_store = ObjectProperty(None)
+    # Grid index of the CropObjects' bounding boxes, for spatial queries.
+    spatial_index = ObjectProperty(None)
+    # The next free objid. Only grows (until the CropObjects are cleared),
+    # so the objids of removed CropObjects are not reused.
+    _next_objid = NumericProperty(0)
     mlclasses = DictProperty()
     mlclasses_by_name = DictProperty()
 
@@ -362,6 +597,20 @@ class CropObjectAnnotatorModel(Widget):
     # Object detection
     _object_detection_client = ObjectProperty(None, allownone=True)
 
+    # Background export
+    _export_thread = ObjectProperty(None, allownone=True)
+
+    journal = ObjectProperty(None, allownone=True)
+    '''If set, an EditJournal into which every edit of the model
+    is recorded before it is made, for crash recovery.'''
+
+    # Batch updates: nesting depth and what is waiting for the end
+    # of the outermost batch.
+    _batch_depth = NumericProperty(0)
+    _batch_changed_objids = ObjectProperty(None, allownone=True)
+    _batch_pending_sync = ObjectProperty(None, allownone=True)
+    _batch_graph_revision = NumericProperty(0)
+    _batch_observers = ObjectProperty(None, allownone=True)
 
 
     def __init__(self, image=None, cropobjects=None, mlclasses=None, **kwargs):
@@ -369,6 +618,8 @@ class CropObjectAnnotatorModel(Widget):
 
         self.image = image
         self.cropobjects = dict()
+        self.cropobject_store = CropObjectStore()
+        self.spatial_index = SpatialIndex()
         if cropobjects:
             self.import_cropobjects(cropobjects)
         self.mlclasses = dict()
@@ -379,6 +630,10 @@ class CropObjectAnnotatorModel(Widget):
         self.graph = ObjectGraph()
         self.sync_cropobjects_to_graph()
 
+        # Set by the background export thread, so it must not be a Kivy
+        # property: those dispatch their events in the setting thread.
+        self._export_error = None
+
         # self._init_object_detection_handler()
         # ...only run this once the app is running.
 
@@ -419,18 +674,43 @@ class CropObjectAnnotatorModel(Widget):
         self.backup_parser = SimpleDeterministicDependencyParser(grammar=grammar)
 
     def load_image(self, image, compute_cc=False, do_preprocessing=True,
-                   update_temp=True):
-        self._invalidate_cc_cache()
-
+                   update_temp=True, changed_region=None, precompute=True):
+        """Sets the model image.
+
+        :param changed_region: The ``(top, left, bottom, right)`` bounding box
+            of the pixels that differ from the current image, if known.
+            The connected components are then only updated around this
+            region instead of being computed again for the whole image.
+            Ignored if the image gets preprocessed.
+
+        :param precompute: If not set, the connected components are not
+            computed in the background even if ``precompute_cc`` is set.
+            Use this when more images are going to be loaded right away.
+        """
         # Apply preprocessing
         if do_preprocessing:
             processed_image = self._image_processor.process(image)
         else:
             processed_image = image
+
+        is_region_edit = (changed_region is not None) and (not do_preprocessing) \
+                         and (self.image is not None) \
+                         and (processed_image.shape == self.image.shape)
+        if is_region_edit and not self._cc_cache_is_empty:
+            self._update_cc_cache(processed_image, changed_region)
+        elif is_region_edit and (self._cc_future is not None):
+            # The components being computed can be updated once they are done.
+            self._add_cc_future_region(changed_region)
+        else:
+            self._invalidate_cc_cache()
+
         self.image = processed_image
+        self.image_revision += 1
 
         if compute_cc:
             self._compute_cc_cache()
+        elif precompute:
+            self._precompute_cc_cache()
 
         if update_temp:
             self._update_temp_image()
@@ -459,6 +739,10 @@ class CropObjectAnnotatorModel(Widget):
              fn_name='model.add_cropobject',
              tracker_name='model')
     def add_cropobject(self, cropobject, perform_checks=True):
+        self._add_cropobject(cropobject, perform_checks=perform_checks)
+
+    def _add_cropobject(self, cropobject, perform_checks=True):
+        """The untracked implementation of ``add_cropobject()``."""
         if perform_checks:
             if not self._is_cropobject_valid(cropobject):
                 logging.info('Model: Adding cropobject {0}: invalid!'
@@ -478,10 +762,22 @@ class CropObjectAnnotatorModel(Widget):
         self.graph.add_edges(edges)
 
         self.cropobjects[cropobject.objid] = cropobject
+        self.cropobject_store.add(cropobject)
+        # Moving a CropObject is adding it again, so this also
+        # updates the index after moves.
+        self.spatial_index.insert(cropobject.objid, cropobject.bounding_box)
+        self._next_objid = max(self._next_objid, cropobject.objid + 1)
 
         # Sync graph: the object might add inlinks/outlinks
-        # to other objects.
-        self.sync_graph_to_cropobjects()
+        # to other objects. Only the object and its neighbors
+        # can be affected, so the rest of the CropObjects is left alone.
+        neighborhood = [self.cropobjects[k]
+                        for k in self.graph.get_neighborhood(cropobject.objid, inclusive=True)
+                        if k in self.cropobjects]
+        self._sync_or_defer(neighborhood)
+
+        if self.journal is not None:
+            self._journal('add_cropobject', pack_cropobject_mask(cropobject))
 
     def _is_cropobject_valid(self, cropobject):
         t, l, b, r = cropobject.bounding_box
@@ -496,12 +792,19 @@ class CropObjectAnnotatorModel(Widget):
              fn_name='model.remove_cropobject',
              tracker_name='model')
     def remove_cropobject(self, key):
+        self._remove_cropobject(key)
+
+    def _remove_cropobject(self, key):
+        """The untracked implementation of ``remove_cropobject()``."""
         # Could graph sync be solved by binding?
         neighborhood = [self.cropobjects[k]
              for k in self.graph.get_neighborhood(key, inclusive=True)]
         self.graph.remove_obj_from_graph(key)
-        self.sync_graph_to_cropobjects(neighborhood)
+        self._sync_or_defer(neighborhood)
         del self.cropobjects[key]
+        self.cropobject_store.remove(key)
+        self.spatial_index.remove(key)
+        self._journal('remove_cropobject', key)
 
     @Tracker(track_names=['cropobjects'],
              transformations={'cropobjects': [lambda c: ('n_cropobjects', len(c)),
@@ -509,15 +812,31 @@ class CropObjectAnnotatorModel(Widget):
              fn_name='model.import_cropobjects',
              tracker_name='model')
     def import_cropobjects(self, cropobjects, clear=True):
+        self._import_cropobjects(cropobjects, clear=clear)
+
+    def _import_cropobjects(self, cropobjects, clear=True):
+        """The untracked implementation of ``import_cropobjects()``."""
         logging.info('Model: Importing {0} cropobjects.'.format(len(cropobjects)))
         if clear:
-            self.clear_cropobjects()
+            # Not journaled on its own: replaying the import clears again.
+            self._clear_cropobjects()
+        self._record_changed_objids([c.objid for c in cropobjects])
         # Batch processing is more efficient, since rendering the CropObjectList
         # is tied to any change of self.cropobjects
         self.cropobjects = {c.objid: c for c in cropobjects}
+        self.cropobject_store = CropObjectStore(list(self.cropobjects.values()))
+        self.spatial_index = SpatialIndex()
+        for c in cropobjects:
+            self.spatial_index.insert(c.objid, c.bounding_box)
+        if len(cropobjects) > 0:
+            self._next_objid = max(self._next_objid,
+                                   max(c.objid for c in cropobjects) + 1)
         # self.ensure_cropobjects_consistent()
         self.sync_cropobjects_to_graph()
         # self.ensure_consistent()
+        if self.journal is not None:
+            self._journal('import_cropobjects',
+                          [pack_cropobject_mask(c) for c in cropobjects], clear)
 
     @Tracker(track_names=[],
              fn_name='model.export_cropobjects_string',
@@ -529,37 +848,153 @@ class CropObjectAnnotatorModel(Widget):
     @Tracker(track_names=['output'],
              fn_name='model.export_cropobjects',
              tracker_name='model')
-    def export_cropobjects(self, output, **kwargs):
+    def export_cropobjects(self, output, background=False, **kwargs):
+        """Writes the CropObjects into the given file, one by one.
+
+        The CropObjects are first written into a temporary file, which then
+        replaces ``output``, so that a failed export does not destroy
+        the previously saved annotation.
+
+        :param background: If set, the file is written in a separate
+            thread from a snapshot of the CropObjects, so that the annotation
+            can go on in the meantime. Use ``wait_for_export()`` to make sure
+            the file has been written. If the export fails, the model fires
+            ``on_export_failed`` (in the main thread), unless the error has
+            already been raised from ``wait_for_export()``.
+
+        :param kwargs: Passed to ``write_cropobject_list()``
+            (``docname``, ``dataset_name``).
+        """
         logging.info('Model: Exporting CropObjects to {0}'.format(output))
-        with codecs.open(output, 'w', 'utf-8') as hdl:
-            hdl.write(self.export_cropobjects_string(**kwargs))
-            hdl.write('\n')
+        self.sync_graph_to_cropobjects()
+        if not background:
+            self._write_cropobjects(list(self.cropobjects.values()), output, **kwargs)
+            return
+
+        # Exports must not overlap, they might write into the same file.
+        # An error of the previous export is still reported by the Clock.
+        self._join_export_thread()
+        snapshot = self._snapshot_cropobjects()
+        self._export_thread = threading.Thread(target=self._export_in_background,
+                                               args=(snapshot, output, kwargs))
+        self._export_thread.start()
+
+    def _export_in_background(self, cropobjects, output, kwargs):
+        try:
+            self._write_cropobjects(cropobjects, output, **kwargs)
+        except Exception as e:
+            logging.error('Model: Exporting CropObjects to {0} failed: {1}\n{2}'
+                          ''.format(output, e, traceback.format_exc()))
+            self._export_error = (output, e)
+            Clock.schedule_once(lambda dt: self._report_export_error())
+
+    def _join_export_thread(self):
+        if self._export_thread is not None:
+            self._export_thread.join()
+            self._export_thread = None
+
+    def wait_for_export(self):
+        """Blocks until the running background export (if any) is done.
+
+        :raises Exception: Whatever the background export raised,
+            if it has not been reported through ``on_export_failed`` yet.
+        """
+        self._join_export_thread()
+        if self._export_error is not None:
+            _, error = self._export_error
+            self._export_error = None
+            raise error
+
+    def _report_export_error(self):
+        if self._export_error is not None:
+            output, error = self._export_error
+            self._export_error = None
+            self.dispatch('on_export_failed', output, error)
+
+    def on_export_failed(self, output, error):
+        """Fired when a background export fails."""
+        pass
+
+    @staticmethod
+    def _write_cropobjects(cropobjects, output, **kwargs):
+        temp_output = output + '.temp'
+        try:
+            with codecs.open(temp_output, 'w', 'utf-8') as hdl:
+                write_cropobject_list(cropobjects, hdl, **kwargs)
+                hdl.write('\n')
+            os.replace(temp_output, output)
+        except Exception:
+            if os.path.isfile(temp_output):
+                os.remove(temp_output)
+            raise
+        logging.info('Model: Exported {0} CropObjects to {1}'
+                     ''.format(len(cropobjects), output))
+
+    def _snapshot_cropobjects(self, pack_masks=False):
+        """Copies the CropObjects so that further edits do not affect
+        the copies. The masks are copied too, because some tools edit
+        them in place.
+
+        :param pack_masks: If set, the masks of the copies are packed
+            into bits (see ``muscimarker_io.pack_cropobject_mask()``),
+            for pickling. Use ``unpack_cropobject_mask()`` to get
+            valid CropObjects back.
+        """
+        snapshot = []
+        for c in self.cropobjects.values():
+            c_copy = copy.copy(c)
+            c_copy.inlinks = list(c.inlinks)
+            c_copy.outlinks = list(c.outlinks)
+            c_copy.data = copy.deepcopy(c.data)
+            if pack_masks:
+                # Packing copies the mask.
+                c_copy = pack_cropobject_mask(c_copy)
+            if (c_copy.mask is c.mask) and (c.mask is not None):
+                c_copy.mask = c.mask.copy()
+            snapshot.append(c_copy)
+        return snapshot
 
     @Tracker(track_names=[],
              fn_name='model.clear_cropobjects',
              tracker_name='model')
     def clear_cropobjects(self):
+        self._clear_cropobjects()
+        self._journal('clear_cropobjects')
+
+    def _clear_cropobjects(self):
+        """The untracked and unjournaled implementation
+        of ``clear_cropobjects()``."""
         logging.info('Model: Clearing all {0} cropobjects.'.format(len(self.cropobjects)))
+        self._record_changed_objids(list(self.cropobjects.keys()))
         self.cropobjects = {}
+        self.cropobject_store.clear()
+        self.spatial_index.clear()
+        self._next_objid = 0
         self.sync_cropobjects_to_graph()
 
     def clear_relationships(self, label=None, cropobjects=None):
         """Removes all relationships with the given label. If no label is given
         (default), removes all relationships."""
-        if cropobjects is None:
-            objids = [objid for objid in self.cropobjects]
-        else:
-            objids = [c.objid for c in cropobjects]
-
         if label is None:
             edges = list(self.graph.edges.keys())
+        elif cropobjects is None:
+            edges = self.graph.edges_with_label(label)
         else:
-            edges = [(from_objid, to_objid) for from_objid, to_objid in self.graph.edges
-                     if (self.graph.edges[(from_objid, to_objid)] == label) and
-                        ((from_objid in objids) or (to_objid in objids))]
+            edges = set()
+            for c in cropobjects:
+                edges.update([(i, c.objid) for i in self.graph.inlinks_of(c.objid, label=label)])
+                edges.update([(c.objid, o) for o in self.graph.outlinks_of(c.objid, label=label)])
         self.ensure_remove_edges(edges)
 
 
+    def set_cropobject_clsname(self, objid, clsname):
+        """Changes the class of the given CropObject in place."""
+        c = self.cropobjects[objid]
+        c.clsname = clsname
+        self.cropobject_store.add(c)
+        self._record_changed_objids([objid])
+        self._journal('set_cropobject_clsname', objid, clsname)
+
     def import_classes_definition(self, mlclasses):
         """Overwrites previous mlclasses definition -- there can only be
         one active at the same time.
@@ -572,9 +1007,69 @@ class CropObjectAnnotatorModel(Widget):
         self.mlclasses_by_name = {m.name: m for m in mlclasses}
 
     def get_next_cropobject_id(self):
-        if len(self.cropobjects) == 0:
-            return 0
-        return max(self.cropobjects.keys()) + 1
+        """Returns the objid that the next new CropObject should get.
+        Adding a CropObject with this objid moves it forward."""
+        return self._next_objid
+
+    def reserve_cropobject_ids(self, n):
+        """Reserves ``n`` consecutive objids for CropObjects that will
+        be added later. Returns the first of them."""
+        first_objid = self._next_objid
+        self._next_objid += n
+        return first_objid
+
+    ##########################################################################
+    # Secondary indexes: CropObjects by position, class and staff
+
+    def find_objids_in_bbox(self, t, l, b, r):
+        """Returns the sorted objids of the CropObjects whose bounding
+        boxes intersect the given bounding box."""
+        return self.spatial_index.query_bbox(t, l, b, r)
+
+    def find_objids_at_point(self, row, col):
+        """Returns the sorted objids of the CropObjects whose bounding
+        boxes contain the given pixel."""
+        return self.spatial_index.query_point(row, col)
+
+    def find_nearest_objids(self, row, col, k=1):
+        """Returns the objids of the ``k`` CropObjects whose bounding boxes
+        are nearest to the given pixel, nearest first."""
+        return self.spatial_index.nearest(row, col, k=k)
+
+    def objids_with_clsname(self, *clsnames):
+        """Returns the sorted objids of the CropObjects that have
+        one of the given class names."""
+        return self.cropobject_store.objids_with_clsname(*clsnames)
+
+    def cropobjects_with_clsname(self, *clsnames):
+        """Returns the CropObjects that have one of the given
+        class names, sorted by objid."""
+        return [self.cropobjects[objid]
+                for objid in self.objids_with_clsname(*clsnames)]
+
+    def staff_objids(self):
+        return self.objids_with_clsname(_CONST.STAFF_CLSNAME)
+
+    def objids_attached_to_staff(self, staff_objid):
+        """Returns the sorted objids of the CropObjects that have
+        an attachment to the given staff."""
+        return sorted(self.graph.inlinks_of(staff_objid, label='Attachment'))
+
+    def objids_attached_to_staffs(self, staff_objids):
+        """Like ``objids_attached_to_staff()``, for many staffs at once.
+        Returns a list with the sorted objids for each of the given staffs.
+        Uses one snapshot of the graph for all the staffs."""
+        snapshot = self.graph.snapshot()
+        return [sorted(snapshot.inlinks_of(s, label='Attachment'))
+                if s in snapshot else []
+                for s in staff_objids]
+
+    def staffs_of(self, objid):
+        """Returns the sorted objids of the staffs to which
+        the given CropObject is attached."""
+        return sorted(o for o in self.graph.outlinks_of(objid, label='Attachment')
+                      if (o in self.cropobjects)
+                      and (self.cropobjects[o].clsname == _CONST.STAFF_CLSNAME))
 
     ##########################################################################
     # Synchronizing with the graph.
@@ -722,27 +1217,212 @@ class CropObjectAnnotatorModel(Widget):
         updated as well.
         """
         self.graph.ensure_remove_edge(from_objid, to_objid)
-        self.sync_graph_to_cropobjects(cropobjects=[self.cropobjects[from_objid],
-                                                    self.cropobjects[to_objid]])
+        self._sync_or_defer([self.cropobjects[from_objid],
+                             self.cropobjects[to_objid]])
+        self._journal('remove_edges', [(from_objid, to_objid)])
 
     def ensure_remove_edges(self, edges):
+        edges = list(edges)
         _affected_cropobjects = []
         for from_objid, to_objid in edges:
             self.graph.ensure_remove_edge(from_objid, to_objid)
             _affected_cropobjects.append(self.cropobjects[from_objid])
             _affected_cropobjects.append(self.cropobjects[to_objid])
-        self.sync_graph_to_cropobjects(cropobjects=_affected_cropobjects)
+        self._sync_or_defer(_affected_cropobjects)
+        self._journal('remove_edges', edges)
 
     def ensure_add_edge(self, edge, label='Attachment'):
         self.graph.ensure_add_edge(edge, label=label)
-        self.sync_graph_to_cropobjects(cropobjects=[self.cropobjects[edge[0]],
-                                                    self.cropobjects[edge[1]]])
+        self._sync_or_defer([self.cropobjects[edge[0]],
+                             self.cropobjects[edge[1]]])
+        self._journal('add_edges', [edge], label)
 
     def ensure_add_edges(self, edges, label='Attachment'):
+        edges = list(edges)
         self.graph.ensure_add_edges(edges=edges, label=label)
         _affected_objids = set(itertools.chain(*edges))
         _affected_cropobjects = [self.cropobjects[i] for i in _affected_objids]
-        self.sync_graph_to_cropobjects(cropobjects=_affected_cropobjects)
+        self._sync_or_defer(_affected_cropobjects)
+        self._journal('add_edges', edges, label)
+
+    ##########################################################################
+    # Journal of edits, for crash recovery
+
+    def _journal(self, operation, *args):
+        """Records an edit into the journal. Call this only after the edit
+        has been made, so that edits that fail are not replayed."""
+        if self.journal is not None:
+            self.journal.record(operation, *args)
+
+    def journal_image_edit(self, changed_region=None):
+        """Records a change of the model image into the journal. Call this
+        after the new image is loaded.
+
+        :param changed_region: The ``(top, left, bottom, right)`` bounding
+            box of the pixels that changed. Only this region of the image
+            is recorded. If not given, the whole image is recorded.
+        """
+        if self.journal is None:
+            return
+        if changed_region is None:
+            self._journal('update_image', self.image)
+            return
+        t, l, b, r = changed_region
+        self._journal('update_image_region', t, l, self.image[t:b, l:r])
+
+    def replay_journal(self, records):
+        """Re-does the edits recorded in a journal, on top of the state
+        from the journal's checkpoint. The replayed edits are not recorded
+        again. A record that cannot be replayed is logged and skipped,
+        so that one bad record does not lose all the edits after it.
+
+        :returns: The number of skipped records.
+        """
+        logging.info('Model: Replaying {0} journal records.'.format(len(records)))
+        journal = self.journal
+        self.journal = None
+        n_skipped = 0
+        try:
+            with self.batch():
+                for operation, args in records:
+                    try:
+                        self._replay_journal_record(operation, args)
+                    except Exception as e:
+                        logging.warn('Model: Could not replay journal record {0}{1},'
+                                     ' skipping it: {2}'.format(operation, args, e))
+                        n_skipped += 1
+        finally:
+            self.journal = journal
+        # The images are only loaded without precomputing while replaying,
+        # so that only the last one gets its components computed.
+        self._precompute_cc_cache()
+        return n_skipped
+
+    def _replay_journal_record(self, operation, args):
+        # Replaying must not show up in the tracking log as new work
+        # of the annotator, so only the untracked methods are used.
+        if operation == 'add_cropobject':
+            # The checks were done when the edit was recorded.
+            self._add_cropobject(unpack_cropobject_mask(args[0]), perform_checks=False)
+        elif operation == 'remove_cropobject':
+            self._remove_cropobject(*args)
+        elif operation == 'import_cropobjects':
+            cropobjects, clear = args
+            self._import_cropobjects([unpack_cropobject_mask(c) for c in cropobjects],
+                                     clear)
+        elif operation == 'clear_cropobjects':
+            self._clear_cropobjects()
+        elif operation == 'set_cropobject_clsname':
+            self.set_cropobject_clsname(*args)
+        elif operation == 'add_edges':
+            self.ensure_add_edges(*args)
+        elif operation == 'remove_edges':
+            self.ensure_remove_edges(*args)
+        elif operation == 'update_image':
+            self.load_image(args[0], do_preprocessing=False,
+                            update_temp=False, precompute=False)
+        elif operation == 'update_image_region':
+            t, l, region = args
+            image = self.image * 1
+            image[t:t + region.shape[0], l:l + region.shape[1]] = region
+            self.load_image(image, do_preprocessing=False,
+                            update_temp=False,
+                            changed_region=(t, l,
+                                            t + region.shape[0],
+                                            l + region.shape[1]),
+                            precompute=False)
+        else:
+            raise ValueError('Unknown journal operation: {0}'
+                             ''.format(operation))
+
+    ##########################################################################
+    # Batch updates
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Groups many changes of the model into one update of the views::
+
+            with model.batch():
+                for c in detected_cropobjects:
+                    model.add_cropobject(c)
+
+        Normally, every change of ``cropobjects`` or of the graph's
+        ``edges`` is dispatched right away, and the renderers redraw
+        everything each time. Inside the batch, the observers of these
+        properties are not notified and syncing the graph to the
+        CropObjects' inlinks and outlinks is postponed. At the end, the
+        CropObjects touched by the changes are synced, the properties are
+        dispatched once, and ``on_cropobjects_changed`` is fired with
+        the set of changed objids.
+
+        Until then, the graph is the authority on relationships:
+        the ``inlinks`` and ``outlinks`` of the CropObjects may be stale.
+
+        Batches can be nested; only the outermost one dispatches.
+        """
+        if self._batch_depth == 0:
+            self._begin_batch()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._commit_batch()
+
+    def in_batch(self):
+        return self._batch_depth > 0
+
+    def _begin_batch(self):
+        self._batch_changed_objids = set()
+        self._batch_pending_sync = set()
+        self._batch_graph_revision = self.graph.revision
+        self._batch_observers = {
+            'cropobjects': _suspend_property_observers(self, 'cropobjects'),
+            'edges': _suspend_property_observers(self.graph, 'edges'),
+        }
+
+    def _commit_batch(self):
+        changed_objids = self._batch_changed_objids
+        pending_sync = self._batch_pending_sync
+        self._batch_changed_objids = None
+        self._batch_pending_sync = None
+
+        self.sync_graph_to_cropobjects([self.cropobjects[objid]
+                                        for objid in pending_sync
+                                        if objid in self.cropobjects])
+
+        _resume_property_observers(self, 'cropobjects',
+                                   self._batch_observers['cropobjects'])
+        _resume_property_observers(self.graph, 'edges',
+                                   self._batch_observers['edges'])
+        self._batch_observers = None
+
+        if len(changed_objids) > 0:
+            self.property('cropobjects').dispatch(self)
+        if self.graph.revision != self._batch_graph_revision:
+            self.graph.property('edges').dispatch(self.graph)
+        if len(changed_objids) > 0:
+            self.dispatch('on_cropobjects_changed', changed_objids)
+
+    def on_cropobjects_changed(self, objids):
+        """Fired at the end of a batch with the set of objids of the
+        CropObjects that were added, removed, or relinked in it."""
+        pass
+
+    def _record_changed_objids(self, objids):
+        if self._batch_changed_objids is not None:
+            self._batch_changed_objids.update(objids)
+
+    def _sync_or_defer(self, cropobjects):
+        """Syncs the graph to the given CropObjects, or, inside a batch,
+        remembers them to be synced at its end."""
+        objids = [c.objid for c in cropobjects]
+        self._record_changed_objids(objids)
+        if self._batch_pending_sync is not None:
+            self._batch_pending_sync.update(objids)
+        else:
+            self.sync_graph_to_cropobjects(cropobjects)
 
     ##########################################################################
     # Integrity
@@ -754,16 +1434,8 @@ class CropObjectAnnotatorModel(Widget):
             raise ValueError('Cannot validate cropobjects without image')
         shape = self.image.shape
 
-        invalid_clsname_objs = []
-        oversized_objs = []
-        for c in list(self.cropobjects.values()):
-            clsname = c.clsname
-            if clsname not in self.mlclasses_by_name:
-                invalid_clsname_objs.append(c)
-            if c.top < 0 or c.left < 0:
-                oversized_objs.append(c)
-            if c.bottom > shape[0] or c.right > shape[1]:
-                oversized_objs.append(c)
+        invalid_clsname_objs = self.cropobject_store.find_invalid_clsnames(self.mlclasses_by_name)
+        oversized_objs = self.cropobject_store.find_outside(shape)
 
         if len(invalid_clsname_objs) > 0:
             return False
@@ -785,17 +1457,8 @@ class CropObjectAnnotatorModel(Widget):
         "Very small" means that their bounding box area is
         smaller than the given threshold or they consist of less
         than ``mask_threshold`` pixels."""
-        very_small_cropobjects = []
-
-        for c in list(self.cropobjects.values()):
-            total_masked_area = c.mask.sum()
-            total_bbox_area = c.width * c.height
-            if total_bbox_area < bbox_threshold:
-                very_small_cropobjects.append(c)
-            elif total_masked_area < mask_threshold:
-                very_small_cropobjects.append(c)
-
-        return list(set([c.objid for c in very_small_cropobjects]))
+        return self.cropobject_store.find_small(bbox_threshold=bbox_threshold,
+                                                mask_threshold=mask_threshold)
 
     def find_vertices_with_loops(self):
         loop_objids = []
@@ -847,15 +1510,36 @@ class CropObjectAnnotatorModel(Widget):
         in question. Ignores whether these staffs are already within
         the list of ``cropobjects`` passed to the function.
 
-        Wraps the ``muscima.graph.find_related_staffs()`` function.
+        Does what the ``muscima.graph.find_related_staffs()`` function does
+        for staffs attached directly to the cropobjects (or to which they
+        are attached), but queries a snapshot of the graph for all the
+        cropobjects at once, instead of building a ``NotationGraph``
+        of the whole document and searching it object by object.
 
         :param with_stafflines: If set, will also return all stafflines
             and staffspaces related to the discovered staffs.
         """
-        related_staffs = find_related_staffs(cropobjects,
-                                             list(self.cropobjects.values()),
-                                             with_stafflines=with_stafflines)
-        return related_staffs
+        snapshot = self.graph.snapshot()
+        query_objids = numpy.array([c.objid for c in cropobjects], dtype='int64')
+        query_objids = query_objids[numpy.isin(query_objids, snapshot.objids)]
+        if len(query_objids) == 0:
+            return []
+
+        staff_objids = set(self.staff_objids())
+        related_objids = [o for o in snapshot.neighborhood(query_objids,
+                                                           label='Attachment',
+                                                           inclusive=False)
+                          if o in staff_objids]
+
+        if with_stafflines and (len(related_objids) > 0):
+            staffline_objids = set(self.objids_with_clsname(
+                *_CONST.STAFFLINE_CROPOBJECT_CLSNAMES))
+            related_objids.extend(o for o in snapshot.bfs(related_objids,
+                                                          label='Attachment',
+                                                          max_depth=1)
+                                  if o in staffline_objids)
+
+        return [self.cropobjects[o] for o in related_objids]
 
     ##########################################################################
     # Keeping the model in a consistent state
@@ -878,30 +1562,169 @@ class CropObjectAnnotatorModel(Widget):
     ##########################################################################
     # Connected components: a useful thing to keep track of
     def _compute_cc_cache(self):
+        self._cancel_cc_future()
         logging.info('AnnotModel: Computing connected components...')
-        cc, labels, bboxes = compute_connected_components(self.image)
-        logging.info('AnnotModel: Got cc: {0}, labels: {1}, bboxes: {2}'
-                     ''.format(cc, labels.shape, len(bboxes)))
-        self._cc, self._labels, self._bboxes = cc, labels, bboxes
+        labels_path = self._generate_cc_labels_filename()
+        cc, labels, bboxes = compute_connected_components(self.image,
+                                                          labels_path=labels_path)
+        logging.info('AnnotModel: Got cc: {0}, labels: {1} {2}, bboxes: {3}'
+                     ''.format(cc, labels.shape, labels.dtype, len(bboxes)))
+        self._set_cc_cache(cc, labels, bboxes, labels_path)
         logging.info('AnnotModel: ...done, there are {0} labels.'.format(cc))
 
+    def _precompute_cc_cache(self):
+        """Starts computing the connected components of the current image
+        in the background, if ``precompute_cc`` is set and they are neither
+        cached nor being computed already."""
+        if (self.image is not None) and self.precompute_cc \
+                and self._cc_cache_is_empty and (self._cc_future is None):
+            self._start_cc_future()
+
+    def _start_cc_future(self):
+        """Starts computing the connected components of the current image
+        in a background thread. The image must not be edited in place
+        in the meantime (see ``image``)."""
+        self._cancel_cc_future()
+        logging.info('AnnotModel: Computing connected components in the background.')
+        labels_path = self._generate_cc_labels_filename()
+        self._cc_future = _BackgroundComputation(self._compute_cc_in_background,
+                                                 args=(self.image, labels_path),
+                                                 discard=self._discard_cc_result)
+        self._cc_future_labels_path = labels_path
+
+    @staticmethod
+    def _compute_cc_in_background(image, labels_path):
+        try:
+            return compute_connected_components(image, labels_path=labels_path) \
+                   + (labels_path,)
+        except Exception:
+            _remove_cc_labels_file(labels_path)
+            raise
+
+    @staticmethod
+    def _discard_cc_result(result):
+        _remove_cc_labels_file(result[-1])
+
+    def _generate_cc_labels_filename(self):
+        if not self.cc_labels_dir:
+            return None
+        random_string = str(uuid.uuid4())[:8]
+        return os.path.join(self.cc_labels_dir,
+                            'cc_labels__{0}.dat'.format(random_string))
+
+    def _set_cc_cache(self, max_label, labels, bboxes, labels_path):
+        self._release_cc_labels_file()
+        self._max_label, self._labels, self._bboxes = max_label, labels, bboxes
+        self._cc_labels_path = labels_path
+
+    def _release_cc_labels_file(self):
+        if self._cc_labels_path is not None:
+            self._labels = None
+            _remove_cc_labels_file(self._cc_labels_path)
+            self._cc_labels_path = None
+
+    def _cancel_cc_future(self):
+        if self._cc_future is not None:
+            # A computation that writes a labels file is waited for,
+            # so that the file is gone once the cache is invalidated.
+            self._cc_future.cancel(wait=self._cc_future_labels_path is not None)
+        self._cc_future = None
+        self._cc_future_region = None
+        self._cc_future_labels_path = None
+
+    def _add_cc_future_region(self, changed_region):
+        if self._cc_future_region is None:
+            self._cc_future_region = tuple(changed_region)
+            return
+        t, l, b, r = self._cc_future_region
+        c_t, c_l, c_b, c_r = changed_region
+        self._cc_future_region = (min(t, c_t), min(l, c_l), max(b, c_b), max(r, c_r))
+
+    def _collect_cc_future(self):
+        """Waits for the background computation of the connected components
+        and fills the cache with its result, updated with the image changes
+        made in the meantime. If the computation failed, the components
+        are computed right here instead."""
+        future, region = self._cc_future, self._cc_future_region
+        self._cc_future = None
+        self._cc_future_region = None
+        self._cc_future_labels_path = None
+        if not future.done():
+            logging.info('AnnotModel: Waiting for the connected components...')
+        try:
+            cc, labels, bboxes, labels_path = future.result()
+        except Exception as e:
+            logging.warn('AnnotModel: Background computation of connected'
+                         ' components failed, computing them again: {0}'.format(e))
+            self._compute_cc_cache()
+            return
+        self._set_cc_cache(cc, labels, bboxes, labels_path)
+        if region is not None:
+            # The image only differs from the one the components were
+            # computed from inside this region.
+            self._update_cc_cache(self.image, region)
+        logging.info('AnnotModel: Got connected components from the background,'
+                     ' there are {0} labels.'.format(len(bboxes)))
+
+    def is_cc_cache_ready(self):
+        """Returns True if ``cc``, ``labels`` and ``bboxes`` can be used
+        without waiting for the connected components to be computed."""
+        return (not self._cc_cache_is_empty) \
+               or ((self._cc_future is not None) and self._cc_future.done())
+
+    def _update_cc_cache(self, image, changed_region):
+        """Patches the cached connected components after the pixels
+        of the image in ``changed_region`` have changed. The labels array
+        and the bboxes dict are modified in place.
+
+        The labels are then no longer consecutive: ``max_label`` is
+        the highest label in use, which may be more than ``cc``.
+
+        If the new labels do not fit into the label image, the cache
+        is dropped instead."""
+        try:
+            self._max_label = update_connected_components(image, self._labels, self._bboxes,
+                                                          changed_region,
+                                                          max_label=self._max_label)
+        except OverflowError as e:
+            logging.info('AnnotModel: Cannot update cc, dropping them: {0}'.format(e))
+            self._invalidate_cc_cache()
+            return
+        logging.info('AnnotModel: Updated cc in region {0}, there are {1} labels.'
+                     ''.format(changed_region, len(self._bboxes)))
+
     def _invalidate_cc_cache(self):
-        self._cc = -1
+        self._cancel_cc_future()
+        self._release_cc_labels_file()
+        self._max_label = -1
         self._labels = None
         self._bboxes = None
 
     def _ensure_cc_cache(self):
+        if not self._cc_cache_is_empty:
+            return
+        if self._cc_future is not None:
+            self._collect_cc_future()
         if self._cc_cache_is_empty:
             self._compute_cc_cache()
 
     @property
     def _cc_cache_is_empty(self):
-        return self._cc < 0
+        return self._max_label < 0
 
     @property
     def cc(self):
+        """The number of connected components (not counting
+        the background)."""
+        self._ensure_cc_cache()
+        return len(self._bboxes) - (0 in self._bboxes)
+
+    @property
+    def max_label(self):
+        """The highest label in use in ``labels``. Once the components
+        have been updated after an edit, this is not the same as ``cc``."""
         self._ensure_cc_cache()
-        return self._cc
+        return self._max_label
 
     @property
     def labels(self):
@@ -1015,8 +1838,9 @@ class CropObjectAnnotatorModel(Widget):
 
         # Do false positive filtering here (per class)
 
-        for c in processed_cropobjects:
-            self.add_cropobject(c)
+        with self.batch():
+            for c in processed_cropobjects:
+                self.add_cropobject(c)
 
     def _detection_apply_margin(self, cropobjects, margin, bounding_box):
         """Checks if the CropObject aren't within the given margin. Note that this
@@ -1045,8 +1869,13 @@ class CropObjectAnnotatorModel(Widget):
             else:
                 return True
 
-        output_cropobjects = [c for c in cropobjects if _within_margin(c, margin, bounding_box)]
-        cropobjects_in_margin = [c for c in cropobjects if c not in output_cropobjects]
+        output_cropobjects = []
+        cropobjects_in_margin = []
+        for c in cropobjects:
+            if _within_margin(c, margin, bounding_box):
+                output_cropobjects.append(c)
+            else:
+                cropobjects_in_margin.append(c)
         logging.info('Detection: Bounding box: {0}'.format(bounding_box))
         logging.info('Detection: Margin: {0}'.format(margin))
         logging.info('Detection: Filtering out {0} cropobjects found only in the margin.'
@@ -1064,7 +1893,7 @@ class CropObjectAnnotatorModel(Widget):
         return cropobjects
 
     def _detection_apply_objids(self, cropobjects):
-        _delta_objid = self.get_next_cropobject_id()
+        _delta_objid = self.reserve_cropobject_ids(len(cropobjects))
         _next_objid = _delta_objid
 
         output_cropobjects = []
@@ -1091,23 +1920,29 @@ class CropObjectAnnotatorModel(Widget):
         :return:
         """
         # Note that stafflines get special treatment: only checked against width, not height.
-        tiny = [c for c in cropobjects if c.mask.sum() < min_mask_area]
-        logging.info('Detection: Filtering out {0} tiny cropobjects'.format(len(tiny)))
-        narrow = [c for c in cropobjects if c.width < min_size]
-        logging.info('Detection: Filtering out {0} narrow cropobjects'.format(len(narrow)))
-
-        output_stafflines = [c for c in cropobjects
-                             if (c.clsname == _CONST.STAFFLINE_CLSNAME) and (c.width >= min_size)]
-        duration_dots = [c for c in cropobjects
-                         if (c.clsname == 'duration-dot') \
-                            and (c.mask.sum() >= 10)]
-        output = [c for c in cropobjects
-                  if (c.clsname != _CONST.STAFFLINE_CLSNAME) \
-                    and (c.clsname != 'duration-dot')
-                    and (c.mask.sum() >= min_mask_area) \
-                    and (min(c.width, c.height) >= min_size)]
-
-        return output + output_stafflines + duration_dots
+        # (The detection results need not have unique objids yet,
+        #  so the columns are collected here rather than in a CropObjectStore.)
+        mask_areas = numpy.array([c.mask.sum() for c in cropobjects], dtype='int64')
+        widths = numpy.array([c.width for c in cropobjects], dtype='int64')
+        heights = numpy.array([c.height for c in cropobjects], dtype='int64')
+        clsnames = numpy.array([c.clsname for c in cropobjects], dtype=object)
+
+        tiny = mask_areas < min_mask_area
+        logging.info('Detection: Filtering out {0} tiny cropobjects'.format(tiny.sum()))
+        narrow = widths < min_size
+        logging.info('Detection: Filtering out {0} narrow cropobjects'.format(narrow.sum()))
+
+        is_staffline = clsnames == _CONST.STAFFLINE_CLSNAME
+        is_duration_dot = clsnames == 'duration-dot'
+
+        output_stafflines = is_staffline & ~narrow
+        duration_dots = is_duration_dot & (mask_areas >= 10)
+        output = ~is_staffline & ~is_duration_dot & ~tiny \
+                 & (numpy.minimum(widths, heights) >= min_size)
+
+        return [cropobjects[i] for i in numpy.flatnonzero(output)] \
+               + [cropobjects[i] for i in numpy.flatnonzero(output_stafflines)] \
+               + [cropobjects[i] for i in numpy.flatnonzero(duration_dots)]
 
     def _detection_filter_contained(self, cropobjects):
         """Filters out cropobjects that are fully within another object's bounding
@@ -1129,7 +1964,7 @@ class CropObjectAnnotatorModel(Widget):
         """Merges staffline fragments into stafflines. Can group them into staffs,
         add staffspaces, and add the various obligatory relationships of other
         objects to the staff objects. Required before attempting to export MIDI."""
-        if len([c for c in list(self.cropobjects.values()) if c.clsname == 'staff']) > 0:
+        if len(self.staff_objids()) > 0:
             logging.warn('Some stafflines have already been processed. Reprocessing'
                          ' is not certain to work.')
             # return
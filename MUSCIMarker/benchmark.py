@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+"""This is a script that runs micro-benchmarks of performance-critical
+parts of MUSCIMarker, so that regressions are visible.
+
+Available benchmarks:
+
+* ``mask_codec``: RLE mask encoding and decoding of all the CropObjects
+  in a CropObjectList file, compared against the original pure-Python
+  implementation. The bit-packed mask encoding is compared against RLE.
+* ``parse``: decoding ``<CropObject>`` XML elements into CropObjects
+  (objects/s), compared against the original decoder, and parsing
+  a whole file.
+* ``add_cropobjects``: adding CropObjects one by one to the annotator
+  model (each linked to the previous one), compared against syncing
+  the whole graph to the CropObjects after each addition. Needs Kivy.
+* ``connected_components``: bounding boxes and areas of the connected
+  components of a full-page score image, compared against the original
+  pixel-by-pixel implementation. Uses the default score image, not the
+  input file. Needs Kivy.
+* ``related_staffs``: finding the staffs related to all the CropObjects
+  of a synthetic page through a snapshot of the model's graph, compared
+  against ``muscima.graph.find_related_staffs()``. Needs Kivy.
+
+Example::
+
+    python -m MUSCIMarker.benchmark -b mask_codec -i MUSCIMarker/static/example_annotation.xml
+
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import division
+from builtins import range
+from builtins import map
+from builtins import str
+import argparse
+import logging
+import os
+import timeit
+
+import numpy
+from lxml import etree
+
+from MUSCIMarker.muscimarker_io import CropObject, CROPOBJECT_MASK_ORDER, \
+    parse_cropobject_list, _parse_cropobject_element
+
+__version__ = "0.0.1"
+__author__ = "Jan Hajic jr."
+
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(__file__),
+                             'static', 'example_annotation.xml')
+DEFAULT_IMAGE = os.path.join(os.path.dirname(__file__),
+                             'static', 'default_score_image.png')
+
+
+##############################################################################
+# Reference implementations. These are the original versions of functions
+# that have since been optimized, kept here to measure the speedup against.
+
+def _reference_encode_mask_rle(mask):
+    mask_flat = mask.flatten(order=CROPOBJECT_MASK_ORDER)
+
+    output_strings = []
+    current_run_type = 0
+    current_run_length = 0
+    for i in mask_flat:
+        if i == current_run_type:
+            current_run_length += 1
+        else:
+            s = '{0}:{1}'.format(current_run_type, current_run_length)
+            output_strings.append(s)
+            current_run_type = i
+            current_run_length = 1
+    s = '{0}:{1}'.format(current_run_type, current_run_length)
+    output_strings.append(s)
+    output = ' '.join(output_strings)
+    return output
+
+
+def _reference_decode_mask_rle(mask_string, shape):
+    values = []
+    for kv in mask_string.split(' '):
+        k_string, v_string = kv.split(':')
+        k, v = int(k_string), int(v_string)
+        vs = [k for _ in range(v)]
+        values.extend(vs)
+
+    mask = numpy.array(values).reshape(shape)
+    return mask
+
+
+def _reference_parse_cropobject_element(cropobject, lazy_masks=False):
+    objid = int(float(cropobject.findall('Id')[0].text))
+
+    clsname = None
+    if len(cropobject.findall('MLClassName')) > 0:
+        clsname = cropobject.findall('MLClassName')[0].text
+    else:
+        raise ValueError('CropObject {0}: no clsname provided.'.format(objid))
+
+    def _uses_xy(cropobject):
+        xs = cropobject.findall('Y')
+        ys = cropobject.findall('X')
+        return (len(xs) > 0) and (len(ys) > 0)
+    def _uses_topleft(cropobject):
+        xs = cropobject.findall('Top')
+        ys = cropobject.findall('Left')
+        return (len(xs) > 0) and (len(ys) > 0)
+
+    if _uses_xy(cropobject):
+        top = float(cropobject.findall('Y')[0].text)
+        left = float(cropobject.findall('X')[0].text)
+    elif _uses_topleft(cropobject):
+        top = float(cropobject.findall('Top')[0].text)
+        left = float(cropobject.findall('Left')[0].text)
+    else:
+        raise KeyError('Cropobject {0} has neither Top/Left, nor Y/Y'
+                       ' position information!'.format(objid))
+
+    width = float(cropobject.findall('Width')[0].text)
+    height = float(cropobject.findall('Height')[0].text)
+
+    inlinks = []
+    i_s = cropobject.findall('Inlinks')
+    if len(i_s) > 0:
+        i_s_text = cropobject.findall('Inlinks')[0].text
+        if i_s_text is not None:
+            inlinks = list(map(int, i_s_text.split(' ')))
+
+    outlinks = []
+    o_s = cropobject.findall('Outlinks')
+    if len(o_s) > 0:
+        o_s_text = cropobject.findall('Outlinks')[0].text
+        if o_s_text is not None:
+            outlinks = list(map(int, o_s_text.split(' ')))
+
+    obj = CropObject(objid=objid, clsname=clsname,
+                     top=top, left=left, width=width, height=height,
+                     inlinks=inlinks, outlinks=outlinks)
+
+    mask = None
+    m = cropobject.findall('Mask')
+    if len(m) > 0 and lazy_masks:
+        obj.set_mask_string(cropobject.findall('Mask')[0].text)
+    else:
+        if len(m) > 0:
+            mask = obj.decode_mask(cropobject.findall('Mask')[0].text,
+                                   shape=(obj.height, obj.width))
+        obj.set_mask(mask)
+    logging.debug('Created CropObject with ID {0}'.format(obj.objid))
+    return obj
+
+
+def _reference_add_cropobject(model, cropobject):
+    model.graph.add_vertex(cropobject.objid)
+    edges = []
+    for i in cropobject.inlinks:
+        edges.append((i, cropobject.objid))
+    for o in cropobject.outlinks:
+        edges.append((cropobject.objid, o))
+    model.graph.add_edges(edges)
+
+    model.cropobjects[cropobject.objid] = cropobject
+    model.cropobject_store.add(cropobject)
+    model.sync_graph_to_cropobjects()
+
+
+def _reference_connected_components2bboxes(labels):
+    bboxes = {}
+    for x, row in enumerate(labels):
+        for y, l in enumerate(row):
+            if l not in bboxes:
+                bboxes[l] = [x, y, x+1, y+1]
+            else:
+                box = bboxes[l]
+                if x < box[0]:
+                    box[0] = x
+                elif x + 1 > box[2]:
+                    box[2] = x + 1
+                if y < box[1]:
+                    box[1] = y
+                elif y + 1 > box[3]:
+                    box[3] = y + 1
+    return bboxes
+
+
+##############################################################################
+# Benchmarks
+
+def _time(fn, repeat):
+    """Returns the best time of ``repeat`` runs of ``fn()``, in seconds."""
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def _report(name, n_items, unit, t_new, t_reference=None):
+    line = '{0}: {1:.4f} s ({2:.0f} {3}/s)'.format(name, t_new,
+                                                   n_items / t_new, unit)
+    if t_reference is not None:
+        line += ', reference: {0:.4f} s, speedup {1:.1f}x' \
+                ''.format(t_reference, t_reference / t_new)
+    print(line)
+
+
+def benchmark_mask_codec(filename, repeat=5):
+    """Times RLE decoding and encoding of all masks in the given
+    CropObjectList file."""
+    root = etree.parse(filename).getroot()
+    mask_strings = []
+    shapes = []
+    for element in root.iter('CropObject'):
+        masks = element.findall('Mask')
+        if len(masks) == 0 or masks[0].text == 'None':
+            continue
+        mask_strings.append(masks[0].text)
+        shapes.append((int(float(element.findall('Height')[0].text)),
+                       int(float(element.findall('Width')[0].text))))
+    masks = [CropObject.decode_mask_rle(m, shape=s)
+             for m, s in zip(mask_strings, shapes)]
+    n_pixels = sum([m.size for m in masks])
+    logging.info('Benchmarking mask codec on {0} masks ({1} pixels)'
+                 ''.format(len(masks), n_pixels))
+
+    t_decode = _time(lambda: [CropObject.decode_mask_rle(m, shape=s)
+                              for m, s in zip(mask_strings, shapes)], repeat)
+    t_decode_ref = _time(lambda: [_reference_decode_mask_rle(m, shape=s)
+                                  for m, s in zip(mask_strings, shapes)], repeat)
+    _report('decode_mask_rle', n_pixels, 'px', t_decode, t_decode_ref)
+
+    t_encode = _time(lambda: [CropObject.encode_mask_rle(m) for m in masks], repeat)
+    t_encode_ref = _time(lambda: [_reference_encode_mask_rle(m) for m in masks], repeat)
+    _report('encode_mask_rle', n_pixels, 'px', t_encode, t_encode_ref)
+
+    packed_strings = [CropObject.encode_mask_packbits(m) for m in masks]
+    t_decode_packed = _time(lambda: [CropObject.decode_mask_packbits(m, shape=s)
+                                     for m, s in zip(packed_strings, shapes)], repeat)
+    _report('decode_mask_packbits', n_pixels, 'px', t_decode_packed, t_decode)
+    t_encode_packed = _time(lambda: [CropObject.encode_mask_packbits(m) for m in masks], repeat)
+    _report('encode_mask_packbits', n_pixels, 'px', t_encode_packed, t_encode)
+    logging.info('Mask strings: {0} chars in RLE, {1} chars bit-packed'
+                 ''.format(sum(map(len, mask_strings)), sum(map(len, packed_strings))))
+
+
+def benchmark_parse(filename, repeat=5):
+    """Times decoding the ``<CropObject>`` elements of the given
+    CropObjectList file into CropObjects, with and without decoding
+    the masks. The XML itself is parsed only once, beforehand."""
+    elements = list(etree.parse(filename).getroot().iter('CropObject'))
+    logging.info('Benchmarking CropObject element decoding on {0} objects'
+                 ''.format(len(elements)))
+
+    # The decoders must agree before their speed is worth comparing.
+    for e in elements:
+        if str(_parse_cropobject_element(e)) != str(_reference_parse_cropobject_element(e)):
+            raise ValueError('Decoders disagree on element:\n{0}'
+                             ''.format(etree.tostring(e)))
+
+    for lazy_masks in [False, True]:
+        t_parse = _time(lambda: [_parse_cropobject_element(e, lazy_masks=lazy_masks)
+                                 for e in elements], repeat)
+        t_parse_ref = _time(lambda: [_reference_parse_cropobject_element(e, lazy_masks=lazy_masks)
+                                     for e in elements], repeat)
+        _report('parse_cropobject_element (lazy_masks={0})'.format(lazy_masks),
+                len(elements), 'objs', t_parse, t_parse_ref)
+
+    # End-to-end, including reading the file.
+    t_file = _time(lambda: parse_cropobject_list(filename, lazy_masks=True), repeat)
+    _report('parse_cropobject_list (lazy_masks=True)', len(elements), 'objs', t_file)
+
+
+def benchmark_add_cropobjects(filename, repeat=5, n_cropobjects=1000):
+    """Times adding ``n_cropobjects`` CropObjects to an empty annotator
+    model, one by one. Each CropObject is attached to the previous one,
+    so that the graph has to be synced. The input file is not used."""
+    # The model needs Kivy, which the other benchmarks do not.
+    from muscima.cropobject import CropObject as MuscimaCropObject
+    from MUSCIMarker.annotator_model import CropObjectAnnotatorModel
+
+    def _chain():
+        return [MuscimaCropObject(i, 'notehead-full', 10 * i, 10, width=8, height=6,
+                                  outlinks=[i - 1] if i > 0 else [])
+                for i in range(n_cropobjects)]
+
+    def _add_all(add_fn):
+        model = CropObjectAnnotatorModel()
+        for c in _chain():
+            add_fn(model, c)
+        return model
+
+    def _add(model, c):
+        model._add_cropobject(c, perform_checks=False)
+
+    logging.info('Benchmarking adding {0} CropObjects to the model'
+                 ''.format(n_cropobjects))
+
+    model = _add_all(_add)
+    model_ref = _add_all(_reference_add_cropobject)
+    for objid, c in model_ref.cropobjects.items():
+        if sorted(model.cropobjects[objid].inlinks) != sorted(c.inlinks) \
+                or sorted(model.cropobjects[objid].outlinks) != sorted(c.outlinks):
+            raise ValueError('CropObject {0}: links differ from the reference.'
+                             ''.format(objid))
+
+    t_add = _time(lambda: _add_all(_add), repeat)
+    t_add_ref = _time(lambda: _add_all(_reference_add_cropobject), repeat)
+    _report('add_cropobject', n_cropobjects, 'objs', t_add, t_add_ref)
+
+
+def benchmark_connected_components(filename, repeat=5, image_filename=DEFAULT_IMAGE):
+    """Times computing the bounding boxes (and areas) of all connected
+    components of a full-page image. The CropObjectList file is not used."""
+    # utils needs Kivy, which the other benchmarks do not.
+    import scipy.misc
+    import skimage.measure
+    from MUSCIMarker.utils import connected_components2bboxes
+
+    image = scipy.misc.imread(image_filename, mode='L')
+    labels = skimage.measure.label(image, background=0)
+    logging.info('Benchmarking connected component bounding boxes on {0} image'
+                 ' with {1} components'.format(image.shape, labels.max()))
+
+    bboxes = connected_components2bboxes(labels)
+    bboxes_ref = _reference_connected_components2bboxes(labels)
+    if {int(l): b for l, b in bboxes_ref.items()} != bboxes:
+        raise ValueError('Bounding boxes differ from the reference.')
+
+    t_bboxes = _time(lambda: connected_components2bboxes(labels), repeat)
+    # The reference takes seconds on a full page.
+    t_bboxes_ref = _time(lambda: _reference_connected_components2bboxes(labels),
+                         min(repeat, 2))
+    _report('connected_components2bboxes', labels.size, 'px', t_bboxes, t_bboxes_ref)
+
+    t_areas = _time(lambda: connected_components2bboxes(labels, return_areas=True), repeat)
+    _report('connected_components2bboxes (return_areas=True)', labels.size, 'px', t_areas)
+
+
+def benchmark_connected_components_update(filename, repeat=5, image_filename=DEFAULT_IMAGE,
+                                          region_size=100):
+    """Times updating the connected components of a full-page image after
+    erasing a square region, against labeling the whole image again.
+    The CropObjectList file is not used."""
+    import scipy.misc
+    from MUSCIMarker.utils import compute_connected_components, update_connected_components
+
+    image = scipy.misc.imread(image_filename, mode='L')
+    cc, labels, bboxes = compute_connected_components(image)
+    t, l = image.shape[0] // 2, image.shape[1] // 2
+    region = (t, l, t + region_size, l + region_size)
+    logging.info('Benchmarking connected component updates on {0} image,'
+                 ' region {1}'.format(image.shape, region))
+
+    edited = image.copy()
+    edited[t:t + region_size, l:l + region_size] = 0
+
+    # Updating again with the same image and region gives the same result,
+    # so the runs can all patch the same labels.
+    max_label = update_connected_components(edited, labels, bboxes, region, cc)
+
+    def _update():
+        update_connected_components(edited, labels, bboxes, region, max_label)
+
+    def _full():
+        compute_connected_components(edited)
+
+    t_update = _time(_update, repeat)
+    t_full = _time(_full, repeat)
+    _report('update_connected_components', 1, 'region', t_update, t_full)
+
+
+def benchmark_related_staffs(filename, repeat=5, n_staffs=10, n_per_staff=200):
+    """Times finding the staffs (and their stafflines) related to all
+    the CropObjects of a synthetic page, through the model's graph snapshot,
+    compared against ``muscima.graph.find_related_staffs()``. Each staff
+    has ``n_per_staff`` noteheads attached to it, and each notehead has
+    a stem. The input file is not used. Needs Kivy."""
+    from muscima.cropobject import CropObject as MuscimaCropObject
+    from muscima.graph import find_related_staffs
+    from MUSCIMarker.annotator_model import CropObjectAnnotatorModel
+
+    cropobjects = []
+    for s in range(n_staffs):
+        staff_objid = len(cropobjects)
+        staff = MuscimaCropObject(staff_objid, 'staff', 100 * s, 0, width=1000, height=40)
+        cropobjects.append(staff)
+        for i in range(9):
+            clsname = 'staff_line' if i % 2 == 0 else 'staff_space'
+            cropobjects.append(MuscimaCropObject(len(cropobjects), clsname,
+                                                 100 * s + 5 * i, 0, width=1000, height=5))
+            staff.outlinks.append(cropobjects[-1].objid)
+        for i in range(n_per_staff):
+            stem = MuscimaCropObject(len(cropobjects) + 1, 'stem', 100 * s, 5 * i,
+                                     width=1, height=30)
+            notehead = MuscimaCropObject(len(cropobjects), 'notehead-full', 100 * s + 10, 5 * i,
+                                         width=5, height=4, outlinks=[staff_objid, stem.objid])
+            cropobjects.extend([notehead, stem])
+
+    model = CropObjectAnnotatorModel()
+    model.import_cropobjects(cropobjects)
+    all_cropobjects = list(model.cropobjects.values())
+    logging.info('Benchmarking related staffs of {0} CropObjects'.format(len(all_cropobjects)))
+
+    related = model.find_related_staffs(all_cropobjects)
+    related_ref = find_related_staffs(all_cropobjects, all_cropobjects)
+    if sorted(c.objid for c in related) != sorted(c.objid for c in related_ref):
+        raise ValueError('Related staffs differ from the reference.')
+
+    t_related = _time(lambda: model.find_related_staffs(all_cropobjects), repeat)
+    t_related_ref = _time(lambda: find_related_staffs(all_cropobjects, all_cropobjects),
+                          min(repeat, 2))
+    _report('find_related_staffs', len(all_cropobjects), 'objs', t_related, t_related_ref)
+
+    # After an edit, the snapshot has to be built again.
+    def _edit_and_find():
+        model.ensure_add_edge((cropobjects[11].objid, 0))
+        model.ensure_remove_edge(cropobjects[11].objid, 0)
+        model.find_related_staffs(all_cropobjects)
+
+    t_rebuild = _time(_edit_and_find, repeat)
+    _report('find_related_staffs (after an edit)', len(all_cropobjects), 'objs', t_rebuild)
+
+
+BENCHMARKS = {
+    'add_cropobjects': benchmark_add_cropobjects,
+    'connected_components': benchmark_connected_components,
+    'connected_components_update': benchmark_connected_components_update,
+    'mask_codec': benchmark_mask_codec,
+    'parse': benchmark_parse,
+    'related_staffs': benchmark_related_staffs,
+}
+
+
+##############################################################################
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__, add_help=True,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-b', '--benchmarks', nargs='+', action='store',
+                        default=sorted(BENCHMARKS.keys()),
+                        choices=sorted(BENCHMARKS.keys()),
+                        help='Which benchmarks to run. Runs all by default.')
+    parser.add_argument('-i', '--input', action='store', default=DEFAULT_INPUT,
+                        help='CropObjectList file to benchmark on.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Report the best of this many runs.')
+
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Turn on INFO messages.')
+    parser.add_argument('--debug', action='store_true',
+                        help='Turn on DEBUG messages.')
+
+    return parser
+
+
+def main(args):
+    logging.info('Starting main...')
+    for name in args.benchmarks:
+        BENCHMARKS[name](args.input, repeat=args.repeat)
+
+
+if __name__ == '__main__':
+    parser = build_argument_parser()
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    if args.debug:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
+
+    main(args)
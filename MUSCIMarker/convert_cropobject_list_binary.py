@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""This is a simple script that converts CropObject list files
+into the binary sidecar format, which loads much faster than XML.
+
+For each input ``file.xml``, the sidecar ``file.xml.npz`` is written
+next to it. MUSCIMarker then uses the sidecar when importing ``file.xml``,
+as long as the XML file has not changed since the conversion.
+
+With ``--to_xml``, converts sidecars (given as inputs) back to XML
+instead. Existing XML files are not overwritten unless ``--force``
+is given."""
+from __future__ import print_function, unicode_literals
+import argparse
+import codecs
+import logging
+import os
+import time
+
+from muscima.cropobject import CropObject
+from muscima.io import parse_cropobject_list, export_cropobject_list
+
+from MUSCIMarker.muscimarker_io import save_cropobject_list_binary, load_cropobject_list_binary, \
+    binary_sidecar_filename, is_binary_sidecar_fresh, CROPOBJECT_BINARY_SUFFIX
+
+__version__ = "0.0.1"
+__author__ = "Jan Hajic jr."
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__, add_help=True,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-i', '--inputs', nargs='+', required=True,
+                        help='Input CropObject list files.')
+    parser.add_argument('--to_xml', action='store_true',
+                        help='Convert binary sidecars back to XML.')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='Rewrite outputs even if they are up to date'
+                             ' (or, with --to_xml, if they exist).')
+
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Turn on INFO messages.')
+    parser.add_argument('--debug', action='store_true',
+                        help='Turn on DEBUG messages.')
+
+    return parser
+
+
+def main(args):
+    logging.info('Starting main...')
+    _start_time = time.time()
+
+    for f in args.inputs:
+        if args.to_xml:
+            if not f.endswith(CROPOBJECT_BINARY_SUFFIX):
+                raise ValueError('Not a binary CropObject list: {0}'.format(f))
+            output = f[:-len(CROPOBJECT_BINARY_SUFFIX)]
+            if os.path.isfile(output) and not args.force:
+                logging.warning('Output {0} exists, skipping.'.format(output))
+                continue
+            cropobjects = load_cropobject_list_binary(f, cropobject_class=CropObject)
+            with codecs.open(output, 'w', 'utf-8') as hdl:
+                hdl.write(export_cropobject_list(cropobjects))
+                hdl.write('\n')
+        else:
+            output = binary_sidecar_filename(f)
+            if is_binary_sidecar_fresh(output, f) and not args.force:
+                logging.info('Sidecar {0} is up to date, skipping.'.format(output))
+                continue
+            cropobjects = parse_cropobject_list(f)
+            save_cropobject_list_binary(cropobjects, output, source_filename=f)
+        logging.info('Converted {0} to {1}'.format(f, output))
+
+    _end_time = time.time()
+    logging.info('convert_cropobject_list_binary.py done in {0:.3f} s'
+                 ''.format(_end_time - _start_time))
+
+
+if __name__ == '__main__':
+    parser = build_argument_parser()
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    if args.debug:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
+
+    main(args)
@@ -0,0 +1,297 @@
+"""This module implements a column-oriented store of CropObject
+attributes, for queries over all the CropObjects at once.
+
+The CropObjects themselves stay where they are (e.g. in the annotator
+model's ``cropobjects`` dict). The store keeps a copy of their objids,
+bounding boxes, class names and mask areas in numpy arrays, one array
+per attribute, so that questions like "which objects are smaller
+than 10 pixels?" become a single numpy expression instead of a Python
+loop over the objects.
+
+>>> from MUSCIMarker.muscimarker_io import CropObject
+>>> store = CropObjectStore([CropObject(0, 'notehead-full', 10, 10, width=8, height=6),
+...                          CropObject(1, 'stem', 0, 17, width=1, height=16),
+...                          CropObject(2, 'notehead-full', 40, 30, width=8, height=6)])
+>>> len(store)
+3
+>>> store.objids_with_clsname('notehead-full')
+[0, 2]
+>>> store.find_small(bbox_threshold=20)
+[1]
+>>> store.remove(0)
+>>> store.count_by_clsname() == {'notehead-full': 1, 'stem': 1}
+True
+
+The store has to be kept in sync with the CropObjects: call ``add()``
+whenever a CropObject is added or changed and ``remove()`` when it is
+removed.
+"""
+from __future__ import print_function, unicode_literals, division
+
+from builtins import object
+import collections
+import logging
+
+import numpy
+
+__version__ = "0.0.1"
+__author__ = "Jan Hajic jr."
+
+
+class CropObjectStore(object):
+    """Keeps the objids, bounding boxes, class names and mask areas
+    of a set of CropObjects in numpy arrays.
+
+    The rows of the arrays are in no particular order: removing
+    a CropObject moves the last row into its place. Use ``objids``
+    to find out which CropObject a row belongs to, and ``rows()``
+    to go the other way.
+
+    :param cropobjects: The initial CropObjects.
+
+    :param compute_mask_areas: If set (default), the number of pixels
+        in each CropObject's mask is recorded. This needs the masks, so
+        turn it off if the masks have not been decoded and are not needed
+        (the ``mask_areas`` column is then filled with the bounding box
+        areas). CropObjects without a mask always get their bounding box
+        area, since they occupy the whole bounding box.
+    """
+    _INITIAL_CAPACITY = 64
+
+    _COLUMN_DTYPES = [('objids', 'int64'),
+                      ('tops', 'int64'),
+                      ('lefts', 'int64'),
+                      ('bottoms', 'int64'),
+                      ('rights', 'int64'),
+                      ('clsname_ids', 'int32'),
+                      ('mask_areas', 'int64')]
+
+    def __init__(self, cropobjects=(), compute_mask_areas=True):
+        self.compute_mask_areas = compute_mask_areas
+
+        self._n = 0
+        self._capacity = 0
+        self._columns = {}
+        self._allocate(max(self._INITIAL_CAPACITY, len(cropobjects)))
+
+        # objid --> row
+        self._rows = {}
+
+        # clsname <--> clsname id. Ids are never reused.
+        self.clsnames = []
+        self._clsname_ids = {}
+
+        # clsname id --> set of objids, kept up to date by add() and remove()
+        self._objids_by_clsname_id = collections.defaultdict(set)
+
+        for c in cropobjects:
+            self.add(c)
+
+    def _allocate(self, capacity):
+        for name, dtype in self._COLUMN_DTYPES:
+            column = numpy.zeros(capacity, dtype=dtype)
+            if name in self._columns:
+                column[:self._n] = self._columns[name][:self._n]
+            self._columns[name] = column
+        self._capacity = capacity
+
+    ##########################################################################
+    # Keeping in sync with the CropObjects
+
+    def add(self, cropobject):
+        """Records the given CropObject. If a CropObject with the same
+        objid is already in the store, its row is overwritten."""
+        objid = cropobject.objid
+        clsname_id = self._get_or_add_clsname_id(cropobject.clsname)
+        if objid in self._rows:
+            row = self._rows[objid]
+            # The class might have changed.
+            self._objids_by_clsname_id[int(self._columns['clsname_ids'][row])].discard(objid)
+        else:
+            if self._n == self._capacity:
+                self._allocate(2 * self._capacity)
+            row = self._n
+            self._n += 1
+            self._rows[objid] = row
+
+        t, l, b, r = cropobject.bounding_box
+        columns = self._columns
+        columns['objids'][row] = objid
+        columns['tops'][row] = t
+        columns['lefts'][row] = l
+        columns['bottoms'][row] = b
+        columns['rights'][row] = r
+        columns['clsname_ids'][row] = clsname_id
+        self._objids_by_clsname_id[clsname_id].add(objid)
+
+        mask_area = (b - t) * (r - l)
+        if self.compute_mask_areas:
+            mask = cropobject.mask
+            if mask is not None:
+                mask_area = int(numpy.count_nonzero(mask))
+        columns['mask_areas'][row] = mask_area
+
+    def extend(self, cropobjects):
+        """Records all the given CropObjects."""
+        if self._n + len(cropobjects) > self._capacity:
+            self._allocate(max(2 * self._capacity, self._n + len(cropobjects)))
+        for c in cropobjects:
+            self.add(c)
+
+    def remove(self, objid):
+        """Forgets the CropObject with the given objid."""
+        row = self._rows.pop(objid)
+        self._objids_by_clsname_id[int(self._columns['clsname_ids'][row])].discard(objid)
+        last = self._n - 1
+        if row != last:
+            for column in self._columns.values():
+                column[row] = column[last]
+            self._rows[int(self._columns['objids'][row])] = row
+        self._n -= 1
+
+    def clear(self):
+        """Forgets all the CropObjects."""
+        self._n = 0
+        self._rows = {}
+        self._objids_by_clsname_id = collections.defaultdict(set)
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, objid):
+        return objid in self._rows
+
+    def _get_or_add_clsname_id(self, clsname):
+        if clsname not in self._clsname_ids:
+            self._clsname_ids[clsname] = len(self.clsnames)
+            self.clsnames.append(clsname)
+        return self._clsname_ids[clsname]
+
+    def clsname_id(self, clsname):
+        """Returns the id of the given class name in the ``clsname_ids``
+        column, or -1 if no CropObject in the store ever had it."""
+        return self._clsname_ids.get(clsname, -1)
+
+    ##########################################################################
+    # Columns. These are views into the store: do not write into them,
+    # and do not keep them across changes of the store.
+
+    @property
+    def objids(self):
+        return self._columns['objids'][:self._n]
+
+    @property
+    def tops(self):
+        return self._columns['tops'][:self._n]
+
+    @property
+    def lefts(self):
+        return self._columns['lefts'][:self._n]
+
+    @property
+    def bottoms(self):
+        return self._columns['bottoms'][:self._n]
+
+    @property
+    def rights(self):
+        return self._columns['rights'][:self._n]
+
+    @property
+    def heights(self):
+        return self.bottoms - self.tops
+
+    @property
+    def widths(self):
+        return self.rights - self.lefts
+
+    @property
+    def bbox_areas(self):
+        return self.heights * self.widths
+
+    @property
+    def clsname_ids(self):
+        return self._columns['clsname_ids'][:self._n]
+
+    @property
+    def mask_areas(self):
+        return self._columns['mask_areas'][:self._n]
+
+    def rows(self, objids):
+        """Returns the rows of the given objids, as an integer array.
+
+        >>> from MUSCIMarker.muscimarker_io import CropObject
+        >>> store = CropObjectStore([CropObject(i, 'x', 0, 0, 1, 1) for i in [5, 3, 9]])
+        >>> store.rows([9, 5]).tolist()
+        [2, 0]
+
+        :raises KeyError: If some objid is not in the store.
+        """
+        missing = [o for o in objids if o not in self._rows]
+        if len(missing) > 0:
+            raise KeyError('CropObjectStore: objids not found: {0}'.format(missing))
+        return numpy.array([self._rows[o] for o in objids], dtype='int64')
+
+    ##########################################################################
+    # Queries
+
+    def select(self, row_mask):
+        """Returns the objids of the rows where ``row_mask`` is True,
+        as a list. The ``row_mask`` is typically an expression over
+        the columns, e.g. ``store.select(store.widths < 5)``."""
+        return self.objids[row_mask].tolist()
+
+    def clsname_mask(self, clsname):
+        """Returns a boolean array: which rows have the given class name."""
+        return self.clsname_ids == self.clsname_id(clsname)
+
+    def objids_with_clsname(self, *clsnames):
+        """Returns the sorted objids of the CropObjects that have one
+        of the given class names. Does not scan the columns: the objids
+        of each class are kept in an index."""
+        objids = set()
+        for clsname in clsnames:
+            clsname_id = self.clsname_id(clsname)
+            if clsname_id in self._objids_by_clsname_id:
+                objids.update(self._objids_by_clsname_id[clsname_id])
+        return sorted(objids)
+
+    def count_by_clsname(self):
+        """Returns a dict: how many CropObjects there are of each class."""
+        return {self.clsnames[i]: len(objids)
+                for i, objids in self._objids_by_clsname_id.items()
+                if len(objids) > 0}
+
+    def find_small(self, bbox_threshold=10, mask_threshold=None):
+        """Returns the objids of CropObjects whose bounding box area
+        is smaller than ``bbox_threshold``, or which have fewer than
+        ``mask_threshold`` pixels in their mask (if given)."""
+        small = self.bbox_areas < bbox_threshold
+        if mask_threshold is not None:
+            if not self.compute_mask_areas:
+                logging.warning('CropObjectStore: mask areas were not computed,'
+                                ' using bounding box areas instead.')
+            small |= self.mask_areas < mask_threshold
+        return self.select(small)
+
+    def find_outside(self, shape):
+        """Returns the objids of CropObjects that do not fit into an image
+        of the given ``(height, width)`` shape."""
+        outside = (self.tops < 0) | (self.lefts < 0) \
+                  | (self.bottoms > shape[0]) | (self.rights > shape[1])
+        return self.select(outside)
+
+    def find_invalid_clsnames(self, valid_clsnames):
+        """Returns the objids of CropObjects whose class name
+        is not among the ``valid_clsnames``."""
+        valid_ids = [self._clsname_ids[c] for c in valid_clsnames
+                     if c in self._clsname_ids]
+        return self.select(~numpy.isin(self.clsname_ids, valid_ids))
+
+    def average_bbox_size(self, clsname):
+        """Returns the average ``(height, width)`` of the CropObjects
+        with the given class name. If there are none, returns NaNs."""
+        objids = self.objids_with_clsname(clsname)
+        if len(objids) == 0:
+            return float('nan'), float('nan')
+        rows = self.rows(objids)
+        return float(self.heights[rows].mean()), float(self.widths[rows].mean())
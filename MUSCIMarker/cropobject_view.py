@@ -421,8 +421,7 @@ class CropObjectView(SelectableView, ToggleButton):
         self.destroy_mlclass_selection_spinner()
 
     def set_mlclass(self, clsname):
-        # This should be wrapped in some cropobject's set_class method.
-        self._model_counterpart.clsname = clsname
+        self._model.set_cropobject_clsname(self.objid, clsname)
         self.cropobject.clsname = clsname
         # We should also check that the new class name is consistent
         # with the edges...
@@ -0,0 +1,206 @@
+"""This module implements a write-ahead journal of edits, for recovering
+the annotation work after a crash.
+
+Instead of pickling the whole application state every few seconds,
+MUSCIMarker writes a full *checkpoint* of the state only now and then,
+and in between appends every edit of the model (adding or removing
+a CropObject, adding or removing edges, changing a region of the image...)
+to a journal file, as it happens. Recovery loads the last checkpoint and
+replays the journal on top of it. Writing a checkpoint empties the journal,
+so the journal only ever holds the edits since the last checkpoint.
+
+>>> import tempfile
+>>> journal = EditJournal(os.path.join(tempfile.mkdtemp(), 'state.pkl'))
+>>> journal.checkpoint({'cropobjects': []})
+>>> journal.record('remove_cropobject', 12)
+>>> journal.record('add_edges', [(1, 2)], 'Attachment')
+>>> journal.n_records
+2
+>>> state, records = journal.load()
+>>> state
+{'cropobjects': []}
+>>> records
+[('remove_cropobject', (12,)), ('add_edges', ([(1, 2)], 'Attachment'))]
+
+A record is a pair ``(operation, args)``. The journal does not know what
+the operations mean; the CropObjectAnnotatorModel records and replays
+them. Each record is pickled when it is recorded, so later changes to the
+recorded objects do not affect it.
+
+The journal is split into numbered *segments*. Starting a checkpoint
+closes the current segment and opens the next one, so that the checkpoint
+can be written (e.g. in a background thread) while new edits keep coming
+into the new segment. The checkpoint remembers the first segment it does
+not include, and the older segments are only deleted after the checkpoint
+has been written. A crash at any point thus leaves a checkpoint and the
+segments with exactly the edits that are missing from it.
+
+If the application crashes in the middle of writing a record, the broken
+record at the end of the journal is ignored on loading.
+"""
+from __future__ import print_function, unicode_literals, division
+
+from builtins import object
+import logging
+import os
+import pickle
+
+__version__ = "0.0.1"
+__author__ = "Jan Hajic jr."
+
+
+JOURNAL_SUFFIX = '.journal'
+
+#: The key under which the checkpoint stores its first journal segment.
+_SEGMENT_KEY = '_journal_segment'
+
+
+class EditJournal(object):
+    """Keeps the checkpoint and the journal of edits since that checkpoint.
+
+    :param checkpoint_path: Where the checkpoint is stored. The journal
+        segments are stored next to it, with the ``.journal.<number>``
+        suffix added.
+    """
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+
+        self._hdl = None
+        self.n_records = 0
+
+        # Never append to a segment left over from an earlier run:
+        # it may end with a broken record.
+        existing_segments = self._existing_segments()
+        if len(existing_segments) > 0:
+            self.segment = existing_segments[-1] + 1
+        else:
+            self.segment = 0
+
+    def segment_path(self, segment):
+        return '{0}{1}.{2}'.format(self.checkpoint_path, JOURNAL_SUFFIX, segment)
+
+    @property
+    def journal_path(self):
+        """The file into which the records currently go."""
+        return self.segment_path(self.segment)
+
+    def _existing_segments(self):
+        """Returns the sorted numbers of the segment files on disk."""
+        journal_dir = os.path.dirname(self.checkpoint_path) or '.'
+        if not os.path.isdir(journal_dir):
+            return []
+        prefix = os.path.basename(self.checkpoint_path) + JOURNAL_SUFFIX + '.'
+        segments = []
+        for fname in os.listdir(journal_dir):
+            if fname.startswith(prefix) and fname[len(prefix):].isdigit():
+                segments.append(int(fname[len(prefix):]))
+        return sorted(segments)
+
+    def _ensure_open(self):
+        if self._hdl is None:
+            journal_dir = os.path.dirname(self.journal_path)
+            if journal_dir and not os.path.isdir(journal_dir):
+                os.makedirs(journal_dir)
+            self._hdl = open(self.journal_path, 'ab')
+
+    def close(self):
+        if self._hdl is not None:
+            self._hdl.close()
+            self._hdl = None
+
+    def record(self, operation, *args):
+        """Appends the given operation to the journal."""
+        self._ensure_open()
+        data = pickle.dumps((operation, args), protocol=pickle.HIGHEST_PROTOCOL)
+        self._hdl.write(data)
+        # Without flushing, the record would wait in the buffer
+        # and get lost in a crash.
+        self._hdl.flush()
+        self.n_records += 1
+
+    def start_checkpoint(self):
+        """Closes the current segment: the records made from now on go
+        into the next one. Returns the number of the new segment, which is
+        the first segment that the checkpoint of the current state will
+        not include. Pass it to ``write_checkpoint()``."""
+        self.close()
+        self.segment += 1
+        self.n_records = 0
+        return self.segment
+
+    def write_checkpoint(self, state, first_segment):
+        """Writes the given state as the new checkpoint and deletes the
+        journal segments that it includes. Only touches the files, so it
+        can run in a background thread.
+
+        :param state: A dict, as returned by ``load()``.
+
+        :param first_segment: The value returned by ``start_checkpoint()``
+            when the state was taken.
+        """
+        state = dict(state)
+        state[_SEGMENT_KEY] = first_segment
+
+        # Cautious behavior: let's try not to destroy the previous
+        # checkpoint until we are sure the new one has been written correctly.
+        temp_path = self.checkpoint_path + '.temp'
+        try:
+            with open(temp_path, 'wb') as hdl:
+                pickle.dump(state, hdl, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            logging.warn('EditJournal: Saving checkpoint {0} failed.'
+                         ''.format(self.checkpoint_path))
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        os.rename(temp_path, self.checkpoint_path)
+
+        for segment in self._existing_segments():
+            if segment < first_segment:
+                os.remove(self.segment_path(segment))
+
+    def checkpoint(self, state):
+        """Writes the given state as the new checkpoint and empties
+        the journal: its records are all included in the state."""
+        self.write_checkpoint(state, self.start_checkpoint())
+
+    def load(self):
+        """Returns the checkpoint state (None if there is no checkpoint)
+        and the list of journal records since then."""
+        state = None
+        first_segment = 0
+        if os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rb') as hdl:
+                state = pickle.load(hdl)
+            if isinstance(state, dict):
+                first_segment = state.pop(_SEGMENT_KEY, 0)
+
+        records = []
+        for segment in self._existing_segments():
+            if segment < first_segment:
+                continue
+            is_broken = self._load_segment(segment, records)
+            if is_broken:
+                # The later records may depend on the lost ones.
+                break
+        return state, records
+
+    def _load_segment(self, segment, records):
+        """Appends the records from the given segment to ``records``.
+        Returns True if the segment ends with a broken record."""
+        path = self.segment_path(segment)
+        with open(path, 'rb') as hdl:
+            while True:
+                try:
+                    records.append(pickle.load(hdl))
+                except EOFError:
+                    return False
+                except (pickle.UnpicklingError, ValueError, TypeError,
+                        AttributeError, IndexError) as e:
+                    logging.warn('EditJournal: Broken record no. {0} in {1},'
+                                 ' ignoring the rest of the journal: {2}'
+                                 ''.format(len(records), path, e))
+                    return True
@@ -260,11 +260,6 @@ class ConnectedComponentBoundingBoxTracer(BoundingBoxTracer):
 
     # current_postprocessed_bbox = DictProperty()
 
-    # Caches.
-    _cc = NumericProperty(-1)
-    _labels = ObjectProperty(None)
-    _bboxes = ObjectProperty(None)
-
     def on_current_selected_bbox(self, instance, pos):
         """Recompute to snap to connected components within the selection.
         """
@@ -288,26 +283,16 @@ class ConnectedComponentBoundingBoxTracer(BoundingBoxTracer):
             logging.info('CCSelect: Processed single click; adjusted '
                          'Img box {0}'.format(img_box))
 
-        # Compute bboxes from the image (unless cached already).
-        #if self._bboxes is None:
-        self._cc = app.annot_model.cc
-        self._labels = app.annot_model.labels
-        self._bboxes = app.annot_model.bboxes
-            # image = app.annot_model.image
-            # logging.info('CCselect: Recomputing bboxes...')
-            # if (self._cc < 0) or (self._labels is None):
-            #     #self._cc, self._labels = cv2.connectedComponents(image)
-            #     self._labels = skimage.measure.label(image, background=0)
-            #     logging.warn('CCSelect: found {0} CCs in total. Labels dtype; {1}, cc total type: {2}'
-            #                  ''.format(self._labels.max(), self._labels.dtype, type(self._cc)))
-            #     self._cc = int(self._labels.max())
-            # self._bboxes = connected_components2bboxes(self._labels)
+        # The model caches the components; they are not kept here,
+        # because the model may replace them whenever the image changes.
+        labels = app.annot_model.labels
+        bboxes = app.annot_model.bboxes
 
         # Find components that are inside the selection.
-        selected_labels = set(self._labels[img_t:img_b, img_l:img_r].flatten())
+        selected_labels = numpy.unique(labels[img_t:img_b, img_l:img_r]).tolist()
         logging.info('CCSelect: Selected labels: {0}'.format(selected_labels))
-        logging.info('CCSelect: bboxes: {0}'.format(self._bboxes))
-        selected_label_bboxes = numpy.array([self._bboxes[l] for l in selected_labels
+        logging.info('CCSelect: bboxes: {0}'.format(len(bboxes)))
+        selected_label_bboxes = numpy.array([bboxes[l] for l in selected_labels
                                              if l != 0])  # Exclude background CC
         logging.info('CCSelect: Selected bboxes: {0}'.format(selected_label_bboxes))
 
@@ -0,0 +1,311 @@
+"""This module implements an immutable snapshot of an ObjectGraph,
+for running many graph queries at once.
+
+The ObjectGraph keeps its edges in Kivy dicts of sets, which is
+convenient for editing, but slow when analysis code asks for
+neighborhoods, descendants or connected groups of many objects. The
+snapshot stores the adjacency of each edge label in compressed sparse
+row (CSR) form -- an ``indptr`` and an ``indices`` array per direction --
+so that whole frontiers of a breadth-first search are expanded with
+a few numpy operations, and unbounded searches and connected components
+are left to ``scipy.sparse.csgraph``.
+
+>>> edges = {(0, 1): 'Attachment', (1, 2): 'Attachment', (3, 2): 'Precedence'}
+>>> snapshot = GraphSnapshot([0, 1, 2, 3, 4], edges)
+>>> snapshot.descendants([0])
+[1, 2]
+>>> snapshot.ancestors([2], label='Attachment')
+[0, 1]
+>>> snapshot.connected_groups(label='Attachment')
+[[0, 1, 2], [3], [4]]
+>>> snapshot.connected_groups()
+[[0, 1, 2, 3], [4]]
+
+Do not build snapshots directly from a live graph; use
+``ObjectGraph.snapshot()``, which caches the snapshot until
+the graph changes.
+"""
+from __future__ import print_function, unicode_literals, division
+
+from builtins import object
+
+import numpy
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, breadth_first_order
+
+__version__ = "0.0.1"
+__author__ = "Jan Hajic jr."
+
+
+def _readonly(a):
+    a.flags.writeable = False
+    return a
+
+
+class _CSRAdjacency(object):
+    """The edges of one label (or all edges), in both directions.
+    Vertices are referred to by their index in the snapshot."""
+    def __init__(self, sources, targets, n_vertices):
+        self.n_vertices = n_vertices
+        self.out_indptr, self.out_indices = self._build(sources, targets, n_vertices)
+        self.in_indptr, self.in_indices = self._build(targets, sources, n_vertices)
+
+    @staticmethod
+    def _build(sources, targets, n_vertices):
+        order = numpy.argsort(sources, kind='stable')
+        indices = targets[order]
+        counts = numpy.bincount(sources, minlength=n_vertices)
+        indptr = numpy.zeros(n_vertices + 1, dtype='int64')
+        numpy.cumsum(counts, out=indptr[1:])
+        return _readonly(indptr), _readonly(indices)
+
+    def arrays(self, direction):
+        if direction == 'out':
+            return self.out_indptr, self.out_indices
+        elif direction == 'in':
+            return self.in_indptr, self.in_indices
+        raise ValueError('Unknown direction: {0}'.format(direction))
+
+    def neighbors(self, idxs, direction):
+        """Returns the indices of all the neighbors of the given
+        vertex indices (with repetitions)."""
+        indptr, indices = self.arrays(direction)
+        starts = indptr[idxs]
+        lengths = indptr[idxs + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return numpy.zeros(0, dtype='int64')
+        # Concatenated ranges [start, start + length) for every vertex.
+        offsets = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths)
+        return indices[offsets + numpy.arange(total)]
+
+
+class GraphSnapshot(object):
+    """A read-only copy of the vertices and labeled edges of an
+    ObjectGraph, with the adjacency stored in CSR arrays.
+
+    The vertices are identified by their ``objid`` in all the public
+    methods. Internally, they are numbered by their position in the sorted
+    ``objids`` array.
+
+    :param vertices: The objids of the vertices.
+
+    :param edges: A dict of ``(from, to): label``, like ``ObjectGraph.edges``.
+        Edges to objids that are not among the ``vertices`` add those
+        objids as vertices.
+
+    :param revision: The revision of the graph that the snapshot was
+        taken from.
+    """
+    def __init__(self, vertices, edges, revision=None):
+        self.revision = revision
+
+        edge_list = list(edges.items())
+        sources = numpy.array([a1 for (a1, _), _ in edge_list], dtype='int64')
+        targets = numpy.array([a2 for (_, a2), _ in edge_list], dtype='int64')
+        edge_labels = [l for _, l in edge_list]
+
+        self.objids = _readonly(numpy.union1d(numpy.array(list(vertices), dtype='int64'),
+                                              numpy.concatenate([sources, targets])))
+        n_vertices = len(self.objids)
+
+        source_idxs = numpy.searchsorted(self.objids, sources)
+        target_idxs = numpy.searchsorted(self.objids, targets)
+
+        self.labels = sorted(set(edge_labels))
+        label_ids = numpy.array([self.labels.index(l) for l in edge_labels]
+                                if len(edge_list) > 0 else [], dtype='int64')
+
+        self._adjacency = {None: _CSRAdjacency(source_idxs, target_idxs, n_vertices)}
+        for i, label in enumerate(self.labels):
+            in_label = label_ids == i
+            self._adjacency[label] = _CSRAdjacency(source_idxs[in_label],
+                                                   target_idxs[in_label],
+                                                   n_vertices)
+
+    def __len__(self):
+        return len(self.objids)
+
+    def __contains__(self, objid):
+        i = numpy.searchsorted(self.objids, objid)
+        return i < len(self.objids) and self.objids[i] == objid
+
+    @property
+    def n_edges(self):
+        return len(self._adjacency[None].out_indices)
+
+    def indices(self, objids):
+        """Returns the positions of the given objids in ``objids``.
+
+        :raises KeyError: If some objid is not in the snapshot.
+        """
+        objids = numpy.asarray(objids, dtype='int64').ravel()
+        idxs = numpy.searchsorted(self.objids, objids)
+        found = idxs < len(self.objids)
+        found[found] = self.objids[idxs[found]] == objids[found]
+        if not found.all():
+            raise KeyError('GraphSnapshot: objids not found: {0}'
+                           ''.format(objids[~found].tolist()))
+        return idxs
+
+    def adjacency(self, label=None):
+        """Returns ``(indptr, indices)`` of the outgoing edges with the
+        given label (all edges if ``label`` is None). The outlinks of the
+        vertex at position ``i`` are ``objids[indices[indptr[i]:indptr[i+1]]]``.
+        """
+        return self._get_adjacency(label).arrays('out')
+
+    def _get_adjacency(self, label):
+        if label not in self._adjacency:
+            # No edges with this label.
+            self._adjacency[label] = _CSRAdjacency(numpy.zeros(0, dtype='int64'),
+                                                   numpy.zeros(0, dtype='int64'),
+                                                   len(self.objids))
+        return self._adjacency[label]
+
+    def _directions(self, direction):
+        if direction == 'both':
+            return ['out', 'in']
+        return [direction]
+
+    ##########################################################################
+    # Neighbors
+
+    def outlinks_of(self, objid, label=None):
+        adjacency = self._get_adjacency(label)
+        return self.objids[adjacency.neighbors(self.indices([objid]), 'out')].tolist()
+
+    def inlinks_of(self, objid, label=None):
+        adjacency = self._get_adjacency(label)
+        return self.objids[adjacency.neighbors(self.indices([objid]), 'in')].tolist()
+
+    def neighborhood(self, objids, label=None, inclusive=True):
+        """Returns the sorted objids of all the undirected neighbors
+        of the given objects, like ``ObjectGraph.get_neighborhood()``,
+        but for many objects at once.
+
+        :param inclusive: Should the output include the given objects?
+        """
+        idxs = self.indices(objids)
+        adjacency = self._get_adjacency(label)
+        neighbors = [adjacency.neighbors(idxs, 'out'), adjacency.neighbors(idxs, 'in')]
+        if inclusive:
+            neighbors.append(idxs)
+        return self.objids[numpy.unique(numpy.concatenate(neighbors))].tolist()
+
+    ##########################################################################
+    # Traversals
+
+    def reachable_mask(self, objids, label=None, direction='out', max_depth=None):
+        """Breadth-first search from the given objects, one whole frontier
+        at a time. Returns a boolean array over ``objids``: which vertices
+        can be reached from the given ones, along edges with the given label.
+        The given objects themselves are included.
+
+        :param direction: Follow the edges forward (``'out'``), backward
+            (``'in'``), or both ways (``'both'``).
+
+        :param max_depth: Only follow paths up to this many edges long.
+            Unlimited by default.
+        """
+        adjacency = self._get_adjacency(label)
+        directions = self._directions(direction)
+
+        visited = numpy.zeros(len(self.objids), dtype=bool)
+        frontier = numpy.unique(self.indices(objids))
+        visited[frontier] = True
+        if max_depth is None:
+            # Long chains would take one numpy round per edge;
+            # let scipy run the whole search instead.
+            visited[self._scipy_reachable(adjacency, frontier, direction)] = True
+            return visited
+        depth = 0
+        while len(frontier) > 0 and (max_depth is None or depth < max_depth):
+            neighbors = numpy.concatenate([adjacency.neighbors(frontier, d)
+                                           for d in directions])
+            neighbors = numpy.unique(neighbors)
+            frontier = neighbors[~visited[neighbors]]
+            visited[frontier] = True
+            depth += 1
+        return visited
+
+    def _scipy_reachable(self, adjacency, sources, direction):
+        # A virtual vertex with edges to all the sources, so that
+        # a single search starts from all of them.
+        n = len(self.objids)
+        indptr, indices = adjacency.arrays('in' if direction == 'in' else 'out')
+        indptr = numpy.concatenate([indptr, [indptr[-1] + len(sources)]])
+        indices = numpy.concatenate([indices, sources])
+        matrix = csr_matrix((numpy.ones(len(indices), dtype='int8'), indices, indptr),
+                            shape=(n + 1, n + 1))
+        order = breadth_first_order(matrix, n, directed=(direction != 'both'),
+                                    return_predecessors=False)
+        return order[order < n]
+
+    def bfs(self, objids, label=None, direction='out', max_depth=None):
+        """Returns the sorted objids of everything reachable from the given
+        objects, including themselves. See ``reachable_mask()``."""
+        return self.objids[self.reachable_mask(objids, label=label,
+                                               direction=direction,
+                                               max_depth=max_depth)].tolist()
+
+    def descendants(self, objids, label=None):
+        """Returns the sorted objids of all objects reachable from
+        the given ones by following edges forward. The given objects are
+        not included, unless they are reachable from another given object
+        (or from themselves, through a cycle)."""
+        return self._strict_reachable(objids, label, 'out')
+
+    def ancestors(self, objids, label=None):
+        """Returns the sorted objids of all objects from which one of
+        the given ones can be reached. Counterpart of ``descendants()``."""
+        return self._strict_reachable(objids, label, 'in')
+
+    def _strict_reachable(self, objids, label, direction):
+        # Start from the neighbors, so that the given objects are only
+        # included if there is a path to them.
+        adjacency = self._get_adjacency(label)
+        start = numpy.unique(adjacency.neighbors(self.indices(objids), direction))
+        if len(start) == 0:
+            return []
+        return self.bfs(self.objids[start], label=label, direction=direction)
+
+    ##########################################################################
+    # Components
+
+    def component_labels(self, label=None):
+        """Returns an integer array over ``objids``: the weakly connected
+        component of each vertex, considering only edges with the given
+        label. Components are numbered from 0 in the order of their
+        smallest objid."""
+        adjacency = self._get_adjacency(label)
+        n = len(self.objids)
+        matrix = csr_matrix((numpy.ones(len(adjacency.out_indices), dtype='int8'),
+                             adjacency.out_indices, adjacency.out_indptr),
+                            shape=(n, n))
+        _, components = connected_components(matrix, directed=True, connection='weak')
+        # Renumber the components by their first vertex.
+        _, first, inverse = numpy.unique(components, return_index=True, return_inverse=True)
+        order = numpy.argsort(numpy.argsort(first))
+        return order[inverse]
+
+    def connected_groups(self, label=None, objids=None):
+        """Returns the weakly connected components as lists of objids,
+        ordered by their smallest objid.
+
+        :param objids: If given, only return the components that contain
+            some of these objects.
+        """
+        components = self.component_labels(label=label)
+        if objids is not None:
+            wanted = numpy.unique(components[self.indices(objids)])
+            in_wanted = numpy.isin(components, wanted)
+        else:
+            in_wanted = numpy.ones(len(components), dtype=bool)
+
+        order = numpy.argsort(components[in_wanted], kind='stable')
+        sorted_components = components[in_wanted][order]
+        sorted_objids = self.objids[in_wanted][order]
+        boundaries = numpy.flatnonzero(numpy.diff(sorted_components)) + 1
+        return [g.tolist() for g in numpy.split(sorted_objids, boundaries)
+                if len(g) > 0]
@@ -7,9 +7,12 @@ import codecs
 import logging
 import time
 
-from muscima.cropobject import merge_cropobject_lists
+from muscima.cropobject import CropObject, merge_cropobject_lists
 from muscima.io import  parse_cropobject_list, export_cropobject_list
 
+from MUSCIMarker.muscimarker_io import parse_cropobject_lists_parallel
+from MUSCIMarker.parse_cache import cropobject_list_parser, CACHE_DIR_HELP
+
 __version__ = "0.0.1"
 __author__ = "Jan Hajic jr."
 
@@ -23,6 +26,11 @@ def build_argument_parser():
                              ' in the order in which they are given.')
     parser.add_argument('-o', '--output', required=True,
                         help='Output file for the merged CropObject list.')
+    parser.add_argument('--no_cache', '--no-cache', action='store_true',
+                        help='Always parse the input files, do not use'
+                             ' the parsed CropObjectList cache. ' + CACHE_DIR_HELP)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Parse the input files in this many processes.')
 
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Turn on INFO messages.')
@@ -34,18 +42,22 @@ def build_argument_parser():
 
 def main(args):
     logging.info('Starting main...')
-    _start_time = time.clock()
+    _start_time = time.time()
 
     logging.warning('Merging CropObject lists is now very dangerous,'
                     ' becaues of the uid situation.')
 
-    inputs = [parse_cropobject_list(f) for f in args.inputs]
+    parse = cropobject_list_parser(use_cache=not args.no_cache,
+                                   parser=parse_cropobject_list,
+                                   cropobject_class=CropObject)
+    inputs = parse_cropobject_lists_parallel(args.inputs, workers=args.jobs,
+                                             parser=parse)
     merged = merge_cropobject_lists(*inputs)
     with codecs.open(args.output, 'w', 'utf-8') as hdl:
         hdl.write(export_cropobject_list(merged))
         hdl.write('\n')
 
-    _end_time = time.clock()
+    _end_time = time.time()
     logging.info('merge_cropobject_lists.py done in {0:.3f} s'.format(_end_time - _start_time))
 
 
@@ -15,9 +15,15 @@ from builtins import str
 from builtins import map
 from builtins import range
 from builtins import object
+import base64
 import copy
+import hashlib
+import io
+import json
 import logging
+import multiprocessing
 import os
+import zlib
 
 import itertools
 import numpy
@@ -39,6 +45,11 @@ MFF_MUSCIMA_XML = os.path.join(MFF_MUSCIMA_ROOT, 'XML')
 
 CROPOBJECT_MASK_ORDER = 'C'
 
+CROPOBJECT_MASK_PACKBITS_PREFIX = 'pz64:'
+'''Marks a mask string in the ``packbits`` encoding (see
+``CropObject.encode_mask_packbits()``). It cannot start an RLE or a bitmap
+mask string, so the encoding is unambiguous.'''
+
 ##############################################################################
 # Annotations lookup
 
@@ -109,6 +120,81 @@ def hex2rgb(hstr):
 # Representing symbolic annotations from MUSCIMA++:
 
 
+def pack_mask_bits(mask):
+    """Packs a binary mask into bits (``numpy.packbits`` of the mask
+    flattened in ``CROPOBJECT_MASK_ORDER``). Use ``unpack_mask_bits()``
+    with the mask's shape to get it back.
+
+    >>> mask = numpy.array([[0, 0, 1, 1], [1, 0, 0, 0]])
+    >>> pack_mask_bits(mask)
+    array([56], dtype=uint8)
+    >>> unpack_mask_bits(pack_mask_bits(mask), mask.shape)
+    array([[0, 0, 1, 1],
+           [1, 0, 0, 0]], dtype=uint8)
+
+    """
+    return numpy.packbits(numpy.asarray(mask, dtype='uint8').flatten(order=CROPOBJECT_MASK_ORDER))
+
+
+def unpack_mask_bits(mask_bits, shape):
+    """Inverse of ``pack_mask_bits()``. Returns a ``uint8`` mask."""
+    n_pixels = shape[0] * shape[1]
+    mask = numpy.unpackbits(mask_bits)[:n_pixels]
+    return mask.reshape(shape, order=CROPOBJECT_MASK_ORDER)
+
+
+class PackedMask(object):
+    """A binary mask packed into bits, for pickling CropObjects that keep
+    their masks unpacked (such as the ``muscima`` CropObjects held by
+    the annotator model) in an eighth of the space.
+    See ``pack_cropobject_mask()``.
+    """
+    def __init__(self, mask):
+        self.shape = mask.shape
+        self.bits = pack_mask_bits(mask)
+
+    def unpack(self):
+        return unpack_mask_bits(self.bits, self.shape)
+
+
+def pack_cropobject_mask(cropobject):
+    """Returns a shallow copy of the CropObject with its mask packed
+    into a ``PackedMask``, meant to be pickled. The copy is not a valid
+    CropObject until ``unpack_cropobject_mask()`` is called on it.
+    Masks that are not binary, and the CropObjects of this module (which
+    keep their masks packed anyway), are left as they are.
+
+    >>> from muscima.cropobject import CropObject as MCropObject
+    >>> c = MCropObject(0, 'test', 10, 100, width=4, height=2,
+    ...                 mask=numpy.array([[0, 0, 1, 1], [1, 0, 0, 0]]))
+    >>> c_packed = pack_cropobject_mask(c)
+    >>> c_packed.mask.bits
+    array([56], dtype=uint8)
+    >>> unpack_cropobject_mask(c_packed).mask
+    array([[0, 0, 1, 1],
+           [1, 0, 0, 0]], dtype=uint8)
+
+    """
+    if isinstance(cropobject, CropObject):
+        return cropobject
+    mask = cropobject.mask
+    if (mask is None) or isinstance(mask, PackedMask) \
+            or ((mask.size > 0) and (mask.max() > 1)):
+        return cropobject
+    c_packed = copy.copy(cropobject)
+    c_packed.mask = PackedMask(mask)
+    return c_packed
+
+
+def unpack_cropobject_mask(cropobject):
+    """Unpacks the ``PackedMask`` of a CropObject made by
+    ``pack_cropobject_mask()``, in place. CropObjects without
+    a ``PackedMask`` are left as they are. Returns the CropObject."""
+    if isinstance(cropobject.mask, PackedMask):
+        cropobject.mask = cropobject.mask.unpack()
+    return cropobject
+
+
 class CropObject(object):
     """One annotated object.
 
@@ -209,6 +295,10 @@ class CropObject(object):
       bounding box. (Supersedes ``<Y>`` in older CropObjectList files.)
     * ``<Left>`` is the horizontal coordinate of the upper left corner of
       the object's bounding box. (Supersedes ``<X>`` in older CropObjectList files.)
+    * ``<Mask>`` is the mask of the object, by default in run-length encoding
+      (see ``CropObject.encode_mask_rle()``). Large masks can also be stored
+      bit-packed and compressed; such mask strings start with ``pz64:``
+      (see ``CropObject.encode_mask_packbits()``).
 
     Legacy issues with X, Y, and positions
     ------------------------------------
@@ -312,7 +402,14 @@ class CropObject(object):
 
         # The mask presupposes integer bounds.
         # Applied relative to CropObject bounds, not the whole image.
-        self.mask = None
+        self._mask = None
+        # Binary masks are kept bit-packed (see set_mask()).
+        self._mask_bits = None
+        self._mask_shape = None
+        # The unpacked mask, once it has been asked for.
+        self._mask_unpacked = None
+        # Encoded mask that has not been decoded yet (see set_mask_string()).
+        self._mask_string = None
         self.set_mask(mask)
 
         self.inlinks = inlinks
@@ -322,6 +419,28 @@ class CropObject(object):
         logging.debug('...done!')
 
     def set_mask(self, mask):
+        """Sets the mask, after checking that its shape matches the
+        CropObject's integer bounds. The mask is converted to ``uint8``.
+
+        Binary masks (the usual case) are stored bit-packed, which takes
+        64 times less memory than an ``int64`` array. The ``mask`` attribute
+        then unpacks them on demand into a read-only array: to change
+        the mask, set a new one. The unpacked mask is kept, so that code
+        which reads ``mask`` over and over does not unpack it each time;
+        it is not pickled.
+
+        >>> c = CropObject(0, 'test', 10, 100, width=4, height=2)
+        >>> c.set_mask(numpy.array([[0, 0, 1, 1], [1, 0, 0, 0]]))
+        >>> c.mask
+        array([[0, 0, 1, 1],
+               [1, 0, 0, 0]], dtype=uint8)
+        >>> c.mask[0, 0] = 1
+        Traceback (most recent call last):
+        ...
+        ValueError: assignment destination is read-only
+
+        Non-binary masks are kept as they are (in ``uint8``).
+        """
         if mask is None:
             self.mask = None
         else:
@@ -338,7 +457,77 @@ class CropObject(object):
                 logging.debug('CropObject.set_mask(): Supplied non-integer mask'
                               ' with dtype={0}'.format(mask.dtype))
 
-            self.mask = mask.astype('uint8')
+            self.mask = mask
+
+    def _set_mask_bits(self, mask_bits, shape):
+        """Sets the mask directly from its bit-packed form
+        (``numpy.packbits`` of the mask flattened in ``CROPOBJECT_MASK_ORDER``),
+        without unpacking it. The shape is not checked."""
+        self._mask_string = None
+        self._mask = None
+        self._mask_unpacked = None
+        self._mask_bits = mask_bits
+        self._mask_shape = tuple(shape)
+
+    def set_mask_string(self, mask_string):
+        """Sets the mask from its encoded string form (as found in the
+        ``<Mask>`` element), but defers decoding it until the ``mask``
+        is first accessed. Code that only needs bounding boxes, class
+        names and links then never pays for decoding the masks.
+
+        >>> c = CropObject(0, 'test', 10, 100, width=4, height=2)
+        >>> c.set_mask_string('0:2 1:3 0:3')
+        >>> c.mask
+        array([[0, 0, 1, 1],
+               [1, 0, 0, 0]], dtype=uint8)
+
+        """
+        if mask_string == 'None':
+            self.mask = None
+            return
+        self._mask = None
+        self._mask_string = mask_string
+
+    @property
+    def mask(self):
+        if self._mask_string is not None:
+            self.set_mask(self.decode_mask(self._mask_string,
+                                           shape=(self.height, self.width)))
+        if self._mask_bits is not None:
+            if self._mask_unpacked is None:
+                self._mask_unpacked = unpack_mask_bits(self._mask_bits,
+                                                       self._mask_shape)
+                self._mask_unpacked.flags.writeable = False
+            return self._mask_unpacked
+        return self._mask
+
+    @mask.setter
+    def mask(self, mask):
+        """Stores the mask as ``uint8``, bit-packed if it is binary.
+        Does not check the shape: use ``set_mask()`` for that."""
+        self._mask_string = None
+        self._mask = None
+        self._mask_bits = None
+        self._mask_shape = None
+        self._mask_unpacked = None
+        if mask is None:
+            return
+
+        mask = numpy.asarray(mask).astype('uint8')
+        if (mask.size > 0) and (mask.max() > 1):
+            self._mask = mask
+        else:
+            self._set_mask_bits(pack_mask_bits(mask), mask.shape)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Pickles keep only the packed mask.
+        state['_mask_unpacked'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_mask_unpacked', None)
+        self.__dict__.update(state)
 
     @property
     def top(self):
@@ -376,6 +565,9 @@ class CropObject(object):
         """A CropObject is empty if it is composed of zero pixels.
         This is measured through the mask. CropObjects without
         a mask are assumed to be non-empty."""
+        if self._mask_bits is not None:
+            return not self._mask_bits.any()
+
         if self.mask is None:
             return False
 
@@ -542,29 +734,31 @@ class CropObject(object):
             return
 
         # We know the object is not empty.
+        # (The mask is unpacked on every access, so get it only once.)
+        mask = self.mask
 
         # How many rows/columns to trim from top, bottom, etc.
         trim_top = -1
-        for i in range(self.mask.shape[0]):
-            if self.mask[i,:].sum() != 0:
+        for i in range(mask.shape[0]):
+            if mask[i,:].sum() != 0:
                 trim_top = i
                 break
 
         trim_left = -1
-        for j in range(self.mask.shape[1]):
-            if self.mask[:,j].sum() != 0:
+        for j in range(mask.shape[1]):
+            if mask[:,j].sum() != 0:
                 trim_left = j
                 break
 
         trim_bottom = -1
-        for k in range(self.mask.shape[0]):
-            if self.mask[-(k+1),:].sum() != 0:
+        for k in range(mask.shape[0]):
+            if mask[-(k+1),:].sum() != 0:
                 trim_bottom = k
                 break
 
         trim_right = -1
-        for l in range(self.mask.shape[1]):
-            if self.mask[:,-(l+1)].sum() != 0:
+        for l in range(mask.shape[1]):
+            if mask[:,-(l+1)].sum() != 0:
                 trim_right = l
                 break
 
@@ -579,10 +773,10 @@ class CropObject(object):
         rel_b = self.height - trim_bottom
         rel_r = self.width - trim_right
 
-        new_mask = self.mask[rel_t:rel_b, rel_l:rel_r] * 1
+        new_mask = mask[rel_t:rel_b, rel_l:rel_r] * 1
 
         logging.debug('Cropobject.crop: Old mask shape {0}, new mask shape {1}'
-                     ''.format(self.mask.shape, new_mask.shape))
+                     ''.format(mask.shape, new_mask.shape))
 
         # new bounding box, relative to image -- used to compute the CropObject's
         # new position and size
@@ -599,6 +793,12 @@ class CropObject(object):
         self.set_mask(new_mask)
 
     def __str__(self):
+        return self.to_xml_string()
+
+    def to_xml_string(self, mask_mode='rle'):
+        """Returns the XML representation of the CropObject, with the mask
+        encoded in the given ``mask_mode`` (``rle``, ``bitmap``
+        or ``packbits``). ``str(cropobject)`` uses the default ``rle``."""
         lines = []
         lines.append('<CropObject>')
         lines.append('\t<Id>{0}</Id>'.format(self.objid))
@@ -608,7 +808,12 @@ class CropObject(object):
         lines.append('\t<Width>{0}</Width>'.format(self.width))
         lines.append('\t<Height>{0}</Height>'.format(self.height))
 
-        mask_string = self.encode_mask(self.mask)
+        if (self._mask_string is not None) \
+                and (self._determine_mask_mode(self._mask_string) == mask_mode):
+            # Never decoded, so it cannot have changed.
+            mask_string = self._mask_string
+        else:
+            mask_string = self.encode_mask(self.mask, mode=mask_mode)
         lines.append('\t<Mask>{0}</Mask>'.format(mask_string))
 
         if len(self.inlinks) > 0:
@@ -626,6 +831,10 @@ class CropObject(object):
             return self.encode_mask_rle(mask, compress=compress)
         elif mode == 'bitmap':
             return self.encode_mask_bitmap(mask, compress=compress)
+        elif mode == 'packbits':
+            return self.encode_mask_packbits(mask)
+        else:
+            raise ValueError('Unknown mask encoding mode: {0}'.format(mode))
 
     @staticmethod
     def encode_mask_bitmap(mask, compress=False):
@@ -655,26 +864,70 @@ class CropObject(object):
         Currently, the rows of the mask are not treated in any special
         way. The mask just gets flattened and then encoded.
 
-        Implementation:
+        >>> mask = numpy.array([[0, 0, 1, 1, 1], [0, 0, 0, 1, 1]])
+        >>> CropObject.encode_mask_rle(mask)
+        '0:2 1:3 0:3 1:2'
+
+        The encoding always starts with a run of zeros, even if that run
+        is empty:
+
+        >>> CropObject.encode_mask_rle(numpy.ones((2, 2), dtype='uint8'))
+        '0:0 1:4'
+
+        Implementation: run boundaries are found all at once as the
+        positions where the flattened mask differs from its predecessor,
+        so there is no per-pixel Python loop.
         """
         if mask is None:
             return 'None'
         mask_flat = mask.flatten(order=CROPOBJECT_MASK_ORDER)
+        if mask_flat.size == 0:
+            return '0:0'
+
+        run_starts = numpy.flatnonzero(mask_flat[1:] != mask_flat[:-1]) + 1
+        run_starts = numpy.concatenate(([0], run_starts))
+        run_lengths = numpy.diff(numpy.append(run_starts, mask_flat.size))
+        run_types = mask_flat[run_starts].tolist()
+        run_lengths = run_lengths.tolist()
+
+        # The first run is by convention a run of zeros.
+        if run_types[0] != 0:
+            run_types.insert(0, 0)
+            run_lengths.insert(0, 0)
+
+        output = ' '.join(['{0}:{1}'.format(k, v)
+                           for k, v in zip(run_types, run_lengths)])
+        return output
 
-        output_strings = []
-        current_run_type = 0
-        current_run_length = 0
-        for i in mask_flat:
-            if i == current_run_type:
-                current_run_length += 1
-            else:
-                s = '{0}:{1}'.format(current_run_type, current_run_length)
-                output_strings.append(s)
-                current_run_type = i
-                current_run_length = 1
-        s = '{0}:{1}'.format(current_run_type, current_run_length)
-        output_strings.append(s)
-        output = ' '.join(output_strings)
+    @staticmethod
+    def encode_mask_packbits(mask):
+        """Encodes the mask array as bits, compressed and made printable:
+
+        * Flatten the mask (then use width and height of CropObject for
+          reshaping), with any nonzero value becoming 1.
+        * Pack eight pixels into each byte (``numpy.packbits``).
+        * Compress the bytes with zlib.
+        * Encode the result in base64 and prepend ``pz64:``.
+
+        This is much more compact than RLE for large masks with many runs,
+        such as stafflines, slurs or beams, and much faster to decode.
+        The mask must be binary; values other than 0 and 1 are not kept.
+
+        >>> mask = numpy.array([[0, 0, 1, 1, 1], [0, 0, 0, 1, 1]])
+        >>> mask_string = CropObject.encode_mask_packbits(mask)
+        >>> mask_string.startswith('pz64:')
+        True
+        >>> CropObject.decode_mask_packbits(mask_string, shape=(2, 5))
+        array([[0, 0, 1, 1, 1],
+               [0, 0, 0, 1, 1]], dtype=uint8)
+
+        """
+        if mask is None:
+            return 'None'
+        mask_flat = mask.flatten(order=CROPOBJECT_MASK_ORDER) != 0
+        packed = zlib.compress(numpy.packbits(mask_flat).tobytes())
+        output = CROPOBJECT_MASK_PACKBITS_PREFIX \
+                 + base64.b64encode(packed).decode('ascii')
         return output
 
     def decode_mask(self, mask_string, shape):
@@ -683,12 +936,17 @@ class CropObject(object):
             return self.decode_mask_rle(mask_string, shape=shape)
         elif mode == 'bitmap':
             return self.decode_mask_bitmap(mask_string, shape=shape)
+        elif mode == 'packbits':
+            return self.decode_mask_packbits(mask_string, shape=shape)
 
     def _determine_mask_mode(self, mask_string):
-        """If the mask string starts with '0:' or '1:', or generally
+        """If the mask string starts with the ``pz64:`` prefix, it is
+        bit-packed. If it starts with '0:' or '1:', or generally
         if it contains a non-0 or 1 symbol, assume it is RLE."""
         mode = 'bitmap'
-        if len(mask_string) < 3:
+        if mask_string.startswith(CROPOBJECT_MASK_PACKBITS_PREFIX):
+            mode = 'packbits'
+        elif len(mask_string) < 3:
             mode = 'bitmap'
         elif ':' in mask_string[:3]:
             mode = 'rle'
@@ -713,18 +971,36 @@ class CropObject(object):
     @staticmethod
     def decode_mask_rle(mask_string, shape):
         """Decodes the mask array from the RLE-encoded form
-        to the 2D numpy array."""
+        to the 2D numpy array.
+
+        >>> CropObject.decode_mask_rle('0:2 1:3 0:3 1:2', shape=(2, 5))
+        array([[0, 0, 1, 1, 1],
+               [0, 0, 0, 1, 1]])
+
+        """
         if mask_string == 'None':
             return None
 
-        values = []
-        for kv in mask_string.split(' '):
-            k_string, v_string = kv.split(':')
-            k, v = int(k_string), int(v_string)
-            vs = [k for _ in range(v)]
-            values.extend(vs)
+        runs = numpy.array(mask_string.replace(':', ' ').split(),
+                           dtype='int64').reshape(-1, 2)
+        values = numpy.repeat(runs[:, 0], runs[:, 1])
 
-        mask = numpy.array(values).reshape(shape)
+        mask = values.reshape(shape)
+        return mask
+
+    @staticmethod
+    def decode_mask_packbits(mask_string, shape):
+        """Decodes the mask array from the bit-packed form
+        (see ``encode_mask_packbits()``) to the 2D numpy array."""
+        if mask_string == 'None':
+            return None
+
+        packed = zlib.decompress(
+            base64.b64decode(mask_string[len(CROPOBJECT_MASK_PACKBITS_PREFIX):]))
+        n_pixels = int(numpy.prod(shape))
+        values = numpy.unpackbits(numpy.frombuffer(packed, dtype='uint8'))[:n_pixels]
+
+        mask = values.reshape(shape)
         return mask
 
     def join(self, other):
@@ -796,7 +1072,8 @@ class MLClass(object):
 def parse_cropobject_list(filename, with_refs=False, tolerate_ref_absence=True,
                           integer_bounds=False,
                           fill_mlclass_names=False,
-                          mlclass_dict={}):
+                          mlclass_dict={},
+                          lazy_masks=False):
     """From a xml file with a CropObjectList as the top element, parse
     a list of CropObjects. (See ``CropObject`` class documentation
     for a description of the XMl format.)
@@ -851,114 +1128,20 @@ def parse_cropobject_list(filename, with_refs=False, tolerate_ref_absence=True,
         in the parsed CropObjectList. Keys are ``clsname``s, values are the
         MLClass objects.
 
+    :param lazy_masks: If set, the masks are not decoded while parsing.
+        The CropObjects keep the raw ``<Mask>`` strings and decode them
+        only when their ``mask`` is first accessed. Use this when you only
+        need bounding boxes, class names or links.
+
     :returns: A list of ``CropObject``s.
     """
     logging.debug('Parsing CropObjectList, with_refs={0}, tolerate={1}.'
                  ''.format(with_refs, tolerate_ref_absence))
-    tree = etree.parse(filename)
-    root = tree.getroot()
-    logging.debug('XML parsed.')
-    cropobject_list = []
-
-    # Parsing one CropObject
-    for i, cropobject in enumerate(root.iter('CropObject')):
-        logging.debug('Parsing CropObject {0}'.format(i))
-
-        objid = int(float(cropobject.findall('Id')[0].text))
-
-        # Dealing with clsname transition
-        clsname=None
-        _has_clsname = False
-        if len(cropobject.findall('MLClassName')) > 0:
-            clsname = cropobject.findall('MLClassName')[0].text
-        else:
-            raise ValueError('CropObject {0}: no clsname provided.'.format(objid))
-
-        #################################
-        # Top left corner position
-
-        # Helper functions for TopLeft/XY transition
-        def _uses_xy(cropobject):
-            xs = cropobject.findall('Y')
-            ys = cropobject.findall('X')
-            return (len(xs) > 0) and (len(ys) > 0)
-        def _uses_topleft(cropobject):
-            xs = cropobject.findall('Top')
-            ys = cropobject.findall('Left')
-            return (len(xs) > 0) and (len(ys) > 0)
-
-        if _uses_xy(cropobject):
-            ###########################################
-            # DANGER! DANGER! DANGER! DANGER! DANGER! #
-            #                                         #
-            #      NOTE THE SWAP OF COORDINATES!      #
-            #                                         #
-            ###########################################
-            top = float(cropobject.findall('Y')[0].text)
-            left = float(cropobject.findall('X')[0].text)
-        elif _uses_topleft(cropobject):
-            top = float(cropobject.findall('Top')[0].text)
-            left = float(cropobject.findall('Left')[0].text)
-        else:
-            raise KeyError('Cropobject {0} has neither Top/Left, nor Y/Y'
-                           ' position information!'.format(objid))
-
-        #################################
-        # Shape
-        width = float(cropobject.findall('Width')[0].text)
-        height = float(cropobject.findall('Height')[0].text)
-
-        #################################
-        # Parsing the graph structure (Can deal with missing Inlinks/Outlinks)
-        inlinks = []
-        i_s = cropobject.findall('Inlinks')
-        if len(i_s) > 0:
-            i_s_text = cropobject.findall('Inlinks')[0].text
-            if i_s_text is not None:  # Zero-length links
-                inlinks = list(map(int, i_s_text.split(' ')))
-
-        outlinks = []
-        o_s = cropobject.findall('Outlinks')
-        if len(o_s) > 0:
-            o_s_text = cropobject.findall('Outlinks')[0].text
-            if o_s_text is not None:
-                outlinks = list(map(int, o_s_text.split(' ')))
-
-        #################################
-        # Create the object.
-        obj = CropObject(objid=objid,
-                         clsname=clsname,
-                         top=top,
-                         left=left,
-                         width=width,
-                         height=height,
-                         inlinks=inlinks,
-                         outlinks=outlinks)
-
-        #################################
-        # Add mask.
-        mask = None
-        m = cropobject.findall('Mask')
-        if len(m) > 0:
-            mask = obj.decode_mask(cropobject.findall('Mask')[0].text,
-                                   shape=(obj.height, obj.width))
-        obj.set_mask(mask)
-        logging.debug('Created CropObject with ID {0}'.format(obj.objid))
-
-        #################################
-        # Enforce integer bounds.
-        # (This is somewhat redundant now, because of masks:
-        #  the CropObject already calls to_integer_bounds() when
-        #  it is created.)
-        if integer_bounds is True:
-            obj.to_integer_bounds()
-
-        cropobject_list.append(obj)
-
+    cropobject_list = list(iter_cropobject_list(filename,
+                                                integer_bounds=integer_bounds,
+                                                lazy_masks=lazy_masks))
     logging.debug('CropObjectList loaded.')
 
-    validate_cropobjects_graph_structure(cropobject_list)
-
     if with_refs:
         logging.debug('Parsing CropObjectList refs.')
         # This is pretty bad at this point. We should change it to a regular tag...
@@ -987,6 +1170,229 @@ def parse_cropobject_list(filename, with_refs=False, tolerate_ref_absence=True,
     return cropobject_list
 
 
+def iter_cropobject_list(filename, integer_bounds=False, validate=True,
+                         lazy_masks=False):
+    """Streaming version of ``parse_cropobject_list()``: yields
+    the CropObjects one by one, as they are read from the file.
+
+    The file is read with ``etree.iterparse``, and each ``<CropObject>``
+    element is discarded as soon as the CropObject is built from it,
+    so the whole XML tree is never held in memory at once.
+
+    >>> test_data_dir = os.path.join(os.path.dirname(__file__),
+    ...                              'test_data', 'cropobjects_xy_vs_topleft')
+    >>> clfile = os.path.join(test_data_dir, '01_basic_topleft.xml')
+    >>> n_cropobjects = 0
+    >>> for c in iter_cropobject_list(clfile):
+    ...     n_cropobjects += 1
+    >>> n_cropobjects
+    48
+
+    The graph structure is validated incrementally: links to objects that
+    have not been seen yet are remembered, and if some of them are still
+    not resolved when the file ends, a ``ValueError`` is raised after the
+    last CropObject has been yielded.
+
+    >>> import io
+    >>> xml = b'''<CropObjectList><CropObjects>
+    ... <CropObject><Id>0</Id><MLClassName>stem</MLClassName><Top>0</Top>
+    ... <Left>0</Left><Width>2</Width><Height>5</Height><Mask>None</Mask>
+    ... <Outlinks>7</Outlinks></CropObject>
+    ... </CropObjects></CropObjectList>'''
+    >>> cropobjects = list(iter_cropobject_list(io.BytesIO(xml)))
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid graph structure in CropObjectList: object 0 has outlink to non-existent object 7
+
+    :param filename: The CropObjectList file (or a file-like object).
+
+    :param integer_bounds: See ``parse_cropobject_list()``.
+
+    :param validate: If set, checks that all inlinks and outlinks
+        point to CropObjects that are in the file.
+
+    :param lazy_masks: See ``parse_cropobject_list()``.
+
+    :returns: A generator of ``CropObject``s.
+    """
+    objids = set()
+    # Links to objects not seen yet: (objid, link, link direction)
+    unresolved_links = []
+
+    context = etree.iterparse(filename, events=('end',), tag='CropObject')
+    for i, (_, element) in enumerate(context):
+        logging.debug('Parsing CropObject {0}'.format(i))
+        obj = _parse_cropobject_element(element, integer_bounds=integer_bounds,
+                                        lazy_masks=lazy_masks)
+
+        # Free the already processed part of the tree.
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+        if validate:
+            objids.add(obj.objid)
+            unresolved_links.extend([(obj.objid, l, 'inlink from')
+                                     for l in obj.inlinks if l not in objids])
+            unresolved_links.extend([(obj.objid, l, 'outlink to')
+                                     for l in obj.outlinks if l not in objids])
+
+        yield obj
+
+    del context
+
+    if validate:
+        for objid, link, direction in unresolved_links:
+            if link not in objids:
+                raise ValueError('Invalid graph structure in CropObjectList:'
+                                 ' object {0} has {1} non-existent'
+                                 ' object {2}'.format(objid, direction, link))
+
+
+def iter_cropobject_lists_parallel(filenames, workers=1,
+                                   parser=parse_cropobject_list):
+    """Parses the given CropObjectList files in a pool of ``workers``
+    processes. Yields the lists of CropObjects in the order of ``filenames``,
+    as soon as they are available, so that callers can log progress.
+
+    >>> clfile = os.path.join(os.path.dirname(__file__),
+    ...                       'test_data', 'example_annotation.xml')
+    >>> [len(cs) for cs in iter_cropobject_lists_parallel([clfile, clfile], workers=2)]
+    [139, 139]
+
+    :param workers: How many processes to use. With ``workers=1``,
+        the files are parsed in this process and no pool is created.
+
+    :param parser: The function that parses one file. Must be picklable,
+        e.g. a module-level function or a ``functools.partial`` of one
+        (see ``parse_cache.cropobject_list_parser()``).
+    """
+    if workers <= 1 or len(filenames) <= 1:
+        for f in filenames:
+            yield parser(f)
+        return
+
+    # Forking a process that runs other threads (such as Kivy's) can leave
+    # the workers deadlocked, so where possible they are started afresh.
+    if hasattr(multiprocessing, 'get_context'):
+        pool = multiprocessing.get_context('spawn').Pool(processes=min(workers, len(filenames)))
+    else:
+        pool = multiprocessing.Pool(processes=min(workers, len(filenames)))
+    try:
+        for cropobjects in pool.imap(parser, filenames):
+            yield cropobjects
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parse_cropobject_lists_parallel(filenames, workers=1,
+                                    parser=parse_cropobject_list):
+    """Parses the given CropObjectList files in a pool of ``workers``
+    processes. Returns a list of the parsed CropObject lists, in the order
+    of ``filenames``.
+
+    See ``iter_cropobject_lists_parallel()`` for the parameters.
+    """
+    return list(iter_cropobject_lists_parallel(filenames,
+                                               workers=workers,
+                                               parser=parser))
+
+
+def _parse_cropobject_element(cropobject, integer_bounds=False,
+                              lazy_masks=False):
+    """Builds a CropObject from its ``<CropObject>`` XML element.
+
+    The children of the element are only walked once: the text of each
+    field is looked up by its tag. If a field is given more than once,
+    the first occurrence is used.
+    """
+    fields = {}
+    for child in cropobject:
+        # Comments and processing instructions do not have a string tag,
+        # so they never match a field name.
+        if child.tag not in fields:
+            fields[child.tag] = child.text
+
+    objid = int(float(fields['Id']))
+
+    # Dealing with clsname transition
+    if 'MLClassName' in fields:
+        clsname = fields['MLClassName']
+    else:
+        raise ValueError('CropObject {0}: no clsname provided.'.format(objid))
+
+    #################################
+    # Top left corner position (TopLeft/XY transition)
+    if ('X' in fields) and ('Y' in fields):
+        ###########################################
+        # DANGER! DANGER! DANGER! DANGER! DANGER! #
+        #                                         #
+        #      NOTE THE SWAP OF COORDINATES!      #
+        #                                         #
+        ###########################################
+        top = float(fields['Y'])
+        left = float(fields['X'])
+    elif ('Top' in fields) and ('Left' in fields):
+        top = float(fields['Top'])
+        left = float(fields['Left'])
+    else:
+        raise KeyError('Cropobject {0} has neither Top/Left, nor Y/Y'
+                       ' position information!'.format(objid))
+
+    #################################
+    # Shape
+    width = float(fields['Width'])
+    height = float(fields['Height'])
+
+    #################################
+    # Parsing the graph structure (Can deal with missing Inlinks/Outlinks)
+    inlinks = []
+    i_s_text = fields.get('Inlinks', None)
+    if i_s_text is not None:  # Zero-length links
+        inlinks = list(map(int, i_s_text.split(' ')))
+
+    outlinks = []
+    o_s_text = fields.get('Outlinks', None)
+    if o_s_text is not None:
+        outlinks = list(map(int, o_s_text.split(' ')))
+
+    #################################
+    # Create the object.
+    obj = CropObject(objid=objid,
+                     clsname=clsname,
+                     top=top,
+                     left=left,
+                     width=width,
+                     height=height,
+                     inlinks=inlinks,
+                     outlinks=outlinks)
+
+    #################################
+    # Add mask.
+    mask = None
+    has_mask = 'Mask' in fields
+    if has_mask and lazy_masks:
+        obj.set_mask_string(fields['Mask'])
+    else:
+        if has_mask:
+            mask = obj.decode_mask(fields['Mask'],
+                                   shape=(obj.height, obj.width))
+        obj.set_mask(mask)
+    logging.debug('Created CropObject with ID %s', objid)
+
+    #################################
+    # Enforce integer bounds.
+    # (This is somewhat redundant now, because of masks:
+    #  the CropObject already calls to_integer_bounds() when
+    #  it is created.)
+    if integer_bounds is True:
+        obj.to_integer_bounds()
+
+    return obj
+
+
 def validate_cropobjects_graph_structure(cropobjects):
     # Verify graph structure
     objids = frozenset([c.objid for c in cropobjects])
@@ -1029,11 +1435,57 @@ def export_cropobject_graph(cropobjects, validate=True):
 
 
 def export_cropobject_list(cropobjects,
-                           mlclasslist_file=None, image_file=None, ref_root=None):
-    """Writes the CropObject data as a XML string."""
-    # This is the data string, the rest is formalities
-    cropobj_string = '\n'.join([str(c) for c in cropobjects])
+                           mlclasslist_file=None, image_file=None, ref_root=None,
+                           docname=None, dataset_name=None, mask_mode='rle'):
+    """Writes the CropObject data as a XML string. To write
+    the XML directly into a file, use ``write_cropobject_list()``."""
+    output = io.StringIO()
+    write_cropobject_list(cropobjects, output,
+                          mlclasslist_file=mlclasslist_file, image_file=image_file,
+                          ref_root=ref_root,
+                          docname=docname, dataset_name=dataset_name,
+                          mask_mode=mask_mode)
+    return output.getvalue()
+
+
+def write_cropobject_list(cropobjects, stream,
+                          mlclasslist_file=None, image_file=None, ref_root=None,
+                          docname=None, dataset_name=None, mask_mode='rle'):
+    """Writes the CropObject data as XML into the given text stream,
+    one CropObject at a time, so that the whole XML string never has
+    to be held in memory. The output is the same as the string returned
+    by ``export_cropobject_list()``.
+
+    >>> clfile = os.path.join(os.path.dirname(__file__),
+    ...                       'test_data', 'example_annotation.xml')
+    >>> cropobjects = parse_cropobject_list(clfile)
+    >>> stream = io.StringIO()
+    >>> write_cropobject_list(cropobjects, stream)
+    >>> stream.getvalue() == export_cropobject_list(cropobjects)
+    True
+
+    :param stream: A text stream, such as a file opened with
+        ``codecs.open(output_file, 'w', 'utf-8')``.
 
+    :param docname: If given, the CropObjects are written with their UIDs
+        set to this document name. The CropObjects themselves are not changed:
+        each is shallow-copied just before it is written. (Only applies to
+        CropObjects that have UIDs, such as the ``muscima`` CropObjects.)
+
+    :param dataset_name: Analogous to ``docname``.
+
+    :param mask_mode: How to encode the masks: ``rle`` (default),
+        or ``packbits`` for a much smaller file if there are many large
+        masks. Only the default is supported for CropObjects that do not
+        implement ``to_xml_string()``, such as the ``muscima`` CropObjects.
+        Files with ``packbits`` masks can only be read by this module's
+        ``parse_cropobject_list()``.
+
+    >>> packed = io.StringIO()
+    >>> write_cropobject_list(cropobjects, packed, mask_mode='packbits')
+    >>> len(packed.getvalue()) < len(stream.getvalue())
+    True
+    """
     lines = []
     lines.append('<?xml version="1.0" encoding="utf-8"?>')
 
@@ -1058,13 +1510,248 @@ def export_cropobject_list(cropobjects,
                  ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
                  ' xmlns:xsd="http://www.w3.org/2001/XMLSchema">')
     lines.append('<CropObjects>')
-    lines.append(cropobj_string)
-    lines.append('</CropObjects>')
-    lines.append('</CropObjectList>')
-    return '\n'.join(lines)
+    stream.write('\n'.join(lines))
+    stream.write('\n')
+
+    # This is the data, the rest is formalities
+    for i, c in enumerate(cropobjects):
+        if (docname is not None) or (dataset_name is not None):
+            c = copy.copy(c)
+            if docname is not None:
+                c.set_doc(docname)
+            if dataset_name is not None:
+                c.set_dataset(dataset_name)
+        if i > 0:
+            stream.write('\n')
+        if mask_mode == 'rle':
+            stream.write(str(c))
+        else:
+            stream.write(c.to_xml_string(mask_mode=mask_mode))
+
+    stream.write('\n</CropObjects>')
+    stream.write('\n</CropObjectList>')
+
+
+##############################################################################
+
+# Binary sidecar format for fast reloading of CropObjectLists.
+#
+# The CropObjectList is stored column by column in an uncompressed ``.npz``
+# archive next to the XML file. Masks are bit-packed with ``numpy.packbits``
+# and concatenated into a single blob, indexed by ``mask_offsets``. Links are
+# stored the same way: a flat array of objids plus per-object offsets.
+
+CROPOBJECT_BINARY_FORMAT_VERSION = 1
+CROPOBJECT_BINARY_SUFFIX = '.npz'
+
+
+def binary_sidecar_filename(filename):
+    """Returns the name of the binary sidecar file that belongs
+    to the given CropObjectList XML file.
+
+    >>> binary_sidecar_filename('annotations/01_basic.xml')
+    'annotations/01_basic.xml.npz'
+
+    """
+    return filename + CROPOBJECT_BINARY_SUFFIX
 
 
-def position_cropobject_list_by_muscimage(cropobject_list, muscimage):
+def _file_fingerprint(filename, with_hash=True):
+    """Returns the size, modification time and (optionally) the SHA1
+    hash of the file contents."""
+    stat = os.stat(filename)
+    sha1 = ''
+    if with_hash:
+        h = hashlib.sha1()
+        with open(filename, 'rb') as hdl:
+            for chunk in iter(lambda: hdl.read(1 << 20), b''):
+                h.update(chunk)
+        sha1 = h.hexdigest()
+    return stat.st_size, stat.st_mtime, sha1
+
+
+def _flatten_links(link_lists):
+    offsets = numpy.zeros(len(link_lists) + 1, dtype='int64')
+    offsets[1:] = numpy.cumsum([len(l) for l in link_lists])
+    flat = numpy.array(list(itertools.chain(*link_lists)), dtype='int64')
+    return flat, offsets
+
+
+def save_cropobject_list_binary(cropobjects, filename, source_filename=None):
+    """Writes the CropObjects into the binary sidecar format.
+
+    Masks are stored as binary: any nonzero mask value is saved as 1.
+    If the CropObjects have a ``uid`` or ``data`` (as the ``muscima``
+    CropObjects do), these are stored as well.
+
+    :param source_filename: The XML file the CropObjects were loaded from
+        (or exported to). Its size, modification time and hash are recorded,
+        so that the loader can detect when the sidecar gets out of date.
+    """
+    n = len(cropobjects)
+    clsnames = sorted(set([c.clsname for c in cropobjects]))
+    clsname_idx = {clsname: i for i, clsname in enumerate(clsnames)}
+
+    arrays = {
+        'format_version': numpy.array(CROPOBJECT_BINARY_FORMAT_VERSION),
+        'objids': numpy.array([c.objid for c in cropobjects], dtype='int64'),
+        'clsnames': numpy.array(clsnames, dtype='U'),
+        'clsname_ids': numpy.array([clsname_idx[c.clsname] for c in cropobjects],
+                                   dtype='int32'),
+        # top, left, height, width
+        'bboxes': numpy.array([(c.top, c.left, c.height, c.width) for c in cropobjects],
+                              dtype='int64').reshape((n, 4)),
+    }
+
+    arrays['inlinks'], arrays['inlink_offsets'] = _flatten_links([c.inlinks for c in cropobjects])
+    arrays['outlinks'], arrays['outlink_offsets'] = _flatten_links([c.outlinks for c in cropobjects])
+
+    has_mask = numpy.array([c.mask is not None for c in cropobjects], dtype='bool')
+    packed_masks = [numpy.packbits(c.mask.flatten(order=CROPOBJECT_MASK_ORDER) != 0)
+                    for c in cropobjects if c.mask is not None]
+    mask_offsets = numpy.zeros(n + 1, dtype='int64')
+    mask_offsets[1:][has_mask] = [len(m) for m in packed_masks]
+    mask_offsets = numpy.cumsum(mask_offsets)
+    arrays['has_mask'] = has_mask
+    arrays['mask_offsets'] = mask_offsets
+    if len(packed_masks) > 0:
+        arrays['masks'] = numpy.concatenate(packed_masks)
+    else:
+        arrays['masks'] = numpy.zeros(0, dtype='uint8')
+
+    if n > 0 and all([hasattr(c, 'uid') for c in cropobjects]):
+        arrays['uids'] = numpy.array([c.uid for c in cropobjects], dtype='U')
+    if n > 0 and all([hasattr(c, 'data') for c in cropobjects]):
+        arrays['data'] = numpy.array([json.dumps(c.data) for c in cropobjects], dtype='U')
+
+    if source_filename is not None:
+        size, mtime, sha1 = _file_fingerprint(source_filename)
+        arrays['source_size'] = numpy.array(size)
+        arrays['source_mtime'] = numpy.array(mtime)
+        arrays['source_sha1'] = numpy.array(sha1)
+
+    # Write through a handle, so that numpy does not append another suffix.
+    with open(filename, 'wb') as hdl:
+        numpy.savez(hdl, **arrays)
+
+
+def is_binary_sidecar_fresh(filename, source_filename):
+    """Checks that the binary sidecar exists and corresponds to the current
+    contents of the given XML file. If the size and modification time match,
+    the sidecar is fresh; otherwise, the content hashes are compared (so that
+    e.g. copying the files around does not invalidate the sidecar)."""
+    if not os.path.isfile(filename):
+        return False
+    try:
+        with numpy.load(filename, allow_pickle=False) as archive:
+            if int(archive['format_version']) != CROPOBJECT_BINARY_FORMAT_VERSION:
+                return False
+            if 'source_sha1' not in archive:
+                return False
+            size = int(archive['source_size'])
+            mtime = float(archive['source_mtime'])
+            sha1 = str(archive['source_sha1'])
+    except (IOError, OSError, ValueError, KeyError):
+        logging.warning('Binary CropObjectList {0} is unreadable.'.format(filename))
+        return False
+
+    source_size, source_mtime, _ = _file_fingerprint(source_filename, with_hash=False)
+    if source_size != size:
+        return False
+    if source_mtime == mtime:
+        return True
+    _, _, source_sha1 = _file_fingerprint(source_filename)
+    return source_sha1 == sha1
+
+
+def load_cropobject_list_binary(filename, source_filename=None,
+                                cropobject_class=CropObject,
+                                fallback_parser=parse_cropobject_list,
+                                update_stale=True):
+    """Loads a CropObjectList stored by ``save_cropobject_list_binary()``.
+
+    >>> import tempfile
+    >>> clfile = os.path.join(os.path.dirname(__file__),
+    ...                       'test_data', 'example_annotation.xml')
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> binfile = os.path.join(tmp_dir, 'example_annotation.xml.npz')
+    >>> cropobjects = load_cropobject_list_binary(binfile, source_filename=clfile)
+    >>> os.path.isfile(binfile)
+    True
+    >>> cropobjects_bin = load_cropobject_list_binary(binfile, source_filename=clfile)
+    >>> export_cropobject_list(cropobjects) == export_cropobject_list(cropobjects_bin)
+    True
+
+    :param source_filename: The XML file that the binary file should
+        correspond to. If given, the binary file is only used when it is
+        up to date with this file. Otherwise, the XML file is parsed instead.
+
+    :param cropobject_class: The CropObjects are built as instances
+        of this class.
+
+    :param fallback_parser: The function used to parse ``source_filename``
+        when the binary file is missing or stale.
+
+    :param update_stale: If set, a missing or stale binary file is
+        re-created from ``source_filename`` after it is parsed.
+
+    :returns: A list of CropObjects.
+    """
+    if source_filename is not None:
+        if not is_binary_sidecar_fresh(filename, source_filename):
+            logging.info('Binary CropObjectList {0} missing or out of date,'
+                         ' loading {1}.'.format(filename, source_filename))
+            cropobjects = fallback_parser(source_filename)
+            if update_stale:
+                try:
+                    save_cropobject_list_binary(cropobjects, filename,
+                                                source_filename=source_filename)
+                except (IOError, OSError) as e:
+                    logging.warning('Could not write binary CropObjectList {0}: {1}'
+                                    ''.format(filename, e))
+            return cropobjects
+
+    with numpy.load(filename, allow_pickle=False) as archive:
+        arrays = {k: archive[k] for k in archive.files}
+
+    clsnames = arrays['clsnames'].tolist()
+    objids = arrays['objids'].tolist()
+    clsname_ids = arrays['clsname_ids'].tolist()
+    bboxes = arrays['bboxes'].tolist()
+    inlinks, inlink_offsets = arrays['inlinks'], arrays['inlink_offsets']
+    outlinks, outlink_offsets = arrays['outlinks'], arrays['outlink_offsets']
+    has_mask = arrays['has_mask']
+    masks, mask_offsets = arrays['masks'], arrays['mask_offsets']
+    uids = arrays['uids'].tolist() if 'uids' in arrays else None
+    data = arrays['data'].tolist() if 'data' in arrays else None
+
+    cropobjects = []
+    for i, objid in enumerate(objids):
+        top, left, height, width = bboxes[i]
+        c = cropobject_class(objid=objid,
+                             clsname=clsnames[clsname_ids[i]],
+                             top=top, left=left, width=width, height=height,
+                             inlinks=inlinks[inlink_offsets[i]:inlink_offsets[i+1]].tolist(),
+                             outlinks=outlinks[outlink_offsets[i]:outlink_offsets[i+1]].tolist())
+        if has_mask[i]:
+            mask_bits = masks[mask_offsets[i]:mask_offsets[i+1]]
+            if hasattr(c, '_set_mask_bits'):
+                # Already in the form in which CropObjects keep their masks.
+                c._set_mask_bits(mask_bits, (height, width))
+            else:
+                mask = numpy.unpackbits(mask_bits, count=height * width)
+                c.set_mask(mask.reshape((height, width), order=CROPOBJECT_MASK_ORDER))
+        if (uids is not None) and hasattr(c, 'set_uid'):
+            c.set_uid(uids[i])
+        if data is not None:
+            c.data = json.loads(data[i])
+        cropobjects.append(c)
+
+    return cropobjects
+
+
+def position_cropobject_list_by_muscimage(cropobject_list, muscimage,
+                                         spatial_index=None):
     """Recomputes a new CropObject list, so that only CropObjects within
     the bounding box of the given MUSCImage are retained and their
     coordinates are recomputed relative to the MUSCImage's bounding box.
@@ -1075,7 +1762,16 @@ def position_cropobject_list_by_muscimage(cropobject_list, muscimage):
     :type muscimage: MUSCImage
     :param muscimage: A MUSCImage against which we want to check
         the CropObjects.
+
+    :type spatial_index: MUSCIMarker.spatial_index.SpatialIndex
+    :param spatial_index: An index of the CropObjects' bounding boxes
+        (such as the annotator model's). If given, only the CropObjects
+        that intersect the MUSCImage are checked.
     """
+    if spatial_index is not None:
+        candidate_objids = set(spatial_index.query_bbox(*muscimage.bounding_box))
+        cropobject_list = [c for c in cropobject_list if c.objid in candidate_objids]
+
     output = []
     for c in cropobject_list:
         if muscimage.contains_bbox(*c.bounding_box):
@@ -1132,7 +1828,7 @@ def render_annotations(img, cropoboject_list, mlclass_list=None, alpha=1.0,
 
     mlclass_dict = None
     if mlclass_list is not None:
-        mlclass_dict = {m.clsname: m for m in mlclass_list}
+        mlclass_dict = {m.name: m for m in mlclass_list}
 
     if grayscale:
         reimg = numpy.zeros((img.shape[0], img.shape[1], 3), dtype=img.dtype)
@@ -1159,6 +1855,115 @@ def render_annotations(img, cropoboject_list, mlclass_list=None, alpha=1.0,
     return (output + reimg) / 2.0
 
 
+def composite_annotations(img, cropobjects, mlclass_list=None, alpha=1.0,
+                          grayscale=False, use_masks=True, tile_height=None,
+                          as_uint8=False):
+    """Renders the given CropObjects onto the image in their class colors,
+    like ``render_annotations()``, but much faster and with less memory,
+    so that it can be used for previews of many large pages.
+
+    Instead of blending each CropObject into a copy of the image, all the
+    CropObjects are first drawn into a label image that holds the class
+    of each pixel, and then all pixels are colored at once by looking up
+    their class color. Where CropObjects overlap, the one that comes later
+    in ``cropobjects`` wins (``render_annotations()`` mixes their colors
+    instead). Otherwise, the colors are the same as those of
+    ``render_annotations()``.
+
+    >>> img = numpy.zeros((4, 6))
+    >>> c = CropObject(0, 'notehead-full', 1, 1, width=2, height=2,
+    ...                mask=numpy.array([[1, 0], [1, 1]]))
+    >>> out = composite_annotations(img, [c], grayscale=True, as_uint8=True)
+    >>> out.shape, out.dtype
+    ((4, 6, 3), dtype('uint8'))
+    >>> out[:, :, 0]
+    array([[ 0,  0,  0,  0,  0,  0],
+           [ 0, 51,  0,  0,  0,  0],
+           [ 0, 51, 51,  0,  0,  0],
+           [ 0,  0,  0,  0,  0,  0]], dtype=uint8)
+
+    :param img: The image, RGB or (if ``grayscale`` is set) single-channel.
+        Floating-point within ``(0.0, 1.0)``, or ``uint8``.
+
+    :param mlclass_list: The classes, for the colors. If None,
+        all CropObjects are drawn in gray (0.8, 0.8, 0.8).
+
+    :param alpha: Weight of the class colors, as in ``render_annotations()``.
+
+    :param use_masks: If set (default), only the pixels in the CropObjects'
+        masks are colored. Otherwise, their whole bounding boxes are
+        colored, as in ``render_annotations()``.
+
+    :param tile_height: If given, the image is processed in horizontal
+        strips of this many rows, so that only the output has to be
+        held in memory in full.
+
+    :param as_uint8: If set, returns an ``uint8`` image (0 - 255).
+        Otherwise, returns a ``float32`` image within ``(0.0, 1.0)``.
+
+    :returns: The RGB image with the annotations.
+    """
+    height, width = img.shape[0], img.shape[1]
+    if tile_height is None:
+        tile_height = height
+    scale = 1.0 / 255 if img.dtype == numpy.uint8 else 1.0
+
+    # Palette: row 0 is the background, row i the color of class i.
+    if mlclass_list is not None:
+        clsname_indexes = {m.name: i + 1 for i, m in enumerate(mlclass_list)}
+        colors = [m.color for m in mlclass_list]
+    else:
+        clsname_indexes = None
+        colors = [(0.8, 0.8, 0.8)]
+    palette = numpy.array([(0.0, 0.0, 0.0)] + colors, dtype='float32')
+    label_dtype = 'uint8' if len(palette) <= 256 else 'int32'
+
+    # The render_annotations() blending: ((img + alpha * color) / (1 + alpha) + img) / 2
+    weight = alpha / (2.0 * (1.0 + alpha))
+
+    tops = numpy.array([c.top for c in cropobjects], dtype='int64')
+    bottoms = numpy.array([c.bottom for c in cropobjects], dtype='int64')
+    if clsname_indexes is not None:
+        labels = [clsname_indexes[c.clsname] for c in cropobjects]
+    else:
+        labels = [1 for _ in cropobjects]
+
+    output = numpy.zeros((height, width, 3),
+                         dtype='uint8' if as_uint8 else 'float32')
+
+    for tile_top in range(0, height, tile_height):
+        tile_bottom = min(tile_top + tile_height, height)
+
+        label_img = numpy.zeros((tile_bottom - tile_top, width), dtype=label_dtype)
+        in_tile = numpy.flatnonzero((tops < tile_bottom) & (bottoms > tile_top))
+        for i in in_tile:
+            c = cropobjects[i]
+            t, b = max(c.top, tile_top), min(c.bottom, tile_bottom)
+            l, r = max(c.left, 0), min(c.right, width)
+            if (l >= r) or (t >= b):
+                continue
+            label_crop = label_img[t - tile_top:b - tile_top, l:r]
+            if use_masks and (c.mask is not None):
+                mask_crop = c.mask[t - c.top:b - c.top, l - c.left:r - c.left]
+                label_crop[mask_crop != 0] = labels[i]
+            else:
+                label_crop[:, :] = labels[i]
+
+        tile = img[tile_top:tile_bottom].astype('float32') * scale
+        if grayscale:
+            tile = numpy.repeat(tile[:, :, numpy.newaxis], 3, axis=2)
+
+        labeled = label_img > 0
+        tile[labeled] += weight * (palette[label_img[labeled]] - tile[labeled])
+
+        if as_uint8:
+            output[tile_top:tile_bottom] = numpy.clip(numpy.round(tile * 255), 0, 255)
+        else:
+            output[tile_top:tile_bottom] = tile
+
+    return output
+
+
 ##############################################################################
 
 # Operations on CropObjects: merge
@@ -1255,29 +2060,87 @@ def cropobjects_merge_links(cropobjects):
     return inlinks, outlinks
 
 
-def merge_cropobject_lists(*cropobject_lists):
+def merge_cropobject_lists(*cropobject_lists, **kwargs):
     """Combines the CropObject lists into one.
 
     This just means shifting the `objid`s (and thus inlinks
     and outlinks). It is assumed the lists pertain to the same
-    image. Uses deepcopy to avoid exposing the original lists
-    to modification through the merged list.
-
+    image. The first list keeps its objids, and each following list
+    is shifted by the total length of the lists before it. If that would
+    give two CropObjects the same objid (because the objids of some list
+    have gaps), the list is shifted to come after all the objids before it
+    instead.
+
+    >>> l1 = [CropObject(0, 'notehead-full', 10, 10, 4, 4, outlinks=[1]),
+    ...       CropObject(1, 'stem', 0, 13, 1, 14, inlinks=[0])]
+    >>> l2 = [CropObject(0, 'notehead-full', 30, 10, 4, 4, outlinks=[1]),
+    ...       CropObject(1, 'stem', 20, 13, 1, 14, inlinks=[0])]
+    >>> merged = merge_cropobject_lists(l1, l2)
+    >>> [(c.objid, c.inlinks, c.outlinks) for c in merged]
+    [(0, [], [1]), (1, [0], []), (2, [], [3]), (3, [2], [])]
+    >>> l3 = [CropObject(0, 'notehead-full', 50, 10, 4, 4),
+    ...       CropObject(3, 'notehead-full', 70, 10, 4, 4)]
+    >>> [c.objid for c in merge_cropobject_lists(l3, l2)]
+    [0, 3, 4, 5]
+    >>> [c.objid for c in l2]
+    [0, 1]
+
+    Uses deepcopy to avoid exposing the original lists to modification
+    through the merged list.
+
+    :param copy: If set to False, makes lightweight copies instead: the merged
+        CropObjects get their own objid and links, but share everything else
+        (most importantly the masks) with the input CropObjects, so merging
+        takes almost no extra memory. The shared masks are read-only. This is
+        meant for reading the merged list, e.g. to compute statistics over
+        a whole corpus. (Keyword-only, default True.)
     """
-    lengths = [len(c) for c in cropobject_lists]
-    shift_by = [0] + [sum(lengths[:i]) for i in range(1, len(lengths))]
+    deep_copy = kwargs.pop('copy', True)
+    if len(kwargs) > 0:
+        raise TypeError('merge_cropobject_lists() got unexpected keyword'
+                        ' arguments: {0}'.format(list(kwargs.keys())))
 
     new_lists = []
-    for clist, s in zip(cropobject_lists, shift_by):
+    used_objids = set()
+    shift_by = 0
+    for clist in cropobject_lists:
+        s = shift_by
+        shift_by += len(clist)
+        if len(clist) == 0:
+            continue
+        if any([(c.objid + s) in used_objids for c in clist]):
+            s = max(used_objids) + 1 - min([c.objid for c in clist])
+
         new_list = []
         for c in clist:
-            new_c = copy.deepcopy(c)
+            if deep_copy:
+                new_c = copy.deepcopy(c)
+            else:
+                new_c = _readonly_shallow_copy(c)
             new_c.objid = c.objid + s
             new_c.inlinks = [i + s for i in c.inlinks]
             new_c.outlinks = [o + s for o in c.outlinks]
             new_list.append(new_c)
         new_lists.append(new_list)
+        used_objids.update([c.objid for c in new_list])
 
     output = list(itertools.chain(*new_lists))
 
-    return output
\ No newline at end of file
+    return output
+
+
+def _readonly_shallow_copy(cropobject):
+    """Copies the CropObject without copying its mask. The copy gets
+    a read-only view of the mask, so that the original cannot be changed
+    through the copy."""
+    new_c = copy.copy(cropobject)
+    # Our CropObjects keep binary masks bit-packed and hand out read-only
+    # arrays already; other masks (ours if non-binary, or of other
+    # CropObject implementations) are plain arrays.
+    for attr in ['_mask', 'mask']:
+        mask = new_c.__dict__.get(attr, None)
+        if isinstance(mask, numpy.ndarray):
+            mask = mask.view()
+            mask.flags.writeable = False
+            new_c.__dict__[attr] = mask
+    return new_c
@@ -0,0 +1,199 @@
+"""This module implements an on-disk cache of parsed CropObjectList
+files, for scripts that analyze the same annotation files over and over.
+
+The parsed CropObjects are stored in the binary sidecar format
+(see ``muscimarker_io.save_cropobject_list_binary()``), which loads
+much faster than the XML. Cache entries are keyed by the absolute path,
+size and modification time of the XML file, so editing a file simply
+makes its old entry unreachable. The total size of the cache is bounded:
+when it grows over the limit, the least recently used entries are
+evicted.
+
+>>> import tempfile
+>>> cache = CropObjectListCache(cache_dir=tempfile.mkdtemp())
+>>> clfile = os.path.join(os.path.dirname(__file__),
+...                       'test_data', 'example_annotation.xml')
+>>> cropobjects = cache.parse(clfile)
+>>> cache.n_misses, cache.n_hits
+(1, 0)
+>>> cropobjects_cached = cache.parse(clfile)
+>>> cache.n_misses, cache.n_hits
+(1, 1)
+>>> export_cropobject_list(cropobjects) == export_cropobject_list(cropobjects_cached)
+True
+
+The scripts that use the cache expose it through a ``--no_cache`` flag.
+"""
+from __future__ import print_function, unicode_literals, division
+
+from builtins import object
+import functools
+import hashlib
+import logging
+import os
+
+from MUSCIMarker.muscimarker_io import CropObject, parse_cropobject_list, export_cropobject_list, \
+    save_cropobject_list_binary, load_cropobject_list_binary, CROPOBJECT_BINARY_SUFFIX
+
+__version__ = "0.0.1"
+__author__ = "Jan Hajic jr."
+
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.muscimarker-cache')
+'''Where the cache is kept, unless the ``MUSCIMARKER_CACHE_DIR``
+environment variable says otherwise.'''
+
+CACHE_DIR_HELP = 'The cache is kept in $MUSCIMARKER_CACHE_DIR' \
+                 ' (default: {0}).'.format(DEFAULT_CACHE_DIR)
+'''Describes where the cache is, for the ``--help`` of scripts that use it.'''
+
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+'''The default size bound of the cache, in bytes (1 GB).'''
+
+
+class CropObjectListCache(object):
+    """Parses CropObjectList files, remembering the results on disk.
+
+    The cache directory is created in the constructor. A cache sent
+    to worker processes (e.g. inside the parser given to
+    ``muscimarker_io.parse_cropobject_lists_parallel()``) is unpickled
+    there without calling the constructor, so the workers just use
+    the directory created by the parent.
+
+    :param cache_dir: Where to keep the cached entries. Created if needed.
+        Defaults to ``$MUSCIMARKER_CACHE_DIR``, or ``DEFAULT_CACHE_DIR``.
+
+    :param max_size: Maximum total size of the cache entries, in bytes.
+    """
+    def __init__(self, cache_dir=None,
+                 max_size=DEFAULT_CACHE_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = os.environ.get('MUSCIMARKER_CACHE_DIR',
+                                       os.path.expanduser(DEFAULT_CACHE_DIR))
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def parse(self, filename, parser=parse_cropobject_list,
+              cropobject_class=CropObject, **parser_kwargs):
+        """Returns the CropObjects from the given file: from the cache
+        if possible, otherwise by calling ``parser(filename, **parser_kwargs)``
+        and storing the result.
+
+        Different parsers produce different CropObjects (e.g. with or
+        without UIDs), so they get separate cache entries. The ``parser_kwargs``
+        are not part of the key: they must not change what is parsed.
+
+        :param cropobject_class: The class of the CropObjects returned
+            by the parser, used to rebuild them from the cache.
+        """
+        entry = self._entry_filename(filename, parser)
+        if os.path.isfile(entry):
+            try:
+                cropobjects = load_cropobject_list_binary(entry,
+                                                          cropobject_class=cropobject_class)
+                # Mark as recently used.
+                os.utime(entry, None)
+                self.n_hits += 1
+                logging.debug('Cache: hit for {0}'.format(filename))
+                return cropobjects
+            except (IOError, OSError, ValueError, KeyError) as e:
+                logging.warning('Cache: broken entry {0} for {1}, re-parsing: {2}'
+                                ''.format(entry, filename, e))
+
+        self.n_misses += 1
+        logging.debug('Cache: miss for {0}'.format(filename))
+        cropobjects = parser(filename, **parser_kwargs)
+        self._store(cropobjects, entry)
+        return cropobjects
+
+    def _entry_filename(self, filename, parser):
+        stat = os.stat(filename)
+        parser_name = '{0}.{1}'.format(parser.__module__, parser.__name__)
+        key = '\t'.join([os.path.abspath(filename),
+                         str(stat.st_size),
+                         repr(stat.st_mtime),
+                         parser_name])
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + CROPOBJECT_BINARY_SUFFIX)
+
+    def _store(self, cropobjects, entry):
+        # Write into a temporary file first, so that a concurrent reader
+        # never sees a half-written entry.
+        tmp_entry = '{0}.{1}.tmp'.format(entry, os.getpid())
+        try:
+            save_cropobject_list_binary(cropobjects, tmp_entry)
+            if os.path.isfile(entry):
+                os.remove(entry)
+            os.rename(tmp_entry, entry)
+        except (IOError, OSError) as e:
+            logging.warning('Cache: could not store entry {0}: {1}'.format(entry, e))
+            if os.path.isfile(tmp_entry):
+                os.remove(tmp_entry)
+            return
+        self.evict()
+
+    def _entries(self):
+        """Returns ``(mtime, size, path)`` of all the cache entries."""
+        entries = []
+        for f in os.listdir(self.cache_dir):
+            if not f.endswith(CROPOBJECT_BINARY_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, f)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Evicted by someone else in the meantime.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Removes least recently used entries until the cache
+        fits into ``max_size``."""
+        entries = sorted(self._entries())
+        total_size = sum([size for _, size, _ in entries])
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            logging.debug('Cache: evicting {0}'.format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """Removes all the cache entries."""
+        for _, _, path in self._entries():
+            os.remove(path)
+
+
+def cropobject_list_parser(use_cache=True, parser=parse_cropobject_list,
+                           cropobject_class=CropObject, **parser_kwargs):
+    """Returns a function that parses a CropObjectList file, going through
+    a ``CropObjectListCache`` unless ``use_cache`` is False. This is how
+    scripts implement their ``--no_cache`` flag.
+
+    The cache is created here, once: call this in the parent process and
+    pass the returned function to the workers.
+
+    >>> parse = cropobject_list_parser(use_cache=False, lazy_masks=True)
+    >>> clfile = os.path.join(os.path.dirname(__file__),
+    ...                       'test_data', 'example_annotation.xml')
+    >>> len(parse(clfile))
+    139
+
+    """
+    if not use_cache:
+        return functools.partial(parser, **parser_kwargs)
+
+    cache = CropObjectListCache()
+    return functools.partial(cache.parse, parser=parser,
+                             cropobject_class=cropobject_class,
+                             **parser_kwargs)
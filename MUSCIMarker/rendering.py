@@ -528,40 +528,43 @@ class CropObjectListView(ListView):
         mask = cropobjects_merge_mask(model_cropobjects)
         inlinks, outlinks = cropobjects_merge_links(model_cropobjects)
 
-        # Remove the merged CropObjects
-        # logging.info('CropObjectListView.merge(): inlinks {0}, outlinks {1}'
-        #              ''.format(inlinks, outlinks))
-        logging.info('CropObjectListView.merge(): Removing/deselecting selection {0}'
-                     ''.format([c.objid for c in self.adapter.selection]))
-        if destructive:
-            to_destroy = [s for s in self.adapter.selection]
-            for s in to_destroy:
-                logging.info('CropObjectListView.merge(): Destroying {0}'
-                             ''.format(s._model_counterpart.uid))
-                s.remove_from_model()
-            # for s in self.adapter.selection:
-            #     logging.info('CropObjectListView.merge(): removing {0}'
-            #                  ''.format(s._model_counterpart.uid))
-            #     logging.info('CropObjectListView.merge(): Before removal,'
-            #                  ' selection: {0}'.format(self.adapter.selection))
-            #     s.remove_from_model()
-            #     logging.info('CropObjectListView.merge(): After removal,'
-            #                  ' selection: {0}'.format(self.adapter.selection))
-        elif deselect:
-            self.unselect_all()
-
-        model_cropobjects = None  # Release refs
-
-        self.render_new_to_back = True
-        c = App.get_running_app().generate_cropobject_from_model_selection({'top': t,
-                                                                            'left': l,
-                                                                            'bottom': b,
-                                                                            'right': r},
-                                                                           mask=mask)
-        c.inlinks = inlinks
-        c.outlinks = outlinks
-
-        self._model.add_cropobject(c)
+        # Removing the merged CropObjects and adding the new one
+        # is redrawn only once, at the end of the batch.
+        with self._model.batch():
+            # Remove the merged CropObjects
+            # logging.info('CropObjectListView.merge(): inlinks {0}, outlinks {1}'
+            #              ''.format(inlinks, outlinks))
+            logging.info('CropObjectListView.merge(): Removing/deselecting selection {0}'
+                         ''.format([c.objid for c in self.adapter.selection]))
+            if destructive:
+                to_destroy = [s for s in self.adapter.selection]
+                for s in to_destroy:
+                    logging.info('CropObjectListView.merge(): Destroying {0}'
+                                 ''.format(s._model_counterpart.uid))
+                    s.remove_from_model()
+                # for s in self.adapter.selection:
+                #     logging.info('CropObjectListView.merge(): removing {0}'
+                #                  ''.format(s._model_counterpart.uid))
+                #     logging.info('CropObjectListView.merge(): Before removal,'
+                #                  ' selection: {0}'.format(self.adapter.selection))
+                #     s.remove_from_model()
+                #     logging.info('CropObjectListView.merge(): After removal,'
+                #                  ' selection: {0}'.format(self.adapter.selection))
+            elif deselect:
+                self.unselect_all()
+
+            model_cropobjects = None  # Release refs
+
+            self.render_new_to_back = True
+            c = App.get_running_app().generate_cropobject_from_model_selection({'top': t,
+                                                                                'left': l,
+                                                                                'bottom': b,
+                                                                                'right': r},
+                                                                               mask=mask)
+            c.inlinks = inlinks
+            c.outlinks = outlinks
+
+            self._model.add_cropobject(c)
         # Problem with retaining selection: this triggers repopulation
         self.render_new_to_back = False
 
@@ -659,25 +662,24 @@ class CropObjectListView(ListView):
 
         _relevant_clsnames = set(list(InferenceEngineConstants.NONGRACE_NOTEHEAD_CLSNAMES)
                                  + list(InferenceEngineConstants.REST_CLSNAMES))
+        _relevant_objids = set(self._model.objids_with_clsname(*_relevant_clsnames))
         prec_cropobjects = [c for c in cropobjects
-                            if c.clsname in _relevant_clsnames]
+                            if c.objid in _relevant_objids]
         logging.info('_infer_precedence: {0} total prec. cropobjects'
                      ''.format(len(prec_cropobjects)))
 
         # Group the objects according to the staff they are related to
         # and infer precedence on these subgroups.
         if factor_by_staff:
-            staffs = [c for c in cropobjects
-                      if c.clsname == InferenceEngineConstants.STAFF_CLSNAME]
-            logging.info('_infer_precedence: got {0} staffs'.format(len(staffs)))
-            staff_objids = {c.objid: i for i, c in enumerate(staffs)}
-            prec_cropobjects_per_staff = [[] for _ in staffs]
+            _objids = set([c.objid for c in cropobjects])
+            staff_objids = [s for s in self._model.staff_objids() if s in _objids]
+            logging.info('_infer_precedence: got {0} staffs'.format(len(staff_objids)))
             # All CropObjects relevant for precedence have a relationship
             # to a staff.
-            for c in prec_cropobjects:
-                for o in c.outlinks:
-                    if o in staff_objids:
-                        prec_cropobjects_per_staff[staff_objids[o]].append(c)
+            _prec_cdict = {c.objid: c for c in prec_cropobjects}
+            prec_cropobjects_per_staff = [
+                [_prec_cdict[o] for o in staff_group if o in _prec_cdict]
+                for staff_group in self._model.objids_attached_to_staffs(staff_objids)]
 
             logging.info('Precedence groups: {0}'
                          ''.format(prec_cropobjects_per_staff))
@@ -693,12 +695,12 @@ class CropObjectListView(ListView):
             return
 
         # Group into equivalence if noteheads share stems
+        _stem_objids = set(self._model.objids_with_clsname('stem'))
         _stems_to_noteheads_map = collections.defaultdict(list)
         for c in prec_cropobjects:
             for o in c.outlinks:
-                c_o = self._model.cropobjects[o]
-                if c_o.clsname == 'stem':
-                    _stems_to_noteheads_map[c_o.objid].append(c.objid)
+                if o in _stem_objids:
+                    _stems_to_noteheads_map[o].append(c.objid)
 
         _prec_equiv_objids = []
         _stemmed_noteheads_objids = []
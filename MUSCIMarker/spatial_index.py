@@ -0,0 +1,209 @@
+"""This module implements a spatial index of CropObject bounding boxes,
+for finding the CropObjects in some region of the image without
+checking all of them.
+
+The index is a uniform grid: the image is divided into square cells,
+and each cell remembers which bounding boxes overlap it. A query only
+looks at the cells it covers and then checks the exact bounding boxes
+of the CropObjects found there.
+
+>>> index = SpatialIndex(cell_size=16)
+>>> index.insert(0, (10, 10, 20, 30))
+>>> index.insert(1, (40, 0, 45, 100))
+>>> index.insert(2, (100, 100, 120, 110))
+>>> index.query_bbox(0, 0, 41, 15)
+[0, 1]
+>>> index.query_point(42, 50)
+[1]
+>>> index.nearest(90, 90, k=2)
+[2, 1]
+
+Moving a bounding box is just inserting it again under the same objid:
+
+>>> index.insert(2, (0, 0, 5, 5))
+>>> index.query_point(2, 2)
+[2]
+>>> index.remove(2)
+>>> len(index)
+2
+
+Bounding boxes are ``(top, left, bottom, right)`` with ``bottom`` and
+``right`` exclusive, like ``CropObject.bounding_box``.
+"""
+from __future__ import print_function, unicode_literals, division
+
+from builtins import object
+import collections
+import heapq
+import math
+
+__version__ = "0.0.1"
+__author__ = "Jan Hajic jr."
+
+
+def bbox_point_distance(bbox, row, col):
+    """The euclidean distance from the given point to the nearest pixel
+    of the given bounding box. Zero if the point is inside.
+
+    >>> bbox_point_distance((0, 0, 10, 10), 5, 5)
+    0.0
+    >>> bbox_point_distance((0, 0, 10, 10), 12, 13)
+    5.0
+    """
+    t, l, b, r = bbox
+    d_row = max(t - row, 0, row - (b - 1))
+    d_col = max(l - col, 0, col - (r - 1))
+    return math.sqrt(d_row ** 2 + d_col ** 2)
+
+
+class SpatialIndex(object):
+    """A grid index of bounding boxes, identified by objids.
+
+    :param cell_size: The size of the grid cells, in pixels. Cells should
+        be somewhat larger than a typical small symbol (a notehead);
+        large objects such as staffs then take up a row of cells.
+    """
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+
+        # (cell row, cell col) --> set of objids
+        self._cells = collections.defaultdict(set)
+        # objid --> bbox
+        self._bboxes = {}
+
+    def __len__(self):
+        return len(self._bboxes)
+
+    def __contains__(self, objid):
+        return objid in self._bboxes
+
+    def bbox(self, objid):
+        return self._bboxes[objid]
+
+    def _cell_range(self, t, l, b, r):
+        """The cells covered by the given bounding box, as
+        ``(first row, last row, first col, last col)``, inclusive."""
+        cs = self.cell_size
+        return (int(t // cs), int((max(b, t + 1) - 1) // cs),
+                int(l // cs), int((max(r, l + 1) - 1) // cs))
+
+    def _iter_cells(self, t, l, b, r):
+        row_start, row_end, col_start, col_end = self._cell_range(t, l, b, r)
+        for cell_row in range(row_start, row_end + 1):
+            for cell_col in range(col_start, col_end + 1):
+                yield cell_row, cell_col
+
+    ##########################################################################
+    # Keeping in sync with the CropObjects
+
+    def insert(self, objid, bbox):
+        """Records the bounding box of the given objid. If the objid
+        is already in the index, its bounding box is replaced."""
+        if objid in self._bboxes:
+            self.remove(objid)
+        t, l, b, r = [int(x) for x in bbox]
+        self._bboxes[objid] = (t, l, b, r)
+        for cell in self._iter_cells(t, l, b, r):
+            self._cells[cell].add(objid)
+
+    def remove(self, objid):
+        """Forgets the given objid."""
+        bbox = self._bboxes.pop(objid)
+        for cell in self._iter_cells(*bbox):
+            objids = self._cells[cell]
+            objids.discard(objid)
+            if len(objids) == 0:
+                del self._cells[cell]
+
+    def clear(self):
+        self._cells = collections.defaultdict(set)
+        self._bboxes = {}
+
+    ##########################################################################
+    # Queries
+
+    def _candidates(self, t, l, b, r):
+        if len(self._cells) == 0:
+            return set()
+        candidates = set()
+        row_start, row_end, col_start, col_end = self._cell_range(t, l, b, r)
+        if (row_end - row_start + 1) * (col_end - col_start + 1) > len(self._cells):
+            # The query covers more cells than there are occupied cells.
+            for (cell_row, cell_col), objids in self._cells.items():
+                if (row_start <= cell_row <= row_end) \
+                        and (col_start <= cell_col <= col_end):
+                    candidates.update(objids)
+            return candidates
+        for cell in self._iter_cells(t, l, b, r):
+            if cell in self._cells:
+                candidates.update(self._cells[cell])
+        return candidates
+
+    def query_bbox(self, t, l, b, r):
+        """Returns the sorted objids whose bounding boxes intersect
+        the given bounding box."""
+        output = []
+        for objid in self._candidates(t, l, b, r):
+            o_t, o_l, o_b, o_r = self._bboxes[objid]
+            if (o_t < b) and (t < o_b) and (o_l < r) and (l < o_r):
+                output.append(objid)
+        return sorted(output)
+
+    def query_point(self, row, col):
+        """Returns the sorted objids whose bounding boxes contain
+        the given pixel."""
+        return self.query_bbox(row, col, row + 1, col + 1)
+
+    def nearest(self, row, col, k=1):
+        """Returns the objids of the ``k`` bounding boxes nearest to
+        the given point, nearest first (see ``bbox_point_distance()``).
+        Ties are broken by objid.
+
+        The search goes through rings of cells around the point, and stops
+        once no bounding box outside the rings searched so far can be
+        nearer than the ``k``-th nearest one found.
+        """
+        if (k <= 0) or (len(self._bboxes) == 0):
+            return []
+        cs = self.cell_size
+        center_row, center_col = int(row // cs), int(col // cs)
+
+        occupied_rows = [cell_row for cell_row, _ in self._cells]
+        occupied_cols = [cell_col for _, cell_col in self._cells]
+        max_radius = max(abs(center_row - min(occupied_rows)),
+                         abs(center_row - max(occupied_rows)),
+                         abs(center_col - min(occupied_cols)),
+                         abs(center_col - max(occupied_cols)))
+
+        seen = set()
+        found = []
+        for radius in range(max_radius + 1):
+            for cell in self._ring(center_row, center_col, radius):
+                for objid in self._cells.get(cell, ()):
+                    if objid not in seen:
+                        seen.add(objid)
+                        found.append((bbox_point_distance(self._bboxes[objid], row, col),
+                                      objid))
+            if len(found) >= k:
+                # Everything not seen yet lies outside the searched square.
+                outside_distance = min(row - (center_row - radius) * cs,
+                                       (center_row + radius + 1) * cs - row,
+                                       col - (center_col - radius) * cs,
+                                       (center_col + radius + 1) * cs - col)
+                nearest = heapq.nsmallest(k, found)
+                if nearest[-1][0] <= outside_distance:
+                    return [objid for _, objid in nearest]
+        return [objid for _, objid in heapq.nsmallest(k, found)]
+
+    @staticmethod
+    def _ring(center_row, center_col, radius):
+        """The cells at the given Chebyshev distance from the center cell."""
+        if radius == 0:
+            yield center_row, center_col
+            return
+        for cell_col in range(center_col - radius, center_col + radius + 1):
+            yield center_row - radius, cell_col
+            yield center_row + radius, cell_col
+        for cell_row in range(center_row - radius + 1, center_row + radius):
+            yield cell_row, center_col - radius
+            yield cell_row, center_col + radius
@@ -137,14 +137,17 @@ class PairwiseClassificationParser(object):
         _cdict = {c.objid: c for c in cropobjects}
 
         # Collect stems per notehead
-        notehead_objids = set([c.objid for c in cropobjects if c.clsname == 'notehead-full'])
-        stem_objids = set([c.objid for c in cropobjects if c.clsname == 'stem'])
+        _objids_by_clsname = collections.defaultdict(set)
+        for c in cropobjects:
+            _objids_by_clsname[c.clsname].add(c.objid)
+        notehead_objids = _objids_by_clsname['notehead-full']
+        stem_objids = _objids_by_clsname['stem']
 
         noteheads_with_stem_objids = set()
         stems_with_notehead_objids = set()
         for f, t in edges:
-            if _cdict[f].clsname == 'notehead-full':
-                if _cdict[t].clsname == 'stem':
+            if f in notehead_objids:
+                if t in stem_objids:
                     noteheads_with_stem_objids.add(f)
                     stems_with_notehead_objids.add(t)
 
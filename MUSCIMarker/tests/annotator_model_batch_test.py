@@ -0,0 +1,67 @@
+import unittest
+
+from muscima.cropobject import CropObject
+
+from MUSCIMarker.annotator_model import CropObjectAnnotatorModel
+
+
+class AnnotatorModelBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.model = CropObjectAnnotatorModel()
+        self.model.import_cropobjects([CropObject(i, 'notehead-full', 10 * i, 10,
+                                                  width=8, height=6)
+                                       for i in range(4)])
+        self.dispatched = []
+        self.changes = []
+        self.model.bind(cropobjects=lambda *args: self.dispatched.append('cropobjects'))
+        self.model.graph.bind(edges=lambda *args: self.dispatched.append('edges'))
+        self.model.bind(on_cropobjects_changed=lambda instance, objids:
+                        self.changes.append(objids))
+
+    def test_dispatch_deferred_to_end(self):
+        with self.model.batch():
+            self.model.ensure_add_edge((0, 1))
+            self.model.ensure_add_edge((1, 2))
+            self.model.remove_cropobject(2)
+            self.assertEqual(self.dispatched, [])
+            self.assertEqual(self.changes, [])
+
+        self.assertEqual(sorted(self.dispatched), ['cropobjects', 'edges'])
+        self.assertEqual(self.changes, [{0, 1, 2}])
+
+        # The CropObjects are synced to the graph at the end.
+        self.assertEqual(self.model.cropobjects[1].inlinks, [0])
+        self.assertEqual(self.model.cropobjects[1].outlinks, [])
+
+        # Outside the batch, dispatching is immediate again.
+        self.model.ensure_add_edge((0, 3))
+        self.assertGreater(len(self.dispatched), 2)
+        self.assertEqual(self.model.cropobjects[3].inlinks, [0])
+
+    def test_nested_batches(self):
+        with self.model.batch():
+            with self.model.batch():
+                self.model.ensure_add_edge((0, 1))
+            self.assertEqual(self.dispatched, [])
+            self.model.ensure_add_edge((2, 3))
+        self.assertEqual(self.changes, [{0, 1, 2, 3}])
+
+    def test_empty_batch(self):
+        with self.model.batch():
+            pass
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(self.changes, [])
+
+    def test_observers_restored_after_error(self):
+        try:
+            with self.model.batch():
+                self.model.ensure_add_edge((0, 1))
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(self.changes, [{0, 1}])
+        self.assertEqual(self.model.cropobjects[1].inlinks, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from lxml import etree
+from muscima.cropobject import CropObject
+
+from MUSCIMarker.annotator_model import CropObjectAnnotatorModel
+
+
+class _UnwritableCropObject(CropObject):
+    def __str__(self):
+        raise ValueError('Cannot write this CropObject.')
+
+
+class AnnotatorModelExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp_dir, 'annotation.xml')
+        self.model = CropObjectAnnotatorModel()
+        self.model.import_cropobjects([CropObject(i, 'notehead-full', 10 * i, 10,
+                                                  width=8, height=6)
+                                       for i in range(3)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_background_export(self):
+        self.model.export_cropobjects(self.output, background=True)
+        self.model.wait_for_export()
+        root = etree.parse(self.output).getroot()
+        self.assertEqual(sorted(int(e.findtext('Id')) for e in root.iter('CropObject')),
+                         [0, 1, 2])
+        self.assertEqual(os.listdir(self.tmp_dir), ['annotation.xml'])
+
+    def test_failed_export_keeps_previous_file(self):
+        self.model.export_cropobjects(self.output)
+        with open(self.output) as hdl:
+            saved = hdl.read()
+
+        self.model._add_cropobject(_UnwritableCropObject(3, 'stem', 0, 0, width=1, height=1),
+                                   perform_checks=False)
+        self.model.export_cropobjects(self.output, background=True)
+        with self.assertRaises(ValueError):
+            self.model.wait_for_export()
+        # The error is only raised once.
+        self.model.wait_for_export()
+
+        with open(self.output) as hdl:
+            self.assertEqual(hdl.read(), saved)
+        self.assertEqual(os.listdir(self.tmp_dir), ['annotation.xml'])
+
+    def test_failed_export_is_reported(self):
+        failures = []
+        self.model.bind(on_export_failed=lambda instance, output, error:
+                        failures.append((output, error)))
+        output = os.path.join(self.tmp_dir, 'missing_dir', 'annotation.xml')
+        self.model.export_cropobjects(output, background=True)
+        self.model._join_export_thread()
+        # Normally called from the Clock, in the main thread.
+        self.model._report_export_error()
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0][0], output)
+        self.model.wait_for_export()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+import numpy
+from muscima.cropobject import CropObject
+from muscima.graph import find_related_staffs
+
+from MUSCIMarker.annotator_model import CropObjectAnnotatorModel
+
+
+class AnnotatorModelIndexesTest(unittest.TestCase):
+    def setUp(self):
+        self.model = CropObjectAnnotatorModel()
+        staffs = [CropObject(i, 'staff', 100 * i, 0, width=200, height=40)
+                  for i in range(2)]
+        noteheads = [CropObject(2 + i, 'notehead-full', 100 * (i % 2) + 10, 10 * i,
+                                width=8, height=6, outlinks=[i % 2])
+                     for i in range(4)]
+        for s in staffs:
+            s.inlinks = [c.objid for c in noteheads if s.objid in c.outlinks]
+        self.model.import_cropobjects(staffs + noteheads)
+
+    def test_objid_allocation(self):
+        self.assertEqual(self.model.get_next_cropobject_id(), 6)
+        # Removed objids are not reused.
+        self.model.remove_cropobject(5)
+        self.assertEqual(self.model.get_next_cropobject_id(), 6)
+
+        self.assertEqual(self.model.reserve_cropobject_ids(3), 6)
+        self.assertEqual(self.model.get_next_cropobject_id(), 9)
+        self.model._add_cropobject(CropObject(20, 'stem', 0, 0, width=1, height=20),
+                                   perform_checks=False)
+        self.assertEqual(self.model.get_next_cropobject_id(), 21)
+
+        self.model.clear_cropobjects()
+        self.assertEqual(self.model.get_next_cropobject_id(), 0)
+
+    def test_clsname_index(self):
+        self.assertEqual(self.model.objids_with_clsname('notehead-full'), [2, 3, 4, 5])
+        self.assertEqual(self.model.objids_with_clsname('staff', 'stem'), [0, 1])
+
+        self.model.set_cropobject_clsname(3, 'notehead-empty')
+        self.model.remove_cropobject(4)
+        self.assertEqual(self.model.objids_with_clsname('notehead-full'), [2, 5])
+        self.assertEqual([c.objid for c in self.model.cropobjects_with_clsname('notehead-empty')],
+                         [3])
+
+    def test_staff_index(self):
+        self.assertEqual(self.model.staff_objids(), [0, 1])
+        self.assertEqual(self.model.objids_attached_to_staff(0), [2, 4])
+        self.assertEqual(self.model.staffs_of(3), [1])
+
+        self.model.ensure_add_edge((3, 0))
+        self.model.ensure_remove_edge(4, 0)
+        self.assertEqual(self.model.objids_attached_to_staff(0), [2, 3])
+        self.assertEqual(self.model.staffs_of(3), [0, 1])
+        self.assertEqual(self.model.staffs_of(4), [])
+        self.assertEqual(self.model.objids_attached_to_staffs([0, 1, 7]),
+                         [[2, 3], [3, 5], []])
+
+    def test_related_staffs(self):
+        self.model._add_cropobject(CropObject(6, 'staff_line', 10, 0, width=200, height=1),
+                                   perform_checks=False)
+        self.model._add_cropobject(CropObject(7, 'staff_space', 11, 0, width=200, height=9),
+                                   perform_checks=False)
+        self.model._add_cropobject(CropObject(8, 'stem', 0, 0, width=1, height=20),
+                                   perform_checks=False)
+        self.model.ensure_add_edges([(0, 6), (0, 7), (2, 8)])
+        all_cropobjects = list(self.model.cropobjects.values())
+        for query in [[2], [2, 3], [8], [0]]:
+            cropobjects = [self.model.cropobjects[o] for o in query]
+            for with_stafflines in [True, False]:
+                related = self.model.find_related_staffs(cropobjects,
+                                                         with_stafflines=with_stafflines)
+                expected = find_related_staffs(cropobjects, all_cropobjects,
+                                               with_stafflines=with_stafflines)
+                self.assertEqual(sorted(c.objid for c in related),
+                                 sorted(c.objid for c in expected))
+
+
+    def test_spatial_index(self):
+        self.assertEqual(self.model.find_objids_in_bbox(0, 0, 50, 15), [0, 2])
+        self.assertEqual(self.model.find_objids_at_point(112, 12), [1, 3])
+        self.assertEqual(self.model.find_nearest_objids(60, 300, k=2), [0, 1])
+
+        # Moving a CropObject is adding it again.
+        c = self.model.cropobjects[3]
+        c.x += 200
+        self.model._add_cropobject(c, perform_checks=False)
+        self.assertEqual(self.model.find_objids_at_point(112, 12), [1])
+        self.assertEqual(self.model.find_objids_at_point(312, 12), [3])
+
+        self.model.remove_cropobject(0)
+        self.assertEqual(self.model.find_objids_in_bbox(0, 0, 50, 15), [2])
+        self.model.clear_cropobjects()
+        self.assertEqual(self.model.find_objids_in_bbox(0, 0, 1000, 1000), [])
+
+    def test_cc_cache_update_in_region(self):
+        image = numpy.zeros((20, 20), dtype='uint8')
+        image[2:4, 2:18] = 255
+        image[10:12, 2:18] = 255
+        self.model.load_image(image, do_preprocessing=False, update_temp=False)
+        labels = self.model.labels
+        self.assertEqual(self.model.cc, 2)
+
+        # Join the two lines: the cache is patched, not recomputed.
+        image = image.copy()
+        image[4:10, 5] = 255
+        self.model.load_image(image, do_preprocessing=False, update_temp=False,
+                              changed_region=(4, 5, 10, 6))
+        self.assertIs(self.model.labels, labels)
+        self.assertEqual(len(numpy.unique(labels[image > 0])), 1)
+        self.assertEqual(self.model.bboxes[labels[2, 2]], [2, 2, 12, 18])
+        self.assertEqual(self.model.cc, 1)
+
+        # Cut the lower line: a new label is used, the count follows.
+        image = image.copy()
+        image[10:12, 10] = 0
+        self.model.load_image(image, do_preprocessing=False, update_temp=False,
+                              changed_region=(10, 10, 12, 11))
+        self.assertEqual(self.model.cc, 2)
+        self.assertEqual(self.model.max_label, labels.max())
+        self.assertGreater(self.model.max_label, self.model.cc)
+
+        # Without a region, the cache is dropped.
+        self.model.load_image(image, do_preprocessing=False, update_temp=False)
+        self.assertIsNot(self.model.labels, labels)
+
+    def test_cc_cache_background(self):
+        image = numpy.zeros((20, 20), dtype='uint8')
+        image[2:4, 2:18] = 255
+        self.model.load_image(image, do_preprocessing=False, update_temp=False)
+        first_future = self.model._cc_future
+        self.assertIsNotNone(first_future)
+
+        # A new image cancels the computation for the old one.
+        image = image.copy()
+        image[10:12, 2:18] = 255
+        self.model.load_image(image, do_preprocessing=False, update_temp=False)
+        self.assertTrue(first_future.cancelled)
+        self.assertIsNot(self.model._cc_future, first_future)
+
+        # Region edits made before the result is collected are applied to it.
+        image = image.copy()
+        image[4:10, 5] = 255
+        self.model.load_image(image, do_preprocessing=False, update_temp=False,
+                              changed_region=(4, 5, 10, 6))
+        self.assertIsNotNone(self.model._cc_future)
+        labels = self.model.labels
+        self.assertIsNone(self.model._cc_future)
+        self.assertTrue(self.model.is_cc_cache_ready())
+        self.assertEqual(len(numpy.unique(labels[image > 0])), 1)
+        self.assertEqual(self.model.bboxes[labels[2, 2]], [2, 2, 12, 18])
+
+    def test_cc_labels_memmap(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            self.model.cc_labels_dir = tmp_dir
+            image = numpy.zeros((20, 20), dtype='uint8')
+            image[2:4, 2:18] = 255
+            self.model.load_image(image, do_preprocessing=False, update_temp=False)
+            # Replaced before (or while) being computed: no file is left behind.
+            self.model.load_image(image.copy(), do_preprocessing=False, update_temp=False)
+            labels = self.model.labels
+            self.assertIsInstance(labels, numpy.memmap)
+            self.assertEqual(labels.dtype, numpy.dtype('uint16'))
+            self.assertEqual(self.model.bboxes[labels[2, 2]], [2, 2, 4, 18])
+            self.assertEqual(len(os.listdir(tmp_dir)), 1)
+
+            self.model._invalidate_cc_cache()
+            self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def _cc_memory(self, image):
+        tracemalloc.start()
+        try:
+            self.model.load_image(image, compute_cc=True, do_preprocessing=False,
+                                  update_temp=False)
+            labels = self.model.labels
+            memory, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return labels, memory
+
+    def test_cc_labels_memory_budget(self):
+        # An A4 page at 300 DPI, with a symbol every 40 pixels.
+        image = numpy.zeros((3508, 2480), dtype='uint8')
+        for t in range(0, image.shape[0], 40):
+            for l in range(0, image.shape[1], 40):
+                image[t:t + 5, l:l + 5] = 255
+
+        labels, memory = self._cc_memory(image)
+        self.assertNotIsInstance(labels, numpy.memmap)
+        self.assertGreaterEqual(memory, labels.nbytes)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            self.model.cc_labels_dir = tmp_dir
+            labels, memory = self._cc_memory(image.copy())
+            self.assertIsInstance(labels, numpy.memmap)
+            # Only the bboxes are kept in memory, not the label image.
+            self.assertLess(memory, labels.nbytes // 4)
+            self.assertEqual(self.model.cc, 88 * 62)
+
+            del labels
+            self.model._invalidate_cc_cache()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
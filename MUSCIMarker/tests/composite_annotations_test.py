@@ -0,0 +1,68 @@
+import unittest
+import os
+
+import numpy
+
+from MUSCIMarker.muscimarker_io import CropObject, parse_cropobject_list, \
+    render_annotations, composite_annotations
+
+
+class _Class(object):
+    def __init__(self, name, color):
+        self.name = name
+        self.color = color
+
+
+class CompositeAnnotationsTest(unittest.TestCase):
+    def setUp(self):
+        fpath = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                             'static', 'example_annotation.xml')
+        self.cropobjects = parse_cropobject_list(fpath)
+        clsnames = sorted(set([c.clsname for c in self.cropobjects]))
+        self.mlclasses = [_Class(n, (1.0, 0.4, 0.1 * (i % 10)))
+                          for i, n in enumerate(clsnames)]
+        height = max([c.bottom for c in self.cropobjects]) + 5
+        width = max([c.right for c in self.cropobjects]) + 5
+        self.img = numpy.random.RandomState(42).uniform(size=(height, width))
+
+    def test_same_as_render_annotations_for_one_object(self):
+        for c in self.cropobjects[:10]:
+            expected = render_annotations(self.img, [c], self.mlclasses, grayscale=True)
+            output = composite_annotations(self.img, [c], self.mlclasses,
+                                           grayscale=True, use_masks=False)
+            self.assertEqual(output.shape, expected.shape)
+            self.assertTrue(numpy.allclose(output, expected, atol=1e-6))
+
+    def test_tiled_same_as_untiled(self):
+        output = composite_annotations(self.img, self.cropobjects, self.mlclasses,
+                                       grayscale=True)
+        for tile_height in [1, 37, 500]:
+            tiled = composite_annotations(self.img, self.cropobjects, self.mlclasses,
+                                          grayscale=True, tile_height=tile_height)
+            self.assertTrue((tiled == output).all())
+
+    def test_uint8_output(self):
+        output = composite_annotations(self.img, self.cropobjects, self.mlclasses,
+                                       grayscale=True)
+        output_uint8 = composite_annotations(self.img, self.cropobjects, self.mlclasses,
+                                             grayscale=True, as_uint8=True)
+        self.assertEqual(output_uint8.dtype, numpy.uint8)
+        self.assertLessEqual(numpy.abs(output * 255 - output_uint8).max(), 1.0)
+
+        # uint8 input is scaled to (0, 1) first.
+        img_uint8 = (self.img * 255).astype('uint8')
+        from_uint8 = composite_annotations(img_uint8, self.cropobjects, self.mlclasses,
+                                           grayscale=True)
+        self.assertLessEqual(numpy.abs(from_uint8 - output).max(), 1.0 / 255 + 1e-6)
+
+    def test_objects_outside_image_are_clipped(self):
+        c = CropObject(0, self.mlclasses[0].name, 2, 2, width=10, height=10)
+        output = composite_annotations(numpy.zeros((5, 5)), [c], self.mlclasses,
+                                       grayscale=True)
+        self.assertEqual(output.shape, (5, 5, 3))
+        self.assertTrue((output[2:, 2:, 0] > 0).all())
+        self.assertTrue((output[:2, :, 0] == 0).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+import numpy
+import skimage.measure
+
+from MUSCIMarker.utils import connected_components2bboxes, compute_connected_components, \
+    update_connected_components, components_mask
+
+
+class ConnectedComponentsTest(unittest.TestCase):
+    def test_bboxes_and_areas(self):
+        rng = numpy.random.RandomState(42)
+        for _ in range(20):
+            image = rng.uniform(size=rng.randint(1, 60, size=2)) < 0.4
+            labels = skimage.measure.label(image, background=0)
+            bboxes, areas = connected_components2bboxes(labels, return_areas=True)
+
+            self.assertEqual(sorted(bboxes.keys()), numpy.unique(labels).tolist())
+            for l, (t, l_, b, r) in bboxes.items():
+                rows, cols = numpy.nonzero(labels == l)
+                self.assertEqual([t, l_, b, r], [rows.min(), cols.min(),
+                                                 rows.max() + 1, cols.max() + 1])
+                self.assertEqual(areas[l], len(rows))
+
+    def test_no_background(self):
+        bboxes = connected_components2bboxes(numpy.ones((3, 5), dtype='int64'))
+        self.assertEqual(bboxes, {1: [0, 0, 3, 5]})
+        self.assertEqual(connected_components2bboxes(numpy.zeros((0, 0), dtype='int64')), {})
+
+        cc, labels, bboxes, areas = compute_connected_components(numpy.eye(3),
+                                                                 return_areas=True)
+        self.assertEqual(cc, 1)
+        self.assertEqual(areas, {0: 6, 1: 3})
+
+    def test_update_matches_full_labeling(self):
+        rng = numpy.random.RandomState(42)
+        for _ in range(50):
+            image = (rng.uniform(size=(40, 50)) < 0.45).astype('uint8')
+            cc, labels, bboxes = compute_connected_components(image)
+            max_label = cc
+            for _ in range(5):
+                t, l = rng.randint(0, 40), rng.randint(0, 50)
+                b, r = rng.randint(t, 41), rng.randint(l, 51)
+                image[t:b, l:r] = rng.uniform(size=(b - t, r - l)) < rng.uniform()
+                max_label = update_connected_components(image, labels, bboxes,
+                                                        (t, l, b, r), max_label)
+
+                _, labels_full, bboxes_full = compute_connected_components(image)
+                # Same components, possibly under different labels.
+                self.assertEqual(self._components(labels, bboxes),
+                                 self._components(labels_full, bboxes_full))
+                self.assertEqual(sorted(bboxes.keys()), numpy.unique(labels).tolist())
+                self.assertGreaterEqual(max_label, labels.max())
+
+    def test_update_overflow(self):
+        image = numpy.zeros((3, 5), dtype='uint8')
+        image[0, 0] = 1
+        cc, labels, bboxes = compute_connected_components(image)
+        self.assertEqual(labels.dtype, numpy.dtype('uint16'))
+
+        image[2, 4] = 1
+        labels_before, bboxes_before = labels.copy(), dict(bboxes)
+        with self.assertRaises(OverflowError):
+            update_connected_components(image, labels, bboxes, (2, 4, 3, 5),
+                                        max_label=numpy.iinfo('uint16').max)
+        self.assertTrue((labels == labels_before).all())
+        self.assertEqual(bboxes, bboxes_before)
+
+    def test_components_mask(self):
+        rng = numpy.random.RandomState(42)
+        image = rng.uniform(size=(40, 50)) < 0.3
+        _, labels, bboxes = compute_connected_components(image)
+        selected = rng.choice(numpy.arange(1, labels.max() + 1), size=5, replace=False)
+        (t, l, b, r), mask = components_mask(labels, bboxes, selected.tolist() + [0])
+
+        expected = numpy.isin(labels, selected)
+        rows, cols = numpy.nonzero(expected)
+        self.assertEqual((t, l, b, r), (rows.min(), cols.min(), rows.max() + 1, cols.max() + 1))
+        self.assertTrue((mask == expected[t:b, l:r]).all())
+        self.assertEqual(components_mask(labels, bboxes, [0]), (None, None))
+
+    @staticmethod
+    def _components(labels, bboxes):
+        return {(tuple(numpy.flatnonzero(labels == l)), tuple(bboxes[l]))
+                for l in bboxes}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from MUSCIMarker.muscimarker_io import parse_cropobject_list, export_cropobject_list, \
+    load_cropobject_list_binary, binary_sidecar_filename, is_binary_sidecar_fresh
+
+
+class CropObjectBinarySidecarTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        source = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                              'test_data', 'example_annotation.xml')
+        self.clfile = os.path.join(self.tmp_dir, 'example_annotation.xml')
+        shutil.copyfile(source, self.clfile)
+        self.binfile = binary_sidecar_filename(self.clfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _load(self, **kwargs):
+        return load_cropobject_list_binary(self.binfile, source_filename=self.clfile,
+                                           **kwargs)
+
+    def test_stale_sidecar_is_reparsed_and_rewritten(self):
+        self._load()
+        self.assertTrue(is_binary_sidecar_fresh(self.binfile, self.clfile))
+
+        with open(self.clfile) as hdl:
+            xml = hdl.read()
+        with open(self.clfile, 'w') as hdl:
+            hdl.write(xml.replace('<MLClassName>notehead-full</MLClassName>',
+                                  '<MLClassName>notehead-empty</MLClassName>', 1))
+        self.assertFalse(is_binary_sidecar_fresh(self.binfile, self.clfile))
+
+        cropobjects = self._load()
+        self.assertEqual(cropobjects[0].clsname, 'notehead-empty')
+        # The sidecar has been rewritten and is now used.
+        self.assertTrue(is_binary_sidecar_fresh(self.binfile, self.clfile))
+        cropobjects_bin = self._load(fallback_parser=None)
+        self.assertEqual(export_cropobject_list(cropobjects_bin),
+                         export_cropobject_list(parse_cropobject_list(self.clfile)))
+
+    def test_unreadable_sidecar_falls_back_to_xml(self):
+        with open(self.binfile, 'wb') as hdl:
+            hdl.write(b'not an npz archive')
+
+        cropobjects = self._load()
+        self.assertEqual(export_cropobject_list(cropobjects),
+                         export_cropobject_list(parse_cropobject_list(self.clfile)))
+        self.assertTrue(is_binary_sidecar_fresh(self.binfile, self.clfile))
+
+    def test_stale_sidecar_not_updated(self):
+        cropobjects = self._load(update_stale=False)
+        self.assertEqual(len(cropobjects), len(parse_cropobject_list(self.clfile)))
+        self.assertFalse(os.path.isfile(self.binfile))
+
+    def test_touched_source_with_same_content_is_fresh(self):
+        self._load()
+        stat = os.stat(self.clfile)
+        os.utime(self.clfile, (stat.st_atime, stat.st_mtime + 10))
+        self.assertTrue(is_binary_sidecar_fresh(self.binfile, self.clfile))
+
+
+if __name__ == '__main__':
+    unittest.main()
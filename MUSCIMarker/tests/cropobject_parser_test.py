@@ -0,0 +1,58 @@
+import unittest
+import os
+
+from lxml import etree
+
+from MUSCIMarker.muscimarker_io import parse_cropobject_list, _parse_cropobject_element
+
+
+class CropObjectElementDecoderTest(unittest.TestCase):
+    def test_xy_and_topleft_agree(self):
+        test_data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                     'test_data', 'cropobjects_xy_vs_topleft')
+        cropobjects = parse_cropobject_list(os.path.join(test_data_dir,
+                                                         '01_basic_topleft.xml'))
+        cropobjects_xy = parse_cropobject_list(os.path.join(test_data_dir,
+                                                            '01_basic_xy.xml'))
+        for c, c_xy in zip(cropobjects, cropobjects_xy):
+            self.assertEqual(str(c), str(c_xy))
+
+    def test_element_fields(self):
+        element = etree.fromstring(
+            '<CropObject>'
+            '<Id>3</Id>'
+            '<!-- comments are skipped -->'
+            '<MLClassName>notehead-full</MLClassName>'
+            '<X>20</X><Y>10</Y>'
+            '<Top>1</Top><Left>2</Left>'
+            '<Width>2</Width><Height>3</Height>'
+            '<Outlinks>4 5</Outlinks>'
+            '<Inlinks></Inlinks>'
+            '<Mask>0:1 1:5</Mask>'
+            '</CropObject>')
+        c = _parse_cropobject_element(element)
+        self.assertEqual(c.objid, 3)
+        self.assertEqual(c.clsname, 'notehead-full')
+        # Y/X take precedence over Top/Left, and are swapped.
+        self.assertEqual((c.top, c.left), (10, 20))
+        self.assertEqual((c.height, c.width), (3, 2))
+        self.assertEqual(c.inlinks, [])
+        self.assertEqual(c.outlinks, [4, 5])
+        self.assertEqual(int(c.mask.sum()), 5)
+
+    def test_element_missing_fields(self):
+        no_position = etree.fromstring(
+            '<CropObject><Id>0</Id><MLClassName>x</MLClassName>'
+            '<X>1</X><Top>1</Top><Width>1</Width><Height>1</Height>'
+            '</CropObject>')
+        self.assertRaises(KeyError, _parse_cropobject_element, no_position)
+
+        no_clsname = etree.fromstring(
+            '<CropObject><Id>0</Id>'
+            '<Top>1</Top><Left>1</Left><Width>1</Width><Height>1</Height>'
+            '</CropObject>')
+        self.assertRaises(ValueError, _parse_cropobject_element, no_clsname)
+
+
+if __name__ == '__main__':
+    unittest.main()
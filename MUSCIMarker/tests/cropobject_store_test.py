@@ -0,0 +1,107 @@
+import unittest
+
+import numpy
+
+from MUSCIMarker.cropobject_store import CropObjectStore
+from MUSCIMarker.muscimarker_io import CropObject
+
+
+def _random_cropobjects(rng, n, objid_offset=0):
+    clsnames = ['notehead-full', 'stem', 'beam', 'duration-dot']
+    cropobjects = []
+    for i in range(n):
+        h, w = rng.randint(1, 20, size=2)
+        t, l = rng.randint(-5, 100, size=2)
+        mask = (rng.uniform(size=(h, w)) < 0.7).astype('uint8')
+        cropobjects.append(CropObject(objid_offset + i, clsnames[rng.randint(len(clsnames))],
+                                      t, l, width=w, height=h, mask=mask))
+    return cropobjects
+
+
+class CropObjectStoreTest(unittest.TestCase):
+    def assertStoreMatches(self, store, cropobjects):
+        self.assertEqual(len(store), len(cropobjects))
+        by_objid = {c.objid: c for c in cropobjects}
+        for row, objid in enumerate(store.objids.tolist()):
+            c = by_objid[objid]
+            self.assertEqual((store.tops[row], store.lefts[row],
+                              store.bottoms[row], store.rights[row]),
+                             c.bounding_box)
+            self.assertEqual(store.clsnames[store.clsname_ids[row]], c.clsname)
+            if c.mask is None:
+                self.assertEqual(store.mask_areas[row], c.width * c.height)
+            else:
+                self.assertEqual(store.mask_areas[row], c.mask.sum())
+
+        # The class index follows the rows.
+        for clsname in set(store.clsnames):
+            self.assertEqual(store.objids_with_clsname(clsname),
+                             sorted(c.objid for c in cropobjects if c.clsname == clsname))
+
+    def test_add_remove(self):
+        rng = numpy.random.RandomState(42)
+        cropobjects = _random_cropobjects(rng, 300)
+        store = CropObjectStore(cropobjects[:10])
+        store.extend(cropobjects[10:])
+        self.assertStoreMatches(store, cropobjects)
+
+        removed = set(rng.choice(300, size=120, replace=False).tolist())
+        for objid in removed:
+            store.remove(objid)
+        remaining = [c for c in cropobjects if c.objid not in removed]
+        self.assertStoreMatches(store, remaining)
+        for objid in removed:
+            self.assertFalse(objid in store)
+
+        # Adding an object with an existing objid replaces it.
+        changed = CropObject(remaining[0].objid, 'slur', 0, 0, width=3, height=3)
+        store.add(changed)
+        self.assertStoreMatches(store, [changed] + remaining[1:])
+
+        self.assertEqual(store.rows([c.objid for c in remaining[:5]]).tolist(),
+                         [store.objids.tolist().index(c.objid) for c in remaining[:5]])
+        self.assertRaises(KeyError, store.rows, [list(removed)[0]])
+
+        store.clear()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.find_small(bbox_threshold=1000), [])
+
+    def test_queries(self):
+        rng = numpy.random.RandomState(42)
+        cropobjects = _random_cropobjects(rng, 200)
+        store = CropObjectStore(cropobjects)
+
+        small = [c.objid for c in cropobjects
+                 if (c.width * c.height < 30) or (c.mask.sum() < 20)]
+        self.assertEqual(sorted(store.find_small(bbox_threshold=30, mask_threshold=20)),
+                         sorted(small))
+
+        outside = [c.objid for c in cropobjects
+                   if c.top < 0 or c.left < 0 or c.bottom > 100 or c.right > 110]
+        self.assertEqual(sorted(store.find_outside((100, 110))), sorted(outside))
+
+        invalid = [c.objid for c in cropobjects if c.clsname not in ['stem', 'beam']]
+        self.assertEqual(sorted(store.find_invalid_clsnames(['stem', 'beam', 'slur'])),
+                         sorted(invalid))
+
+        stems = [c for c in cropobjects if c.clsname == 'stem']
+        self.assertEqual(sorted(store.objids_with_clsname('stem')),
+                         [c.objid for c in stems])
+        self.assertEqual(store.objids_with_clsname('slur'), [])
+        self.assertEqual(store.objids_with_clsname('stem', 'beam'),
+                         sorted(c.objid for c in cropobjects
+                                if c.clsname in ['stem', 'beam']))
+        h_avg, w_avg = store.average_bbox_size('stem')
+        self.assertAlmostEqual(h_avg, numpy.mean([c.height for c in stems]))
+        self.assertAlmostEqual(w_avg, numpy.mean([c.width for c in stems]))
+        self.assertTrue(numpy.isnan(store.average_bbox_size('slur')[0]))
+
+    def test_without_masks(self):
+        c = CropObject(0, 'stem', 0, 0, width=2, height=10,
+                       mask=numpy.zeros((10, 2), dtype='uint8'))
+        self.assertEqual(CropObjectStore([c]).mask_areas.tolist(), [0])
+        self.assertEqual(CropObjectStore([c], compute_mask_areas=False).mask_areas.tolist(), [20])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import unittest
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy
+from muscima.cropobject import CropObject
+
+from MUSCIMarker.annotator_model import CropObjectAnnotatorModel
+from MUSCIMarker.edit_journal import EditJournal
+from MUSCIMarker.muscimarker_io import unpack_cropobject_mask
+from MUSCIMarker.tracker import DefaultTrackerHandler
+
+
+class EditJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.tmp_dir, 'state.pkl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_checkpoint_clears_journal(self):
+        journal = EditJournal(self.checkpoint_path)
+        journal.record('remove_cropobject', 1)
+        journal.checkpoint({'cropobjects': [2]})
+        self.assertFalse(os.path.isfile(journal.journal_path))
+        self.assertEqual(journal.n_records, 0)
+
+        journal.record('remove_cropobject', 2)
+        journal.close()
+        state, records = EditJournal(self.checkpoint_path).load()
+        self.assertEqual(state, {'cropobjects': [2]})
+        self.assertEqual(records, [('remove_cropobject', (2,))])
+
+    def test_records_during_checkpoint_are_kept(self):
+        journal = EditJournal(self.checkpoint_path)
+        journal.record('remove_cropobject', 1)
+        first_segment = journal.start_checkpoint()
+        # Edits made while the checkpoint is being written.
+        journal.record('remove_cropobject', 2)
+
+        # Crash before the checkpoint is written: nothing is lost.
+        self.assertEqual(journal.load()[1], [('remove_cropobject', (1,)),
+                                             ('remove_cropobject', (2,))])
+
+        journal.write_checkpoint({'cropobjects': []}, first_segment)
+        state, records = journal.load()
+        self.assertEqual(state, {'cropobjects': []})
+        self.assertEqual(records, [('remove_cropobject', (2,))])
+        self.assertFalse(os.path.isfile(journal.segment_path(first_segment - 1)))
+
+        # A new journal never appends to an old segment.
+        journal.close()
+        self.assertGreater(EditJournal(self.checkpoint_path).segment, first_segment)
+
+    def test_broken_tail_is_ignored(self):
+        journal = EditJournal(self.checkpoint_path)
+        journal.record('remove_cropobject', 1)
+        journal.record('remove_cropobject', 2)
+        journal.close()
+        # Simulate a crash in the middle of writing the last record.
+        size = os.path.getsize(journal.journal_path)
+        with open(journal.journal_path, 'r+b') as hdl:
+            hdl.truncate(size - 3)
+
+        state, records = journal.load()
+        self.assertIsNone(state)
+        self.assertEqual(records, [('remove_cropobject', (1,))])
+
+    def test_replay_reproduces_model(self):
+        def build_model():
+            model = CropObjectAnnotatorModel()
+            model.image = numpy.zeros((100, 100), dtype='uint8')
+            model.import_cropobjects([CropObject(i, 'notehead-full', 10 * i, 10,
+                                                 width=8, height=6)
+                                      for i in range(4)])
+            return model
+
+        model = build_model()
+        model.journal = EditJournal(self.checkpoint_path)
+        # The tracked add_cropobject() needs a running App.
+        model._add_cropobject(CropObject(4, 'stem', 0, 17, width=1, height=16),
+                              perform_checks=False)
+        model.ensure_add_edges([(0, 4), (1, 4)])
+        model.ensure_remove_edge(1, 4)
+        model.remove_cropobject(3)
+        model.set_cropobject_clsname(2, 'notehead-empty')
+        model.image[5:10, 20:30] = 255
+        model.journal_image_edit(changed_region=(5, 20, 10, 30))
+        model.journal.close()
+
+        _, records = EditJournal(self.checkpoint_path).load()
+        recovered = build_model()
+        recovered.replay_journal(records)
+
+        self.assertEqual(sorted(recovered.cropobjects.keys()), [0, 1, 2, 4])
+        self.assertEqual(recovered.graph.edges, {(0, 4): 'Attachment'})
+        self.assertEqual(recovered.cropobjects[4].inlinks, [0])
+        self.assertEqual(recovered.cropobjects[2].clsname, 'notehead-empty')
+        self.assertTrue((recovered.image == model.image).all())
+
+    def test_replay_import_then_edits(self):
+        model = CropObjectAnnotatorModel()
+        model.import_cropobjects([CropObject(9, 'stem', 0, 0, width=1, height=10)])
+        model.journal = EditJournal(self.checkpoint_path)
+        model.import_cropobjects([CropObject(i, 'notehead-full', 10 * i, 10,
+                                             width=8, height=6)
+                                  for i in range(2)])
+        model.ensure_add_edges([(1, 0)])
+        model.journal.close()
+
+        _, records = EditJournal(self.checkpoint_path).load()
+        self.assertEqual([operation for operation, _ in records],
+                         ['import_cropobjects', 'add_edges'])
+        recovered = CropObjectAnnotatorModel()
+        recovered.import_cropobjects([CropObject(9, 'stem', 0, 0, width=1, height=10)])
+        self.assertEqual(recovered.replay_journal(records), 0)
+        self.assertEqual(sorted(recovered.cropobjects.keys()), [0, 1])
+        self.assertEqual(recovered.graph.edges, {(1, 0): 'Attachment'})
+
+    def test_failed_edits_are_not_journaled(self):
+        model = CropObjectAnnotatorModel()
+        model.import_cropobjects([CropObject(i, 'notehead-full', 10 * i, 10,
+                                             width=8, height=6)
+                                  for i in range(2)])
+        model.journal = EditJournal(self.checkpoint_path)
+        with self.assertRaises(Exception):
+            model.ensure_add_edge((0, 7))
+        model.ensure_add_edge((0, 1))
+        model.journal.close()
+
+        _, records = EditJournal(self.checkpoint_path).load()
+        self.assertEqual(records, [('add_edges', ([(0, 1)], 'Attachment'))])
+
+    def test_replay_skips_bad_records(self):
+        model = CropObjectAnnotatorModel()
+        model.import_cropobjects([CropObject(i, 'notehead-full', 10 * i, 10,
+                                             width=8, height=6)
+                                  for i in range(2)])
+        records = [('add_edges', ([(0, 7)], 'Attachment')),
+                   ('remove_cropobject', (5,)),
+                   ('add_edges', ([(0, 1)], 'Attachment'))]
+        self.assertEqual(model.replay_journal(records), 2)
+        self.assertEqual(model.graph.edges, {(0, 1): 'Attachment'})
+
+    def test_replay_is_not_tracked(self):
+        model = CropObjectAnnotatorModel()
+        model.journal = EditJournal(self.checkpoint_path)
+        model.import_cropobjects([CropObject(i, 'notehead-full', 10 * i, 10,
+                                             width=8, height=6)
+                                  for i in range(3)])
+        model.remove_cropobject(2)
+        model.clear_cropobjects()
+        model.import_cropobjects([CropObject(0, 'stem', 0, 0, width=1, height=10)],
+                                 clear=False)
+        model.journal.close()
+        _, records = EditJournal(self.checkpoint_path).load()
+
+        messages = []
+        write_message_data = DefaultTrackerHandler.__dict__['write_message_data']
+        DefaultTrackerHandler.write_message_data = classmethod(
+            lambda cls, message_data, final=False: messages.append(message_data))
+        try:
+            recovered = CropObjectAnnotatorModel()
+            self.assertEqual(recovered.replay_journal(records), 0)
+        finally:
+            DefaultTrackerHandler.write_message_data = write_message_data
+        self.assertEqual(messages, [])
+        self.assertEqual(sorted(recovered.cropobjects.keys()), [0])
+
+    def test_replay_precomputes_cc_once(self):
+        image = numpy.zeros((20, 20), dtype='uint8')
+        image[2:4, 2:18] = 255
+        records = [('update_image', (image,)),
+                   ('update_image', (255 - image,)),
+                   ('update_image_region', (10, 2, numpy.full((2, 16), 255, dtype='uint8'))),
+                   ('update_image', (image,))]
+
+        model = CropObjectAnnotatorModel()
+        started = []
+        start_cc_future = model._start_cc_future
+        model._start_cc_future = lambda: started.append(1) or start_cc_future()
+        self.assertEqual(model.replay_journal(records), 0)
+        self.assertEqual(len(started), 1)
+        self.assertEqual(model.cc, 1)
+
+    def test_masks_are_packed_in_recovery(self):
+        rng = numpy.random.RandomState(0)
+
+        def masked_cropobject(objid):
+            mask = (rng.uniform(size=(60, 80)) < 0.5).astype('uint8')
+            return CropObject(objid, 'notehead-full', 10, 10 * objid,
+                              width=80, height=60, mask=mask)
+
+        model = CropObjectAnnotatorModel()
+        model.journal = EditJournal(self.checkpoint_path)
+        model.import_cropobjects([masked_cropobject(i) for i in range(3)])
+        model._add_cropobject(masked_cropobject(3), perform_checks=False)
+        model.journal.close()
+
+        _, records = EditJournal(self.checkpoint_path).load()
+        recovered = CropObjectAnnotatorModel()
+        self.assertEqual(recovered.replay_journal(records), 0)
+        for objid, c in model.cropobjects.items():
+            self.assertEqual(recovered.cropobjects[objid].mask.dtype, numpy.uint8)
+            self.assertTrue((recovered.cropobjects[objid].mask == c.mask).all())
+
+        # The checkpoint snapshot does not touch the model's masks.
+        masks_size = sum(c.mask.nbytes for c in model.cropobjects.values())
+        snapshot = model._snapshot_cropobjects(pack_masks=True)
+        self.assertLess(len(pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)),
+                        masks_size // 4)
+        self.assertTrue(all(isinstance(c.mask, numpy.ndarray)
+                            for c in model.cropobjects.values()))
+        self.assertTrue((unpack_cropobject_mask(snapshot[0]).mask
+                         == model.cropobjects[snapshot[0].objid].mask).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
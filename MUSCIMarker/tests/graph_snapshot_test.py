@@ -0,0 +1,94 @@
+import unittest
+
+import numpy
+
+from MUSCIMarker.graph_snapshot import GraphSnapshot
+
+
+LABELS = ['Attachment', 'Precedence']
+
+
+def _reachable(edges, sources, label, direction, max_depth=None):
+    """Plain Python BFS over the edge dict, for reference."""
+    reached = set(sources)
+    frontier = set(sources)
+    depth = 0
+    while frontier and (max_depth is None or depth < max_depth):
+        new_frontier = set()
+        for (a1, a2), l in edges.items():
+            if label is not None and l != label:
+                continue
+            if direction in ('out', 'both') and a1 in frontier:
+                new_frontier.add(a2)
+            if direction in ('in', 'both') and a2 in frontier:
+                new_frontier.add(a1)
+        frontier = new_frontier - reached
+        reached |= frontier
+        depth += 1
+    return sorted(reached)
+
+
+class GraphSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.vertices = list(range(0, 300, 3))
+        self.edges = {}
+        for _ in range(250):
+            a1, a2 = [int(x) for x in rng.choice(self.vertices, size=2, replace=False)]
+            self.edges[(a1, a2)] = LABELS[rng.randint(len(LABELS))]
+        self.snapshot = GraphSnapshot(self.vertices, self.edges)
+        self.rng = rng
+
+    def test_links(self):
+        for v in self.vertices:
+            for label in LABELS + [None]:
+                outlinks = [a2 for (a1, a2), l in self.edges.items()
+                            if a1 == v and (label is None or l == label)]
+                inlinks = [a1 for (a1, a2), l in self.edges.items()
+                           if a2 == v and (label is None or l == label)]
+                self.assertEqual(sorted(self.snapshot.outlinks_of(v, label=label)),
+                                 sorted(outlinks))
+                self.assertEqual(sorted(self.snapshot.inlinks_of(v, label=label)),
+                                 sorted(inlinks))
+
+    def test_bfs(self):
+        for _ in range(50):
+            sources = [int(x) for x in self.rng.choice(self.vertices, size=3, replace=False)]
+            label = [None, 'Attachment', 'Precedence'][self.rng.randint(3)]
+            direction = ['out', 'in', 'both'][self.rng.randint(3)]
+            for max_depth in [None, 1, 3]:
+                self.assertEqual(self.snapshot.bfs(sources, label=label, direction=direction,
+                                                   max_depth=max_depth),
+                                 _reachable(self.edges, sources, label, direction, max_depth))
+
+    def test_descendants_and_ancestors(self):
+        snapshot = GraphSnapshot([0, 1, 2, 3], {(0, 1): 'Attachment', (1, 2): 'Attachment',
+                                                (2, 0): 'Precedence'})
+        self.assertEqual(snapshot.descendants([0], label='Attachment'), [1, 2])
+        self.assertEqual(snapshot.ancestors([2], label='Attachment'), [0, 1])
+        # Through the cycle, 0 is its own descendant.
+        self.assertEqual(snapshot.descendants([0]), [0, 1, 2])
+        self.assertEqual(snapshot.descendants([3]), [])
+
+    def test_connected_groups(self):
+        for label in LABELS + [None]:
+            groups = self.snapshot.connected_groups(label=label)
+            self.assertEqual(sorted(sum(groups, [])), self.vertices)
+            for g in groups:
+                self.assertEqual(_reachable(self.edges, g[:1], label, 'both'), g)
+            self.assertEqual([g[0] for g in groups], sorted([g[0] for g in groups]))
+
+        groups = self.snapshot.connected_groups(objids=[0])
+        self.assertEqual(len(groups), 1)
+        self.assertIn(0, groups[0])
+
+    def test_unknown_objid(self):
+        self.assertRaises(KeyError, self.snapshot.outlinks_of, 1)
+
+    def test_readonly(self):
+        indptr, indices = self.snapshot.adjacency()
+        self.assertRaises(ValueError, indices.__setitem__, 0, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import os
+import pickle
+
+import numpy
+from lxml import etree
+
+from MUSCIMarker.muscimarker_io import CropObject
+
+
+class MaskCodecTest(unittest.TestCase):
+    def test_rle_roundtrip(self):
+        rng = numpy.random.RandomState(42)
+        for _ in range(200):
+            shape = tuple(rng.randint(1, 30, size=2))
+            density = rng.uniform()
+            mask = (rng.uniform(size=shape) < density).astype('uint8')
+
+            encoded = CropObject.encode_mask_rle(mask)
+            decoded = CropObject.decode_mask_rle(encoded, shape=shape)
+            self.assertEqual(decoded.shape, mask.shape)
+            self.assertTrue((decoded == mask).all())
+
+            # Runs alternate, start with zeros, and cover the whole mask.
+            runs = [kv.split(':') for kv in encoded.split(' ')]
+            self.assertEqual(runs[0][0], '0')
+            self.assertEqual(sum(int(v) for _, v in runs), mask.size)
+
+    def test_rle_edge_cases(self):
+        self.assertEqual(CropObject.encode_mask_rle(None), 'None')
+        self.assertEqual(CropObject.encode_mask_rle(numpy.zeros((3, 4), dtype='uint8')),
+                         '0:12')
+        self.assertEqual(CropObject.encode_mask_rle(numpy.ones((3, 4), dtype='uint8')),
+                         '0:0 1:12')
+        self.assertEqual(CropObject.encode_mask_rle(numpy.array([[1, 0, 0, 1]])),
+                         '0:0 1:1 0:2 1:1')
+        self.assertIsNone(CropObject.decode_mask_rle('None', shape=(3, 4)))
+
+    def test_rle_reencodes_example_annotation(self):
+        fpath = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                             'static', 'example_annotation.xml')
+        root = etree.parse(fpath).getroot()
+        for element in root.iter('CropObject'):
+            mask_string = element.findall('Mask')[0].text
+            shape = (int(element.findall('Height')[0].text),
+                     int(element.findall('Width')[0].text))
+            mask = CropObject.decode_mask_rle(mask_string, shape=shape)
+            self.assertEqual(CropObject.encode_mask_rle(mask), mask_string)
+
+    def test_packbits_roundtrip(self):
+        rng = numpy.random.RandomState(42)
+        c = CropObject(0, 'test', 0, 0, width=1, height=1)
+        for _ in range(200):
+            shape = tuple(rng.randint(1, 30, size=2))
+            density = rng.uniform()
+            mask = (rng.uniform(size=shape) < density).astype('uint8')
+
+            encoded = CropObject.encode_mask_packbits(mask)
+            self.assertEqual(c._determine_mask_mode(encoded), 'packbits')
+            decoded = c.decode_mask(encoded, shape=shape)
+            self.assertEqual(decoded.shape, mask.shape)
+            self.assertTrue((decoded == mask).all())
+
+        self.assertEqual(CropObject.encode_mask_packbits(None), 'None')
+        self.assertIsNone(CropObject.decode_mask_packbits('None', shape=(3, 4)))
+
+    def test_mask_mode_detection(self):
+        c = CropObject(0, 'test', 0, 0, width=1, height=1)
+        mask = numpy.array([[1, 0, 0, 1]])
+        self.assertEqual(c._determine_mask_mode(c.encode_mask(mask, mode='rle')), 'rle')
+        self.assertEqual(c._determine_mask_mode(c.encode_mask(mask, mode='bitmap')), 'bitmap')
+        self.assertEqual(c._determine_mask_mode(c.encode_mask(mask, mode='packbits')), 'packbits')
+
+    def test_packed_mask_storage(self):
+        rng = numpy.random.RandomState(42)
+        for _ in range(50):
+            shape = tuple(rng.randint(1, 30, size=2))
+            mask = (rng.uniform(size=shape) < 0.5).astype('int64')
+            c = CropObject(0, 'test', 10, 10, width=shape[1], height=shape[0], mask=mask)
+            self.assertIsNotNone(c._mask_bits)
+            self.assertEqual(c.mask.dtype, numpy.uint8)
+            self.assertTrue((c.mask == mask).all())
+            self.assertEqual(c.is_empty, mask.sum() == 0)
+            self.assertLessEqual(c._mask_bits.nbytes, mask.size // 8 + 1)
+
+        # Non-binary masks are not packed, so that they are not changed.
+        weights = numpy.array([[0, 2], [3, 1]])
+        c = CropObject(0, 'test', 10, 10, width=2, height=2, mask=weights)
+        self.assertIsNone(c._mask_bits)
+        self.assertTrue((c.mask == weights).all())
+
+        c.set_mask(None)
+        self.assertIsNone(c.mask)
+        self.assertFalse(c.is_empty)
+
+    def test_unpacked_mask_is_cached(self):
+        mask = numpy.array([[0, 0, 1, 1], [1, 0, 0, 0]])
+        c = CropObject(0, 'test', 10, 10, width=4, height=2, mask=mask)
+        self.assertIs(c.mask, c.mask)
+
+        # Pickles only keep the packed bits.
+        c_unpickled = pickle.loads(pickle.dumps(c))
+        self.assertIsNone(c_unpickled._mask_unpacked)
+        self.assertTrue((c_unpickled.mask == mask).all())
+
+        # A new mask replaces the cached one.
+        c.set_mask(1 - mask)
+        self.assertTrue((c.mask == 1 - mask).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+
+import numpy
+
+from MUSCIMarker.muscimarker_io import parse_cropobject_list, merge_cropobject_lists, \
+    export_cropobject_graph, CropObject
+
+
+class MergeCropObjectListsTest(unittest.TestCase):
+    def setUp(self):
+        fpath = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                             'test_data', 'example_annotation.xml')
+        self.inputs = [parse_cropobject_list(fpath) for _ in range(3)]
+
+    def test_objids_unique_and_graph_shifted(self):
+        for copy in [False, True]:
+            merged = merge_cropobject_lists(*self.inputs, copy=copy)
+            self.assertEqual(len(merged), sum([len(l) for l in self.inputs]))
+            self.assertEqual(len(set([c.objid for c in merged])), len(merged))
+            # The graph stays valid (validation raises otherwise)
+            # and has all the edges of the inputs.
+            edges = export_cropobject_graph(merged)
+            self.assertEqual(len(edges),
+                             sum([len(export_cropobject_graph(l)) for l in self.inputs]))
+
+    def test_view_shares_masks(self):
+        merged = merge_cropobject_lists(*self.inputs, copy=False)
+        original = self.inputs[1][0]
+        merged_c = merged[len(self.inputs[0])]
+        self.assertIs(merged_c._mask_bits, original._mask_bits)
+        self.assertFalse(merged_c.mask.flags.writeable)
+        # The inputs keep their objids and links.
+        self.assertNotEqual(merged_c.objid, original.objid)
+        self.assertEqual(self.inputs[1][0].objid, self.inputs[0][0].objid)
+
+        # Non-binary masks are shared read-only too.
+        c = CropObject(0, 'x', 0, 0, width=2, height=1, mask=numpy.array([[2, 0]]))
+        merged = merge_cropobject_lists([c], [c], copy=False)
+        self.assertTrue(numpy.shares_memory(merged[1].mask, c.mask))
+        self.assertFalse(merged[1].mask.flags.writeable)
+        self.assertTrue(c.mask.flags.writeable)
+
+    def test_copy_by_default(self):
+        merged = merge_cropobject_lists(*self.inputs)
+        self.assertIsNot(merged[0]._mask_bits, self.inputs[0][0]._mask_bits)
+        self.assertEqual([c.objid for c in merged[:len(self.inputs[0])]],
+                         [c.objid for c in self.inputs[0]])
+        self.assertRaises(TypeError, merge_cropobject_lists, *self.inputs, deepcopy=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import numpy
+
+from MUSCIMarker.annotator_model import ObjectGraph
+
+
+LABELS = ['Attachment', 'Precedence', 'Simultaneity']
+
+
+class ObjectGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = ObjectGraph()
+        for v in range(30):
+            self.graph.add_vertex(v)
+
+    def _assert_label_indexes_consistent(self):
+        for v in self.graph.vertices:
+            for label in LABELS:
+                inlinks = sorted([a1 for (a1, a2), l in self.graph.edges.items()
+                                  if a2 == v and l == label])
+                outlinks = sorted([a2 for (a1, a2), l in self.graph.edges.items()
+                                   if a1 == v and l == label])
+                self.assertEqual(sorted(self.graph.inlinks_of(v, label=label)), inlinks)
+                self.assertEqual(sorted(self.graph.outlinks_of(v, label=label)), outlinks)
+        for label in LABELS:
+            self.assertEqual(sorted(self.graph.edges_with_label(label)),
+                             sorted([e for e, l in self.graph.edges.items() if l == label]))
+
+    def test_label_indexes(self):
+        rng = numpy.random.RandomState(42)
+        for _ in range(500):
+            a1, a2 = [int(x) for x in rng.choice(30, size=2, replace=False)]
+            label = LABELS[rng.randint(len(LABELS))]
+            action = rng.uniform()
+            if action < 0.5:
+                self.graph.add_edge((a1, a2), label=label)
+            elif action < 0.6:
+                self.graph.ensure_add_edges([(a1, a2), (a2, a1)], label=label)
+            elif action < 0.9:
+                self.graph.ensure_remove_edge(a1, a2)
+            else:
+                self.graph.remove_obj_edges(a1)
+        self._assert_label_indexes_consistent()
+
+    def test_relabeling_moves_edge(self):
+        self.graph.add_edge((1, 2), label='Attachment')
+        self.graph.add_edge((1, 2), label='Precedence')
+        self.assertEqual(self.graph.outlinks_of(1, label='Attachment'), [])
+        self.assertEqual(self.graph.outlinks_of(1, label='Precedence'), [2])
+        self._assert_label_indexes_consistent()
+
+    def test_clear_edges(self):
+        self.graph.add_edges([(1, 2), (2, 3)], label='Precedence')
+        self.graph.clear_edges()
+        self.assertEqual(self.graph.inlinks_of(2, label='Precedence'), [])
+        self.assertEqual(self.graph.edges_with_label('Precedence'), [])
+
+    def test_snapshot_cached_until_change(self):
+        self.graph.add_edges([(1, 2), (2, 3)], label='Attachment')
+        snapshot = self.graph.snapshot()
+        self.assertIs(self.graph.snapshot(), snapshot)
+        self.assertEqual(snapshot.descendants([1]), [2, 3])
+
+        self.graph.remove_edge(2, 3)
+        new_snapshot = self.graph.snapshot()
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual(new_snapshot.descendants([1]), [2])
+        # The old snapshot is not affected.
+        self.assertEqual(snapshot.descendants([1]), [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import os
+import pickle
+import shutil
+import tempfile
+
+from MUSCIMarker.muscimarker_io import export_cropobject_list, parse_cropobject_list
+from MUSCIMarker.parse_cache import CropObjectListCache
+
+
+class CropObjectListCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        source = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                              'test_data', 'example_annotation.xml')
+        self.clfile = os.path.join(self.tmp_dir, 'example_annotation.xml')
+        shutil.copyfile(source, self.clfile)
+        self.cache = CropObjectListCache(cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _entries(self):
+        return sorted(path for _, _, path in self.cache._entries())
+
+    def test_changed_mtime_is_a_miss(self):
+        self.cache.parse(self.clfile)
+        stat = os.stat(self.clfile)
+        os.utime(self.clfile, (stat.st_atime, stat.st_mtime + 10))
+        self.cache.parse(self.clfile)
+        self.assertEqual((self.cache.n_misses, self.cache.n_hits), (2, 0))
+        self.cache.parse(self.clfile)
+        self.assertEqual((self.cache.n_misses, self.cache.n_hits), (2, 1))
+
+    def test_changed_size_is_a_miss(self):
+        self.cache.parse(self.clfile)
+        stat = os.stat(self.clfile)
+        with open(self.clfile) as hdl:
+            xml = hdl.read()
+        with open(self.clfile, 'w') as hdl:
+            hdl.write(xml.replace('<MLClassName>notehead-full</MLClassName>',
+                                  '<MLClassName>notehead-empty</MLClassName>', 1))
+        # Same mtime: only the size tells the versions apart.
+        os.utime(self.clfile, (stat.st_atime, stat.st_mtime))
+
+        cropobjects = self.cache.parse(self.clfile)
+        self.assertEqual((self.cache.n_misses, self.cache.n_hits), (2, 0))
+        self.assertEqual(cropobjects[0].clsname, 'notehead-empty')
+
+    def test_broken_entry_is_reparsed(self):
+        cropobjects = self.cache.parse(self.clfile)
+        entry, = self._entries()
+        with open(entry, 'wb') as hdl:
+            hdl.write(b'not an npz archive')
+
+        cropobjects_reparsed = self.cache.parse(self.clfile)
+        self.assertEqual((self.cache.n_misses, self.cache.n_hits), (2, 0))
+        self.assertEqual(export_cropobject_list(cropobjects_reparsed),
+                         export_cropobject_list(cropobjects))
+        # The entry has been rewritten.
+        self.cache.parse(self.clfile)
+        self.assertEqual((self.cache.n_misses, self.cache.n_hits), (2, 1))
+
+    def test_evicts_least_recently_used(self):
+        clfiles = [self.clfile]
+        for i in range(2):
+            clfile = os.path.join(self.tmp_dir, 'copy_{0}.xml'.format(i))
+            shutil.copyfile(self.clfile, clfile)
+            clfiles.append(clfile)
+
+        entries = []
+        for i, clfile in enumerate(clfiles):
+            self.cache.parse(clfile)
+            entry = self.cache._entry_filename(clfile, parse_cropobject_list)
+            # Make the order of use unambiguous.
+            os.utime(entry, (1000 + i, 1000 + i))
+            entries.append(entry)
+        entry_size = os.path.getsize(entries[0])
+
+        # Using the first entry makes the second one the oldest.
+        self.cache.parse(clfiles[0])
+        self.cache.max_size = 2 * entry_size
+        self.cache.evict()
+        self.assertEqual(self._entries(), sorted([entries[0], entries[2]]))
+
+        self.cache.max_size = 0
+        self.cache.evict()
+        self.assertEqual(self._entries(), [])
+
+    def test_unpickled_cache_does_not_create_dir(self):
+        shutil.rmtree(self.cache_dir)
+        cache = pickle.loads(pickle.dumps(self.cache))
+        self.assertEqual(cache.cache_dir, self.cache_dir)
+        self.assertFalse(os.path.isdir(self.cache_dir))
+
+    def test_cache_dir_from_environment(self):
+        cache_dir = os.path.join(self.tmp_dir, 'env_cache')
+        os.environ['MUSCIMARKER_CACHE_DIR'] = cache_dir
+        try:
+            cache = CropObjectListCache()
+        finally:
+            del os.environ['MUSCIMARKER_CACHE_DIR']
+        self.assertEqual(cache.cache_dir, cache_dir)
+        self.assertTrue(os.path.isdir(cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy
+
+from MUSCIMarker.spatial_index import SpatialIndex, bbox_point_distance
+
+
+def _random_bboxes(rng, n):
+    bboxes = {}
+    for objid in range(n):
+        t, l = rng.randint(0, 500, size=2)
+        # Mostly small symbols, some long ones (like stafflines and beams).
+        if rng.uniform() < 0.1:
+            h, w = rng.randint(1, 10), rng.randint(100, 400)
+        else:
+            h, w = rng.randint(1, 40, size=2)
+        bboxes[objid] = (t, l, t + h, l + w)
+    return bboxes
+
+
+def _intersects(bbox, t, l, b, r):
+    o_t, o_l, o_b, o_r = bbox
+    return (o_t < b) and (t < o_b) and (o_l < r) and (l < o_r)
+
+
+class SpatialIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.RandomState(42)
+        self.bboxes = _random_bboxes(self.rng, 400)
+        self.index = SpatialIndex(cell_size=32)
+        for objid, bbox in self.bboxes.items():
+            self.index.insert(objid, bbox)
+
+    def assertIndexMatches(self, index, bboxes):
+        self.assertEqual(len(index), len(bboxes))
+        for _ in range(100):
+            t, l = self.rng.randint(-50, 550, size=2)
+            h, w = self.rng.randint(1, 200, size=2)
+            expected = sorted(objid for objid, bbox in bboxes.items()
+                              if _intersects(bbox, t, l, t + h, l + w))
+            self.assertEqual(index.query_bbox(t, l, t + h, l + w), expected)
+
+            row, col = self.rng.randint(0, 550, size=2)
+            expected = sorted(objid for objid, bbox in bboxes.items()
+                              if _intersects(bbox, row, col, row + 1, col + 1))
+            self.assertEqual(index.query_point(row, col), expected)
+
+            k = self.rng.randint(1, 10)
+            expected = sorted(bboxes, key=lambda o: (bbox_point_distance(bboxes[o], row, col), o))
+            self.assertEqual(index.nearest(row, col, k=k), expected[:k])
+
+    def test_queries(self):
+        self.assertIndexMatches(self.index, self.bboxes)
+        # Queries covering the whole image.
+        self.assertEqual(self.index.query_bbox(-1000, -1000, 2000, 2000),
+                         sorted(self.bboxes))
+        self.assertEqual(self.index.nearest(0, 0, k=1000), sorted(
+            self.bboxes, key=lambda o: (bbox_point_distance(self.bboxes[o], 0, 0), o)))
+
+    def test_move_and_remove(self):
+        for objid in self.rng.choice(400, size=100, replace=False):
+            self.index.remove(objid)
+            del self.bboxes[objid]
+        moved = _random_bboxes(self.rng, 400)
+        for objid in list(self.bboxes)[:100]:
+            self.bboxes[objid] = moved[objid]
+            self.index.insert(objid, moved[objid])
+        self.assertIndexMatches(self.index, self.bboxes)
+
+        self.index.clear()
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.query_point(10, 10), [])
+        self.assertEqual(self.index.nearest(10, 10), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
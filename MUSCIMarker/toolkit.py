@@ -25,7 +25,7 @@ from skimage.filters import threshold_otsu
 from MUSCIMarker.editor import BoundingBoxTracer, ConnectedComponentBoundingBoxTracer, TrimmedBoundingBoxTracer, \
     LineTracer
 from MUSCIMarker.utils import bbox_to_integer_bounds, image_mask_overlaps_cropobject, image_mask_overlaps_model_edge, \
-    bbox_intersection
+    bbox_intersection, points_bounding_box, components_mask
 
 __version__ = "0.0.1"
 __author__ = "Jan Hajic jr."
@@ -264,11 +264,6 @@ class AddSymbolTool(MUSCIMarkerTool):
 class ConnectedSelectTool(AddSymbolTool):
     current_cropobject_selection = ObjectProperty(None)
 
-    # Caches.
-    _cc = NumericProperty(-1)
-    _labels = ObjectProperty(None)
-    _bboxes = ObjectProperty(None)
-
     def create_editor_widgets(self):
         editor_widgets = collections.OrderedDict()
         editor_widgets['bbox_tracer'] = BoundingBoxTracer()
@@ -315,12 +310,13 @@ class ConnectedSelectTool(AddSymbolTool):
         """The "clever" part of the CC tracking."""
         logging.info('CCselect: getting mask and new bounding box from labels.')
 
-        self._cc = self._model.cc
-        self._labels = self._model.labels
-        self._bboxes = self._model.bboxes
+        # Not kept between selections: the model may replace the labels
+        # (and remove their memory-mapped file) whenever the image changes.
+        labels = self._model.labels
+        bboxes = self._model.bboxes
 
-        selected_labels = set([l for l in self._labels[t:b, l:r].flatten()
-                               if l != 0])  # Ignore background
+        selected_labels = [l for l in numpy.unique(labels[t:b, l:r]).tolist()
+                           if l != 0]  # Ignore background
         # Nothing selected
         if len(selected_labels) == 0:
             logging.warn('CCselect: no cc selected!')
@@ -328,28 +324,9 @@ class ConnectedSelectTool(AddSymbolTool):
 
         logging.info('CCSelect: got labels {0}'.format(selected_labels))
 
-        selected_bboxes = numpy.array([self._bboxes[l] for l in selected_labels])
-
-        # Get the combined bbox
-        cc_t = min(selected_bboxes[:, 0])
-        cc_l = min(selected_bboxes[:, 1])
-        cc_b = max(selected_bboxes[:, 2])
-        cc_r = max(selected_bboxes[:, 3])
-
-        # Mask:
-        #   - crop the labels to this box
-        lcrop = self._labels[cc_t:cc_b, cc_l:cc_r]
-
-        #   - create the zeros
-        mask = numpy.zeros(lcrop.shape, dtype='uint8')
-
-        #   - mark as 1 all pixels that have one of the selected labels
-        #     in the crop
-        for l in selected_labels:
-            logging.info('CCSelect: running mask against label {0}'.format(l))
-            mask[lcrop == l] = 1
-
-        return mask, (cc_t, cc_l, cc_b, cc_r)
+        # The combined bbox, and the mask of the selected labels in it.
+        cc_bbox, mask = components_mask(labels, bboxes, selected_labels)
+        return mask, cc_bbox
 
 
 ###############################################################################
@@ -368,12 +345,7 @@ class AverageSymbolTool(AddSymbolTool):
     _current_mask = None
 
     def compute_average_bbox(self, clsname):
-        cropobjects = [c for c in self._model.cropobjects.values()
-                       if c.clsname == clsname]
-        hs = [c.height for c in cropobjects]
-        h_avg = numpy.mean(hs)
-        ws = [c.width for c in cropobjects]
-        w_avg = numpy.mean(ws)
+        h_avg, w_avg = self._model.cropobject_store.average_bbox_size(clsname)
         return int(numpy.round(h_avg)) + 1, int(numpy.round(w_avg)) + 1
 
     def set_average_bbox(self, clsname):
@@ -795,65 +767,71 @@ class MaskEraserTool(LassoBoundingBoxSelectTool):
 
         logging.info('MaskEraser: got bounding box: {0}'.format(bbox))
 
-        for cropobject_view in self.app_ref.cropobject_list_renderer.view.selected_views:
-            c = copy.deepcopy(cropobject_view._model_counterpart)
-            # Guards:
-            if c.mask is None:
-                logging.info('MaskErarser: cropobject {0} has no mask.'
+        # All the objects are redrawn at once at the end of the batch,
+        # so they can only be re-selected afterwards.
+        added_objids = []
+        with self._model.batch():
+            for cropobject_view in self.app_ref.cropobject_list_renderer.view.selected_views:
+                c = copy.deepcopy(cropobject_view._model_counterpart)
+                # Guards:
+                if c.mask is None:
+                    logging.info('MaskErarser: cropobject {0} has no mask.'
+                                 ''.format(c.objid))
+                    continue
+                if not c.overlaps(bbox):
+                    logging.info('MaskErarser: cropobject {0} (bbox {1})'
+                                 'does not overlap.'
+                                 ''.format(c.objid, c.bounding_box))
+                    continue
+
+                logging.info('MaskErarser: processing cropobject {0}.'
                              ''.format(c.objid))
-                continue
-            if not c.overlaps(bbox):
-                logging.info('MaskErarser: cropobject {0} (bbox {1})'
-                             'does not overlap.'
-                             ''.format(c.objid, c.bounding_box))
-                continue
-
-            logging.info('MaskErarser: processing cropobject {0}.'
-                         ''.format(c.objid))
-
-            i_t, i_l, i_b, i_r = bbox_intersection(c.bounding_box, bbox)
-            m_t, m_l, m_b, m_r = bbox_intersection(bbox, c.bounding_box)
-            logging.info('MaskEraser: got cropobject intersection {0}'
-                         ''.format((i_t, i_l, i_b, i_r)))
-            logging.info('MaskEraser: got mask intersection {0}'
-                         ''.format((m_t, m_l, m_b, m_r)))
-
-            logging.info('MaskEraser: cropobject nnz previous = {0}'
-                         ''.format(c.mask.sum()))
-
-            # We need to invert the current mask, as we want to mask *out*
-            # whatever is *in* the mask now.
-            inverse_mask = c.mask.max() - self.current_cropobject_mask[m_t:m_b, m_l:m_r]
-            c.mask[i_t:i_b, i_l:i_r] *= inverse_mask
-            logging.info('MaskEraser: cropobject nnz after = {0}'
-                         ''.format(c.mask.sum()))
-            c.crop_to_mask()
-
-            # We do the removal through the view, so that deselection
-            # and other stuff is handled.
-            cropobject_view.remove_from_model()
-
-            if self.do_split:
-                _next_objid = self._model.get_next_cropobject_id()
-                output_cropobjects = split_cropobject_on_connected_components(c, _next_objid)
-            else:
-                output_cropobjects = [c]
-
-            for c in output_cropobjects:
-                # Now add the CropObject back to redraw. Note that this way,
-                # the object's objid stays the same, which is essential for
-                # maintaining intact inlinks and outlinks!
-                logging.info('MaskEraser: New object data dict: {0}'
-                             ''.format(c.data))
-                self._model.add_cropobject(c)
 
-                try:
-                    new_view = self.app_ref.cropobject_list_renderer.view.get_cropobject_view(c.objid)
-                    new_view.ensure_selected()
-                except KeyError:
-                    logging.info('MaskEraser: View for modified CropObject {0} has'
-                                 ' not been rendered yet, cannot select it.'
-                                 ''.format(c.objid))
+                i_t, i_l, i_b, i_r = bbox_intersection(c.bounding_box, bbox)
+                m_t, m_l, m_b, m_r = bbox_intersection(bbox, c.bounding_box)
+                logging.info('MaskEraser: got cropobject intersection {0}'
+                             ''.format((i_t, i_l, i_b, i_r)))
+                logging.info('MaskEraser: got mask intersection {0}'
+                             ''.format((m_t, m_l, m_b, m_r)))
+
+                logging.info('MaskEraser: cropobject nnz previous = {0}'
+                             ''.format(c.mask.sum()))
+
+                # We need to invert the current mask, as we want to mask *out*
+                # whatever is *in* the mask now.
+                inverse_mask = c.mask.max() - self.current_cropobject_mask[m_t:m_b, m_l:m_r]
+                c.mask[i_t:i_b, i_l:i_r] *= inverse_mask
+                logging.info('MaskEraser: cropobject nnz after = {0}'
+                             ''.format(c.mask.sum()))
+                c.crop_to_mask()
+
+                # We do the removal through the view, so that deselection
+                # and other stuff is handled.
+                cropobject_view.remove_from_model()
+
+                if self.do_split:
+                    _next_objid = self._model.get_next_cropobject_id()
+                    output_cropobjects = split_cropobject_on_connected_components(c, _next_objid)
+                else:
+                    output_cropobjects = [c]
+
+                for c in output_cropobjects:
+                    # Now add the CropObject back to redraw. Note that this way,
+                    # the object's objid stays the same, which is essential for
+                    # maintaining intact inlinks and outlinks!
+                    logging.info('MaskEraser: New object data dict: {0}'
+                                 ''.format(c.data))
+                    self._model.add_cropobject(c)
+                    added_objids.append(c.objid)
+
+        for objid in added_objids:
+            try:
+                new_view = self.app_ref.cropobject_list_renderer.view.get_cropobject_view(objid)
+                new_view.ensure_selected()
+            except KeyError:
+                logging.info('MaskEraser: View for modified CropObject {0} has'
+                             ' not been rendered yet, cannot select it.'
+                             ''.format(objid))
 
         logging.info('MaskEraser: Forcing redraw.')
         self.app_ref.cropobject_list_renderer.redraw += 1
@@ -873,25 +851,29 @@ class MaskAdditionTool(LassoBoundingBoxSelectTool):
             mask=self.current_cropobject_mask)
         c_lasso.crop_to_mask()
 
-        for cropobject_view in self.app_ref.cropobject_list_renderer.view.selected_views:
-            c = copy.deepcopy(cropobject_view._model_counterpart)
-            c.join(c_lasso)
+        added_objids = []
+        with self._model.batch():
+            for cropobject_view in self.app_ref.cropobject_list_renderer.view.selected_views:
+                c = copy.deepcopy(cropobject_view._model_counterpart)
+                c.join(c_lasso)
 
-            # Redraw:
-            cropobject_view.remove_from_model()
+                # Redraw:
+                cropobject_view.remove_from_model()
 
-            logging.info('MaskEraser: New object data dict: {0}'
-                         ''.format(c.data))
-            self._model.add_cropobject(c)
+                logging.info('MaskEraser: New object data dict: {0}'
+                             ''.format(c.data))
+                self._model.add_cropobject(c)
+                added_objids.append(c.objid)
 
-            # Try reselecting the selected objects:
+        # Try reselecting the selected objects:
+        for objid in added_objids:
             try:
-                new_view = self.app_ref.cropobject_list_renderer.view.get_cropobject_view(c.objid)
+                new_view = self.app_ref.cropobject_list_renderer.view.get_cropobject_view(objid)
                 new_view.ensure_selected()
             except KeyError:
                 logging.info('MaskEraser: View for modified CropObject {0} has'
                              ' not been rendered yet, cannot select it.'
-                             ''.format(c.objid))
+                             ''.format(objid))
 
         logging.info('MaskAddition: Forcing redraw.')
         self.app_ref.cropobject_list_renderer.redraw += 1
@@ -1258,14 +1240,17 @@ class CropObjectViewsSelectTool(BaseListItemViewsOperationTool):
 
         _t_middle = time.clock()
 
-        # Find all CropObjects that overlap
-        objids = [objid for objid, c in self._model.cropobjects.items()
-                  if image_mask_overlaps_cropobject(model_mask, c,
-                                                    use_cropobject_mask=self.use_mask_to_determine_selection)]
+        # Find all CropObjects that overlap. Only those that intersect
+        # the bounding box of the selection need to be checked against
+        # the mask.
+        candidate_objids = self._model.find_objids_in_bbox(*points_bounding_box(m_points))
+        objids = set([objid for objid in candidate_objids
+                      if image_mask_overlaps_cropobject(model_mask, self._model.cropobjects[objid],
+                                                        use_cropobject_mask=self.use_mask_to_determine_selection)])
 
         if self.ignore_staff:
-            objids = [objid for objid in objids
-                      if self._model.cropobjects[objid].clsname not in _CONST.STAFF_CROPOBJECT_CLSNAMES]
+            objids = set([objid for objid in objids
+                          if self._model.cropobjects[objid].clsname not in _CONST.STAFF_CROPOBJECT_CLSNAMES])
 
         _t_end = time.clock()
         # logging.info('select_applicable_objects: points and mask took'
@@ -1322,26 +1307,26 @@ class EdgeViewsSelectTool(BaseListItemViewsOperationTool):
         m_points = self.editor_to_model_points(points)
         model_mask = self.model_mask_from_points(m_points)
 
-        # Find all Edges that overlap
-        objid_pairs = []
+        # Find all Edges that overlap. An edge can cross the selection
+        # with both its CropObjects outside, so the candidates are the edges
+        # whose bounding box intersects the selection's bounding box
+        # (rather than the edges of CropObjects from the spatial index).
+        s_t, s_l, s_b, s_r = points_bounding_box(m_points)
+        objid_pairs = set()
         for e in self.available_views:
             # logging.info('Edge {0} --> {1}'.format(e.edge[0], e.edge[1]))
             c_start = self._model.cropobjects[e.start_objid]
             c_end = self._model.cropobjects[e.end_objid]
-            if c_start.objid == 224 and c_end.objid == 225:
-                sx, sy = c_start.middle
-                ex, ey = c_end.middle
-                mx, my = old_div((sx + ex), 2), old_div((sy + ey), 2)
-                logging.warn('Edge 224 --> 225: middle points '
-                             '{0}, {1} -- mask: {2}'
-                             ''.format(c_start.middle, c_end.middle,
-                                       model_mask[mx, my]))
+            (s_row, s_col), (e_row, e_col) = c_start.middle, c_end.middle
+            if (max(s_row, e_row) < s_t) or (min(s_row, e_row) >= s_b) \
+                    or (max(s_col, e_col) < s_l) or (min(s_col, e_col) >= s_r):
+                continue
             # This is a little hack-ish, because the assumptions about
             # what is up and what is left are wrong...?
             if image_mask_overlaps_model_edge(model_mask,
                                               c_start.middle,
                                               c_end.middle):
-                objid_pairs.append((e.start_objid, e.end_objid))
+                objid_pairs.add((e.start_objid, e.end_objid))
 
         # Find all CropObjects that overlap
         # objids = [objid for objid, c in self._model.cropobjects.iteritems()
@@ -1457,7 +1442,7 @@ class RegionBinarizeTool(MUSCIMarkerTool):
         _update_start = time.clock()
 
         # Update image
-        self.app_ref.update_image(image)
+        self.app_ref.update_image(image, changed_region=(m_t, m_l, m_b, m_r))
 
         _binarization_end = time.clock()
         logging.info('RegionBinarizeTool: binarization took {0:.3f} s,'
@@ -1496,7 +1481,7 @@ class BackgroundLassoTool(LassoBoundingBoxSelectTool):
 
         image[m_t:m_b, m_l:m_r] = output_crop
 
-        self.app_ref.update_image(image)
+        self.app_ref.update_image(image, changed_region=(m_t, m_l, m_b, m_r))
 
         # Automatically clears the bounding box (it gets rendered as the new symbol
         # gets recorded).
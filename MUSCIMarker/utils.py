@@ -11,6 +11,7 @@ from math import floor, ceil
 import os
 
 import numpy
+import scipy.ndimage
 import skimage.measure
 from skimage.draw import line
 
@@ -391,8 +392,21 @@ def bbox_intersection(origin, intersect):
         return None
 
 
+def points_bounding_box(points):
+    """Returns the integer bounding box ``(top, left, bottom, right)``
+    that contains all the given ``(row, column)`` points, with the bottom
+    and right bounds exclusive.
 
-def connected_components2bboxes(labels):
+    >>> points_bounding_box([(10, 20.5), (3.2, 40), (7, 22)])
+    (3, 20, 11, 41)
+    """
+    rows, cols = list(zip(*points))
+    return int(floor(min(rows))), int(floor(min(cols))), \
+           int(floor(max(rows))) + 1, int(floor(max(cols))) + 1
+
+
+
+def connected_components2bboxes(labels, return_areas=False):
     """Returns a dictionary of bounding boxes (upper left c., lower right c.)
     for each label.
 
@@ -406,39 +420,255 @@ def connected_components2bboxes(labels):
     [1, 0, 3, 1]
     >>> bboxes[3]
     [3, 2, 4, 4]
+    >>> _, areas = connected_components2bboxes(labels, return_areas=True)
+    >>> [areas[l] for l in range(4)]
+    [9, 3, 2, 2]
 
+    Only labels that occur in the image get a bounding box. The bounding
+    boxes are computed with ``scipy.ndimage.find_objects()``, which goes
+    through the label image once, instead of visiting the pixels one by
+    one in Python.
 
-    :param labels: The output of cv2.connectedComponents().
+    :param labels: The output of cv2.connectedComponents() (or
+        ``skimage.measure.label()``): an array of non-negative integers.
+
+    :param return_areas: If set, also returns a dict with the number
+        of pixels of each label.
 
     :returns: A dict indexed by labels. The values are quadruplets
         (xmin, ymin, xmax, ymax) so that the component with the given label
         lies exactly within labels[xmin:xmax, ymin:ymax].
+        If ``return_areas`` is set, returns a tuple ``(bboxes, areas)``.
     """
+    labels = numpy.asarray(labels)
     bboxes = {}
-    for x, row in enumerate(labels):
-        for y, l in enumerate(row):
-            if l not in bboxes:
-                bboxes[l] = [x, y, x+1, y+1]
-            else:
-                box = bboxes[l]
-                if x < box[0]:
-                    box[0] = x
-                elif x + 1 > box[2]:
-                    box[2] = x + 1
-                if y < box[1]:
-                    box[1] = y
-                elif y + 1 > box[3]:
-                    box[3] = y + 1
+    areas = {}
+    if labels.size == 0:
+        if return_areas:
+            return bboxes, areas
+        return bboxes
+
+    counts = numpy.bincount(labels.ravel())
+
+    # find_objects() does not report the background label 0.
+    if counts[0] > 0:
+        background = labels == 0
+        rows = numpy.flatnonzero(background.any(axis=1))
+        cols = numpy.flatnonzero(background.any(axis=0))
+        bboxes[0] = [int(rows[0]), int(cols[0]), int(rows[-1]) + 1, int(cols[-1]) + 1]
+
+    for i, slices in enumerate(scipy.ndimage.find_objects(labels)):
+        if slices is None:
+            continue
+        row_slice, col_slice = slices
+        bboxes[i + 1] = [row_slice.start, col_slice.start,
+                         row_slice.stop, col_slice.stop]
+
+    if return_areas:
+        areas = {l: int(counts[l]) for l in bboxes}
+        return bboxes, areas
     return bboxes
 
 
-def compute_connected_components(image):
+def label_dtype(max_label):
+    """The narrowest unsigned integer dtype for a label image with the given
+    highest label. At least ``uint16``, so that there is some room for
+    the labels of new components (see ``update_connected_components()``).
+
+    >>> label_dtype(300)
+    dtype('uint16')
+    >>> label_dtype(70000)
+    dtype('uint32')
+    """
+    for dtype in ['uint16', 'uint32']:
+        if max_label <= numpy.iinfo(dtype).max:
+            return numpy.dtype(dtype)
+    return numpy.dtype('uint64')
+
+
+def labels_to_memmap(labels, path):
+    """Copies the label image into a memory-mapped file at the given path,
+    so that it does not take up memory while it is not being used.
+    Returns the memory-mapped array. Delete the file once the array
+    is not needed anymore."""
+    mapped = numpy.memmap(path, dtype=labels.dtype, mode='w+', shape=labels.shape)
+    mapped[:] = labels
+    mapped.flush()
+    return mapped
+
+
+def compute_connected_components(image, return_areas=False, labels_path=None):
+    """Labels the connected components of the nonzero pixels of the image.
+
+    The label image is stored in the narrowest dtype that fits the labels
+    (see ``label_dtype()``) rather than as ``int64``: on a full page,
+    this takes a fourth of the memory.
+
+    :param labels_path: If given, the label image is stored in
+        a memory-mapped file at this path (see ``labels_to_memmap()``).
+
+    :returns: The number of components, the label image, and the bounding
+        boxes of the labels (see ``connected_components2bboxes()``).
+        If ``return_areas`` is set, also the areas of the labels.
+    """
     labels = skimage.measure.label(image, background=0)
     cc = int(labels.max())
-    bboxes = connected_components2bboxes(labels)
+    if return_areas:
+        bboxes, areas = connected_components2bboxes(labels, return_areas=True)
+    else:
+        bboxes = connected_components2bboxes(labels)
+
+    labels = labels.astype(label_dtype(cc))
+    if labels_path is not None:
+        labels = labels_to_memmap(labels, labels_path)
+
+    if return_areas:
+        return cc, labels, bboxes, areas
     return cc, labels, bboxes
 
 
+def components_mask(labels, bboxes, selected_labels):
+    """Returns the bounding box of the given components and a mask of their
+    pixels within it. Each component is only compared against the labels
+    in its own bounding box, not in the whole combined box.
+
+    >>> labels = numpy.array([[1, 0, 2],
+    ...                       [0, 3, 0],
+    ...                       [1, 0, 0]])
+    >>> bboxes = connected_components2bboxes(labels)
+    >>> bbox, mask = components_mask(labels, bboxes, [1, 3])
+    >>> bbox
+    (0, 0, 3, 2)
+    >>> mask
+    array([[1, 0],
+           [0, 1],
+           [1, 0]], dtype=uint8)
+
+    :returns: ``(top, left, bottom, right), mask``, or ``None, None``
+        if no labels are given.
+    """
+    selected_labels = [l for l in selected_labels if l != 0]
+    if len(selected_labels) == 0:
+        return None, None
+    selected_bboxes = numpy.array([bboxes[l] for l in selected_labels])
+    t, l = selected_bboxes[:, 0].min(), selected_bboxes[:, 1].min()
+    b, r = selected_bboxes[:, 2].max(), selected_bboxes[:, 3].max()
+
+    mask = numpy.zeros((b - t, r - l), dtype='uint8')
+    for label, (c_t, c_l, c_b, c_r) in zip(selected_labels, selected_bboxes):
+        mask[c_t - t:c_b - t, c_l - l:c_r - l][labels[c_t:c_b, c_l:c_r] == label] = 1
+    return (int(t), int(l), int(b), int(r)), mask
+
+
+def update_connected_components(image, labels, bboxes, region, max_label=None):
+    """Updates the connected components of an image after the pixels
+    in the given region have changed, without labeling the whole image
+    again. The ``labels`` array and the ``bboxes`` dict (as returned by
+    ``compute_connected_components()`` for the image before the change)
+    are patched in place.
+
+    Only the components that had a pixel in the region or right next to it
+    can change (they may have been erased, split, or merged). These are
+    removed and the foreground in their bounding boxes and in the region
+    is labeled again. The other components keep their labels. The new
+    components get the labels of the removed ones first, and then labels
+    above ``max_label``.
+
+    >>> image = numpy.array([[1, 1, 0, 1, 1],
+    ...                      [0, 0, 0, 0, 0],
+    ...                      [1, 0, 0, 0, 1]])
+    >>> cc, labels, bboxes = compute_connected_components(image)
+    >>> image[0, 2] = 1
+    >>> update_connected_components(image, labels, bboxes, (0, 2, 1, 3))
+    4
+    >>> labels
+    array([[1, 1, 1, 1, 1],
+           [0, 0, 0, 0, 0],
+           [3, 0, 0, 0, 4]], dtype=uint16)
+    >>> sorted(bboxes.items())
+    [(0, [1, 0, 3, 5]), (1, [0, 0, 1, 5]), (3, [2, 0, 3, 1]), (4, [2, 4, 3, 5])]
+
+    :param image: The image after the change.
+
+    :param region: The ``(top, left, bottom, right)`` bounding box
+        of the changed pixels.
+
+    :param max_label: The highest label in use. Computed from ``bboxes``
+        if not given.
+
+    :returns: The highest label in use after the update.
+
+    :raises OverflowError: If the new labels do not fit into the dtype
+        of ``labels``. Nothing is changed then; compute the components
+        again from scratch.
+    """
+    if max_label is None:
+        max_label = max(bboxes.keys()) if len(bboxes) > 0 else 0
+    height, width = labels.shape
+
+    t, l, b, r = region
+    t, l, b, r = max(t, 0), max(l, 0), min(b, height), min(r, width)
+    if (t >= b) or (l >= r):
+        return max_label
+
+    # With 8-connectivity, components one pixel away from the region
+    # may have been connected to (or through) it.
+    e_t, e_l, e_b, e_r = max(t - 1, 0), max(l - 1, 0), min(b + 1, height), min(r + 1, width)
+    affected = numpy.unique(labels[e_t:e_b, e_l:e_r])
+    affected = affected[affected != 0]
+
+    # The window that contains the region and all the affected components.
+    w_t, w_l, w_b, w_r = e_t, e_l, e_b, e_r
+    for label in affected.tolist():
+        a_t, a_l, a_b, a_r = bboxes[label]
+        w_t, w_l, w_b, w_r = min(w_t, a_t), min(w_l, a_l), max(w_b, a_b), max(w_r, a_r)
+
+    window_labels = labels[w_t:w_b, w_l:w_r]
+    relabeled = numpy.isin(window_labels, affected)
+    relabeled[e_t - w_t:e_b - w_t, e_l - w_l:e_r - w_l] |= window_labels[e_t - w_t:e_b - w_t,
+                                                                         e_l - w_l:e_r - w_l] == 0
+    relabeled &= image[w_t:w_b, w_l:w_r] != 0
+
+    new_labels = skimage.measure.label(relabeled, background=0)
+    new_bboxes, _ = connected_components2bboxes(new_labels, return_areas=True)
+    new_bboxes.pop(0, None)
+
+    # Reuse the labels of the removed components, then go above max_label.
+    n_new = len(new_bboxes)
+    free_labels = affected.tolist()[:n_new]
+    free_labels += list(range(max_label + 1, max_label + 1 + n_new - len(free_labels)))
+    if (n_new > 0) and (free_labels[-1] > numpy.iinfo(labels.dtype).max):
+        raise OverflowError('Label {0} does not fit into the {1} label image.'
+                            ''.format(free_labels[-1], labels.dtype))
+
+    window_labels[numpy.isin(window_labels, affected)] = 0
+    for label in affected.tolist():
+        del bboxes[label]
+    label_map = numpy.zeros(n_new + 1, dtype=labels.dtype)
+    label_map[1:] = free_labels
+    window_labels[relabeled] = label_map[new_labels[relabeled]]
+    for new_label, (n_t, n_l, n_b, n_r) in new_bboxes.items():
+        bboxes[free_labels[new_label - 1]] = [n_t + w_t, n_l + w_l, n_b + w_t, n_r + w_l]
+
+    # The background bounding box only needs recomputing if its border
+    # might have moved, i.e. if it goes through the region.
+    if 0 in bboxes:
+        g_t, g_l, g_b, g_r = bboxes[0]
+        is_inside = (t > g_t) and (l > g_l) and (b < g_b) and (r < g_r)
+    else:
+        is_inside = False
+    if not is_inside:
+        background = labels == 0
+        rows = numpy.flatnonzero(background.any(axis=1))
+        cols = numpy.flatnonzero(background.any(axis=0))
+        if len(rows) > 0:
+            bboxes[0] = [int(rows[0]), int(cols[0]), int(rows[-1]) + 1, int(cols[-1]) + 1]
+        else:
+            bboxes.pop(0, None)
+
+    return max(max_label, max(free_labels) if n_new > 0 else 0)
+
+
 def image_mask_overlaps_cropobject(mask, cropobject,
                                    use_cropobject_mask=False):
     """Determines whether the given image mask overlaps the given CropObject.